@@ -1,112 +1,111 @@
 from huggingface_hub import HfApi
+import pyarrow as pa
+import pyarrow.parquet as pq
+import datetime as dt
+import argparse
+import os
+import sys
 
-import pandas as pd
-
-import re
-
-import csv
-
- 
-
-LIST_OF_COLUMNS = ['modelId', 'downloads',
-
-                   'lastModified', 'tags', 'pipeline_tag']
-
- 
-
- 
-
-hf_api = HfApi()
-
-# Get all the1 models in the list
-
-models = hf_api.list_models(
-
-    full=True, sort='lastModified', direction=-1)
-
-# Unpack all values from the generator object
-
-required_data = [i for i in models]
-
- 
-
-daata_dict = {}
-
-# Loop through the list
-
-for data in required_data:
-
-    # Loop through all the column present in the list
-
-    for key in data.__dict__.keys():
-
-        if key in LIST_OF_COLUMNS:
-
-            # Check the dictionary already contains a value for that particular column
-
-            if daata_dict.get(key) is None:
-
-                # If the column and its value is not present then insert column and an empty list pair to the dictionary
-
-                daata_dict[key] = []
-
-            # Get the value for that particular column
-
-            values = daata_dict.get(key)
-
-            if key == 'tags':
-
-                # If its tag column extract value if it is nonne then bydefault return a list with string Empty
-
-                values.append(data.__dict__.get(key, ["Empty"]))
-
-            else:
-
-                values.append(data.__dict__.get(key, "Empty"))
-
-            daata_dict[key] = values
-
+# streams the models updated in the last days from the hugging face hub and keeps the popular transformers models
+# models are listed newest first, so the listing stops as soon as it leaves the time window
+# and every model is filtered as it arrives, memory is bounded by chunk_rows and not by the size of the hub
 TASK_NAME = ['fill-mask', 'token-classification', 'question-answering',
-
              'summarization', 'text-generation', 'text-classification', 'translation']
-
 STRING_TO_CHECK = 'transformers'
 
-# Convert dictionary to the dataframe
-
-df = pd.DataFrame(daata_dict)
-
-# Find the data with the model which will be having trasnfomer tag
-
-df = df[df.tags.apply(lambda x: STRING_TO_CHECK in x)]
-
-# Retrive the data whose task is in the list
-
-df = df[df['pipeline_tag'].isin(TASK_NAME)]
-
-df['lastModified'] = pd.to_datetime(df['lastModified'], errors='coerce')
-#converting lastModified to datetime
-df['Day'] = [d.date() for d in df['lastModified']]
-#creating another coloumn Day to sort las 7 days updated models
-df['Day'] = pd.to_datetime(df['Day'], errors='coerce')
-#converting Day to datetime
-import datetime as dt
-range_max = df['Day'].max()
-range_min = range_max - dt.timedelta(days=7)
-
-#take slice with final week of data
-lastweek_updated = df[(df['Day'] >= range_min) & 
-               (df['Day'] <= range_max)]
-#filtering models updated last 7 days
-lastweek_updated_downloads = lastweek_updated[(lastweek_updated["downloads"])>=10]
-#lastweek_updated_downloads.to_csv("lastweek_updated_models_min10.csv")
-lastweek_updated_downloads_txt = lastweek_updated_downloads["modelId"]
-lastweek_updated_downloads_txt.to_csv("lastweek_updated_models_min10_downloads.csv")
-filename = "lastweek_updated_models_min10_downloads.csv"
-with open(filename, mode="w", newline="") as file:
-  writer = csv.writer(file)
-  writer.writerows(lastweek_updated_downloads_txt)
-#with open("lastweek_updated_models_min10_downloads.csv", "w", encoding="utf-8") as f:
-            #f.write(lastweek_updated_downloads_txt)
-#content = str(lastweek_updated_downloads_txt)
-#print(content, file=open('models.txt', 'w'))
+SCHEMA = pa.schema([
+    ("modelId", pa.string()),
+    ("pipeline_tag", pa.string()),
+    ("downloads", pa.int64()),
+    ("lastModified", pa.timestamp("ms", tz="UTC")),
+    ("tags", pa.list_(pa.string())),
+])
+
+parser = argparse.ArgumentParser()
+# comma separated tasks to keep
+parser.add_argument("--tasks", type=str, default=",".join(TASK_NAME))
+# library tag the models must have
+parser.add_argument("--library", type=str, default=STRING_TO_CHECK)
+# time window in days, counted back from the day of the most recently updated model
+parser.add_argument("--days", type=int, default=7)
+# minimum number of downloads
+parser.add_argument("--min_downloads", type=int, default=10)
+# number of rows buffered before they are written to parquet as a row group
+parser.add_argument("--chunk_rows", type=int, default=10000)
+# folder for the output files, the list file is the model_list_file for create_queue.py
+parser.add_argument("--output_dir", type=str, default="tests/config")
+parser.add_argument("--list_file", type=str, default="lastweek_updated_models_min10_downloads.csv")
+parser.add_argument("--parquet_file", type=str, default="lastweek_updated_models_min10_downloads.parquet")
+args = parser.parse_args()
+
+
+# function to get the last modified time of a model, older huggingface_hub versions return an iso string in lastModified
+def last_modified(model_info):
+    value = getattr(model_info, "last_modified", None) or getattr(model_info, "lastModified", None)
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    return dt.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=dt.timezone.utc)
+
+
+# function to stream the models of the time window that pass the task, library and download filters
+def stream_models(hf_api, tasks, library, days, min_downloads):
+    range_min = None
+    scanned = 0
+    for model_info in hf_api.list_models(full=True, sort='lastModified', direction=-1):
+        scanned = scanned + 1
+        modified = last_modified(model_info)
+        if modified is None:
+            continue
+        # the window is counted in days back from the most recently updated model, which comes first
+        if range_min is None:
+            range_min = modified.date() - dt.timedelta(days=days)
+        if modified.date() < range_min:
+            break
+        tags = getattr(model_info, "tags", None) or []
+        if library not in tags or getattr(model_info, "pipeline_tag", None) not in tasks:
+            continue
+        if (getattr(model_info, "downloads", None) or 0) < min_downloads:
+            continue
+        yield {
+            "modelId": getattr(model_info, "id", None) or getattr(model_info, "modelId", None),
+            "pipeline_tag": model_info.pipeline_tag,
+            "downloads": model_info.downloads,
+            "lastModified": modified,
+            "tags": list(tags),
+        }
+    print (f"Scanned {scanned} models updated since {range_min}")
+
+
+def write_chunk(writer, rows):
+    writer.write_table(pa.Table.from_pylist(rows, schema=SCHEMA))
+
+
+def main():
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    list_file = os.path.join(args.output_dir, args.list_file)
+    parquet_file = os.path.join(args.output_dir, args.parquet_file)
+    hf_api = HfApi()
+    counter = 0
+    rows = []
+    # write to temp files and rename at the end, so a failed run never leaves a partial list for the queue builder
+    with open(f"{list_file}.tmp", "w") as f, pq.ParquetWriter(f"{parquet_file}.tmp", SCHEMA) as writer:
+        for row in stream_models(hf_api, args.tasks.split(","), args.library, args.days, args.min_downloads):
+            # one model id per line, the format load_model_list_file expects
+            f.write(row["modelId"] + "\n")
+            rows.append(row)
+            counter = counter + 1
+            if len(rows) >= args.chunk_rows:
+                write_chunk(writer, rows)
+                rows = []
+                sys.stdout.write(f'{counter}\r')
+                sys.stdout.flush()
+        if rows:
+            write_chunk(writer, rows)
+    os.replace(f"{list_file}.tmp", list_file)
+    os.replace(f"{parquet_file}.tmp", parquet_file)
+    print (f"Wrote {counter} models to {list_file} and {parquet_file}")
+
+
+if __name__ == "__main__":
+    main()
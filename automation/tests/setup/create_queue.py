@@ -1,6 +1,6 @@
 from azure.ai.ml import MLClient
 from azure.identity import DefaultAzureCredential
-import time, sys
+import time
 from azure.ai.ml.entities import (
     ManagedOnlineEndpoint,
     ManagedOnlineDeployment,
@@ -9,11 +9,11 @@ from azure.ai.ml.entities import (
 import json
 import os
 import argparse
-import sys
 from util import load_model_list_file, get_model_containers
+from workflow_renderer import parse_workflow_template, workflow_values, workflow_file_name, write_workflow_files, DEFAULT_WRITERS
+from workflow_manifest import manifest_file_name, sync_workflow_files
 from pathlib import Path
 import yaml
-import requests
 import textwrap
 # from github import Github
 
@@ -50,6 +50,11 @@ parser.add_argument("--test_sku_type", type=str, default="cpu")
 parser.add_argument("--parallel_tests", type=int, default=5)
 # workflow-template.yml file to use as template for generating workflow files
 parser.add_argument("--workflow_template", type=str, default="../config/workflow-template-huggingface.yml")
+# number of threads used to write workflow files
+parser.add_argument("--workflow_writers", type=int, default=DEFAULT_WRITERS)
+# incremental, to only write workflow files that changed since the last run and delete the ones for removed models
+# uses a manifest of workflow file hashes stored next to the queue set as <queue_dir>/<test_set>.manifest.json
+parser.add_argument("--incremental", type=str, default="true")
 # workspace_list file get workspace metadata
 parser.add_argument("--workspace_list", type=str, default="../config/workspaces.json")
 # directory to write logs
@@ -205,196 +210,25 @@ def assign_models_to_queues(models, workspace_list):
                     return queue
 # function to create workflow files
 # !!! any existing workflow files in workflow_dir will be overwritten. backup... !!!
+# the template is parsed once and every workflow is rendered in memory, then written by a bounded pool of writer threads
 def create_workflow_files(q,workspace_list):
-    counter=0
     print (f"Creating workflow files")
-    # check if workflow_dir exists
-    if not os.path.exists(args.workflow_dir):
-        os.makedirs(args.workflow_dir)
-    # generate workflow files
+    template = parse_workflow_template(args.workflow_template)
+    workflows = []
     for workspace in q:
-        print("entered q loop:",workspace)
         for thread in q[workspace]:
-            print("entered q of workspace loop:",thread)
             for model in q[workspace][thread]:
-                # for model in models:
-                print("entered q of workspace of thread loop:",model)
-                # print("entered model of workspace of thread loop:",workflownames)
-                write_single_workflow_file(model,f"{workspace}-{thread}", workspace_list[workspace]['secret_name'])
-                # print progress
-                counter=counter+1
-                print("counter:",counter)
-                sys.stdout.write(f'{counter}\r')
-                sys.stdout.flush()
-    print (f"\nCreated {counter} workflow files")
-# function to write a single workflow file
-def write_single_workflow_file(model, q, secret_name):
-    # print a single dot without a newline to show progress
-    print (".", end="", flush=True)
-    workflowname=model.replace('/','-')
-    # os.system(f"sed -i 's/name: .*/name: {model}/g' {args.workflow_template}")
-    workflow_file=f"{args.workflow_dir}/{workflowname}.yml"
-    os.system(f"rm -rf {args.workflow_dir}/demo_{workflowname}.yml") 
-    # print("yml file----------------------------------------",workflow_file)
-    # # print(workflow_file['env']['test_queue'])
-    print (f"Generating workflow file: {workflow_file}")
-    os.system(f"cp {args.workflow_template} {workflow_file}")
-    # # name=str(model)
-    # # print("name:---------------------",name)
-    # print("model:--------------------",model)
-    # print("workflowname:-------------",workflowname)
-    os.system(f"sed -i s/name: .*/name: {model}/g' {workflow_file}")
-    # replace <test_queue> with q
-    os.system(f"sed -i 's/test_queue: .*/test_queue: {q}/g' {workflow_file}")
-    # os.system(f"sed -i 's/test-norwayeast-02/{q}/g' {workflow_file}")
-    # replace <test_sku_type> with test_sku_type in workflow_file
-    os.system(f"sed -i 's/test_sku_type: .*/test_sku_type: {args.test_sku_type}/g' {workflow_file}")
-    # replace <test_registry> with test_registry in workflow_file
-    os.system(f"sed -i 's/test_trigger_next_model: .*/test_trigger_next_model: {args.test_trigger_next_model}/g' {workflow_file}")
-    # replace <test_keep_looping> with test_keep_looping in workflow_file
-    os.system(f"sed -i 's/test_keep_looping: .*/test_keep_looping: {args.test_keep_looping}/g' {workflow_file}")
-    # replace <test_model_name> with model_container.name in workflow_file
-    os.system(f"sed -i 's=test_model_name: .*=test_model_name: {model}=g' {workflow_file}")
-    # replace <test_set> with test_set in workflow_file
-    os.system(f"sed -i 's/test_set: .*/test_set: {args.test_set}/g' {workflow_file}")
-    # replace <test_secret_name> 
-    os.system(f"sed -i 's/test_secret_name: .*/test_secret_name: {secret_name}/g' {workflow_file}")
-    # # Read in the file
-
-    # github_token="GITHUB_TOKEN"
-    repository_owner="Konjarla-Vindya"
-    repository_name="son-azureml-oss-models"
-    workflow_filename=f".github/workflows/{workflowname}.yml"
-    # workflow_sha="main"  # You need to provide the correct SHA
-    new_workflow_name={model}
-    new_job_name={model}
-
-    # Construct the API URL
-    api_url = f"https://api.github.com/repositories/655633575/contents/{workflow_filename}"
-    print("api url is genrating:--------------------",api_url)
-    print("type of api_url=============",type(api_url))
-    print("type of workflow_file=============",type(workflow_file))
-
-    github_token = os.environ.get("GITHUB_TOKEN")
-    # print("github_token: is ------------------------------------",github_token)
-   
-    # Prepare the request headers
-    headers = {
-        "Authorization": f"Bearer {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    print("header---------------------",headers)
-    # Make the GET request
-    response = requests.get(api_url, headers=headers)
-    print("response is genrating:--------------------",response)
-    
-    if response.status_code == 200:
-        file_info = response.json()
-        file_sha = file_info["sha"]
-        print(f"SHA of '{workflow_filename}': {file_sha}")
-    else:
-        print(f"Failed to fetch file info. Status code: {response.status_code}")
-
-    # Prepare the request headers
-    # headers = {
-    #     "Authorization": f"Bearer {github_token}",
-    #     "Accept": "application/vnd.github.v3+json"
-    # }
-    
-    # # Fetch the existing workflow data
-    # response = requests.get(api_url, headers=headers)
-    # workflow_data = response.json()
-    
-    # # Update the friendly name in the workflow data
-    # workflow_data["name"] = new_job_name
-    # print("workflow_data----------------",workflow_data)
-    # workflow_data["on"]["push"]["branches"] = list(workflow_data["on"]["push"]["branches"])
-    
-    # # Update the workflow using a PUT request
-    # update_response = requests.put(api_url, headers=headers, json=workflow_data)
-    
-    # if update_response.status_code == 200:
-    #     print("Friendly name updated successfully!")
-    # else:
-    #     print(f"Failed to update friendly name. Status code: {update_response.status_code}")
-
-
-    # workflow_sha=file_sha
-    # # Get the latest commit information for the workflow file
-    # commit_info=$(curl -s -H "Authorization: Bearer $github_token" -H "Accept: application/vnd.github.v3+json" \
-    #                "https://api.github.com/repos/$repository_owner/$repository_name/commits?path=$workflow_file")
-    
-    
-    # # Read the current workflow content from GitHub
-    # current_content=$(curl -s -H "Authorization: Bearer $github_token" -H "Accept: application/vnd.github.v3+json" \
-    #                   "https://api.github.com/repos/$repository_owner/$repository_name/contents/$workflow_file?ref=$workflow_sha")
-    # # Extract the current content, URL, and other attributes
-    # current_content=$(echo "$current_content" | jq -r .content)
-    # current_url=$(echo "$current_content" | jq -r .url)
-    # current_encoding=$(echo "$current_content" | jq -r .encoding)
-    
-    # # Prepare the updated content with new names
-    # updated_content=$(echo -n "$current_content" | base64 -d | \
-    #                   sed "s/Old Workflow Name/$new_workflow_name/g; s/Old Job Name/$new_job_name/g")
-    
-    # # Encode the updated content in base64
-    # encoded_updated_content=$(echo -n "$updated_content" | base64 -w 0)
-    
-    # # Prepare the JSON payload for updating the content
-    # json_payload="{\"message\":\"Update workflow names\",\"content\":\"$encoded_updated_content\",\"sha\":\"$workflow_sha\"}"
-    
-    # # Make the PATCH request to update the workflow file
-    # curl -X PUT -H "Authorization: Bearer $github_token" -H "Accept: application/vnd.github.v3+json" \
-    #      -d "$json_payload" "$current_url"
-
-    with open(workflow_file, 'rt') as f:
-        yaml_content = f.read()
-        # yaml_content=yaml.safe_load(f)
-    
-    updated_yaml_content = yaml_content.replace("distl", model)
-    yml_content='"""'+'\n'+updated_yaml_content+'\n'+'"""'
-    print("updated_yaml_content-----------------------",yml_content)
-    modified_yaml_content = yml_content.replace('"""', '')
-    with open(workflow_file, 'w') as yaml_file:
-        yaml_file.write(updated_yaml_content)
-    #     # yaml.dump(updated_yaml_content,yaml_file)
-    # with open(api_url, 'rt') as f:
-    #     doc = yaml.safe_load(f)
-    #     # ,Loader=yaml.FullLoader
-    
-    # doc['name'] = model
-    # # doc['onion']['workflow_dispatch']=
-    # # for model in models:
-    # doc['env']['test_model_name'] = model
-    # doc['env']['test_sku_type'] = args.test_sku_type
-    # doc['env']['test_trigger_next_model'] = args.test_trigger_next_model
-    # doc['env']['test_queue'] = q
-    # doc['env']['test_set'] = args.test_set
-    # doc['env']['test_queue'] = q
-    # print("post change of dict------------",doc)
-    # # doc.replace('true:','on:')
-    # # os.system(f"sed -i 's/true: .*/on: .*/g' {workflow_file}")
-    # with open(workflow_file, 'w') as f:
-    #    yml= yaml.dump(doc, f, default_flow_style=False, sort_keys=False,width=float("inf"))
-    #     # yml=yaml.dump(doc, f, default_flow_style=True, sort_keys=False,width=float("inf"))
-    #     # yaml.dump(doc, f, default_flow_style=True,width=float("inf"))
-    # workflow_filecopy=f"{args.workflow_dir}/suchitest{workflowname}.yml"
-    # os.system(f"cp {workflow_file} {workflow_filecopy}")
-    # # os.system(f"rm -rf {workflow_file}")
-    # # g=Github()
-    # # print("g.workflow(workflow_file)====================",g.workflow(workflow_file))
-    # # print("github.workflow()============================",github.workflow(workflow_file))
+                values = workflow_values(model, f"{workspace}-{thread}", workspace_list[workspace]['secret_name'], args.test_set, args.test_sku_type, args.test_trigger_next_model, args.test_keep_looping)
+                workflows.append((workflow_file_name(model), values))
+    if args.incremental == "true":
+        report = sync_workflow_files(template, workflows, args.workflow_dir, manifest_file_name(args.queue_dir, args.test_set), args.workflow_writers)
+        print (f"\nWorkflow files: {report['added']} added, {report['changed']} changed, {report['removed']} removed, {report['unchanged']} unchanged in {report['elapsed']:.2f}s")
+        return report
+    counter, elapsed = write_workflow_files(template, workflows, args.workflow_dir, args.workflow_writers)
+    print (f"\nCreated {counter} workflow files in {elapsed:.2f}s ({counter/max(elapsed, 1e-6):.0f} files/s)")
+    return {"added": counter, "changed": 0, "removed": 0, "unchanged": 0}
 def workflow_names(models):
-    workflownames=[]
-    j=1
-    while j < len(models):
-        for names in models:
-            workflow_modelname=names.replace('/','-')
-            # print(f"workflow_modelname: {workflow_modelname}")
-            # print("beforeworkflow names",workflownames)
-            workflownames.append(workflow_modelname)
-            # print("in loop workflow names",workflownames)
-        j=j+1
+    workflownames=[names.replace('/','-') for names in models]
     print("out of loop workflow names:",workflownames)
     return workflownames
 def main():
@@ -426,7 +260,7 @@ def main():
     create_queue_files(queue, workspace_list)
     print (f"Created queue files")
     # create workflow files
-    create_workflow_files(q, workspace_list)
+    report = create_workflow_files(q, workspace_list)
     print (f"Created workflow files")
     print (f"Summary:")
     print (f"  Models: {len(models)}")
@@ -434,6 +268,7 @@ def main():
     print (f"  Parallel tests: {parallel_tests}")
     print (f"  Total queues: {len(workspace_list)*parallel_tests}")
     print (f"  Average models per queue: {int(len(models)/(len(workspace_list)*parallel_tests))}")
+    print (f"  Workflow files added: {report['added']}, changed: {report['changed']}, removed: {report['removed']}")
 
         
 if __name__ == "__main__":
@@ -175,7 +175,8 @@ if __name__ == "__main__":
            "resource_group": queue.resource_group,
            "workspace": queue.workspace
            }
-    command_job = run_azure_ml_job(code="./", command_to_run="python generic_model_download_and_register.py", environment="automate-venv:3", compute="Standard-DS3-v2", environment_variables=environment_variables)
+    # upload automation/tests/src so that the job can import the shared hf_model_info.py, and run from this folder as before
+    command_job = run_azure_ml_job(code="../", command_to_run="cd HF_Import_Deploy && python generic_model_download_and_register.py", environment="automate-venv:3", compute="Standard-DS3-v2", environment_variables=environment_variables)
     create_and_get_job_studio_url(command_job, workspace_ml_client)
 
 
@@ -3,24 +3,19 @@ import transformers
 #from azureml.core import Workspace
 #from azureml.core import Workspace
 #from azureml.mlflow import get_mlflow_tracking_uri
-from urllib.request import urlopen
 from box import ConfigBox
-from mlflow.models import infer_signature
-from mlflow.transformers import generate_signature_output
-from transformers import pipeline
-import pandas as pd
 import os 
 import mlflow
-import re
+import sys
+# hf_model_info.py is shared by the scripts in automation/tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hf_model_info import HfModelInfoClient
+from snapshot_cache import SnapshotCache
+from signature_stage import build_pipeline, get_signature
 
   
 # import json
 import json
-# store the URL in url as 
-# parameter for urlopen
-url = "https://huggingface.co/api/models"
-columns_to_read = ["modelId","pipeline_tag","tags"]
-string_to_check = 'transformers'
 
 test_model_name = os.environ.get('test_model_name')
 subscription = os.environ.get('subscription')
@@ -31,16 +26,9 @@ class Model:
     def __init__(self, model_name) -> None:
         self.model_name = model_name
     
-    def get_task_and_sample_data(self) -> pd.DataFrame:
-        response = urlopen(url)
-        data_json = json.loads(response.read())
-        df = pd.DataFrame(data_json, columns=columns_to_read)
-        df = df[df.tags.apply(lambda x: string_to_check in x)]
-        required_data = df[df.modelId.apply(lambda x: x == self.model_name)]
-        required_data = required_data["pipeline_tag"].to_string()
-        pattern = r'[0-9\s+]'
-        final_data = re.sub(pattern, '', required_data)
-        return final_data
+    # gets the task of this model only, empty if it is not a transformers model
+    def get_task_and_sample_data(self) -> str:
+        return HfModelInfoClient().get_task(self.model_name)
     
     def get_sample_input_data(self):
         final_data = self.get_task_and_sample_data()
@@ -57,12 +45,14 @@ class Model:
         
         return scoring_input, task
 
+    # the config, model and tokenizer are read from one cached snapshot of the model
     def download_model_and_tokenizer(self)->dict:
-        model_detail = AutoConfig.from_pretrained(self.model_name)
+        snapshot_cache = SnapshotCache()
+        model_detail = snapshot_cache.from_pretrained(AutoConfig, self.model_name)
         model_library_name = model_detail.to_dict()["architectures"][0]
         model_library = getattr(transformers, model_library_name)
-        model = model_library.from_pretrained(self.model_name)
-        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = snapshot_cache.from_pretrained(model_library, self.model_name)
+        tokenizer = snapshot_cache.from_pretrained(AutoTokenizer, self.model_name)
         # config = AutoConfig.from_pretrained(self.model_name)
         # config_dict = config.to_dict()
         # task_dict = config_dict["task_specific_params"]
@@ -73,9 +63,10 @@ class Model:
     
     def register_model_in_workspace(self, model_and_tokenizer, sample_data, task):
         #task = self.queue.models[self.model_name].task
-        model_pipeline = transformers.pipeline(task=task, model=self.model_name)
-        output = generate_signature_output(model_pipeline, sample_data.inputs)
-        signature = infer_signature(sample_data.inputs, output)
+        # build the pipeline from the model and tokenizer that are already loaded instead of loading the weights again
+        model_pipeline = build_pipeline(task, model_and_tokenizer)
+        # cached per task, or from the pipeline output or the sample inputs depending on test_signature_mode
+        signature = get_signature(task, sample_data.inputs, model_pipeline)
         artifact_path = self.model_name + "-artifact"
         registered_model_name = self.model_name
         # mlflow.set_tracking_uri(ws.get_mlflow_tracking_uri())
@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+import transformers
+from mlflow.models import infer_signature, ModelSignature
+from mlflow.types.schema import Schema, ColSpec
+from mlflow.transformers import generate_signature_output
+
+# builds the mlflow signature of a model for the register scripts without loading the model a second time
+# the pipeline is built from the model and tokenizer that were already loaded for logging the model
+# signature_mode inference runs the sample inputs through the pipeline, schema derives the signature from the
+# sample inputs and the output type of the task without running the model
+# signatures only depend on the task and the shape of the sample inputs, so they are cached per task and shared by all models
+DEFAULT_SIGNATURE_MODE = os.environ.get("test_signature_mode", "inference")
+DEFAULT_CACHE_FILE = os.environ.get("signature_cache_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "signature_cache.json"))
+# output columns of the mlflow transformers pyfunc flavor by task, a column without a name is a plain string output
+# tasks that are not listed, such as token-classification, question-answering and fill-mask, return dicts whose
+# schema is not derived here, their signature is inferred from the pipeline output also in schema mode
+TASK_OUTPUTS = {
+    "text-classification": [("string", "label"), ("double", "score")],
+    "text-generation": [("string", None)],
+    "text2text-generation": [("string", None)],
+    "summarization": [("string", None)],
+    "translation": [("string", None)],
+}
+
+
+# function to build the pipeline of a task from the loaded model and tokenizer instead of the model name
+def build_pipeline(task, model_and_tokenizer):
+    return transformers.pipeline(task=task, model=model_and_tokenizer["model"], tokenizer=model_and_tokenizer["tokenizer"])
+
+
+# function to describe the shape of sample inputs, the types and keys of the values without the text itself
+def input_shape(data):
+    if isinstance(data, dict):
+        return {key: input_shape(value) for key, value in sorted(data.items())}
+    if isinstance(data, (list, tuple)):
+        return [input_shape(data[0])] if data else []
+    return type(data).__name__
+
+
+# function to derive a signature from the sample inputs and the output type of the task, without running the model
+def schema_signature(task, data):
+    outputs = Schema([ColSpec(column_type, name) for column_type, name in TASK_OUTPUTS[task]] if task in TASK_OUTPUTS else [ColSpec("string")])
+    return ModelSignature(inputs=infer_signature(data).inputs, outputs=outputs)
+
+
+class SignatureCache:
+    # signatures of all caches in this process, keyed by task and input shape
+    memory = {}
+    lock = threading.Lock()
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+
+    def key(self, task, data):
+        return f"{task}:{json.dumps(input_shape(data), sort_keys=True)}"
+
+    def load_disk_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except Exception as e:
+            print (f"::warning:: Could not read signature cache {self.cache_file}: \n{e}")
+            return {}
+
+    def get(self, task, data):
+        key = self.key(task, data)
+        if key in self.memory:
+            return self.memory[key]
+        entry = self.load_disk_cache().get(key)
+        if entry is None:
+            return None
+        self.memory[key] = ModelSignature.from_dict(entry)
+        return self.memory[key]
+
+    def put(self, task, data, signature):
+        key = self.key(task, data)
+        self.memory[key] = signature
+        if not self.cache_file:
+            return
+        with self.lock:
+            cache = self.load_disk_cache()
+            cache[key] = signature.to_dict()
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=4, sort_keys=True)
+            os.replace(tmp_file, self.cache_file)
+
+
+# function to get the signature of a model for the sample inputs of its task
+# a cached signature of the task is used first, then the pipeline is run on the inputs unless signature_mode is schema
+def get_signature(task, data, model_pipeline=None, signature_mode=DEFAULT_SIGNATURE_MODE, cache=None):
+    cache = cache or SignatureCache()
+    signature = cache.get(task, data)
+    if signature is not None:
+        print (f"Using cached signature of task {task}")
+        return signature
+    if model_pipeline is None or (signature_mode == "schema" and task in TASK_OUTPUTS):
+        signature = schema_signature(task, data)
+    else:
+        if signature_mode == "schema":
+            print (f"No output schema for task {task}, inferring the signature from the pipeline output")
+        # Generate the transformer model output for that particular model
+        output = generate_signature_output(model_pipeline, data)
+        # It will infer the signature directly from input and output
+        signature = infer_signature(data, output)
+    cache.put(task, data, signature)
+    return signature
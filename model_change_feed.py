@@ -0,0 +1,109 @@
+from huggingface_hub import HfApi
+import datetime as dt
+import argparse
+import json
+import os
+import sys
+
+# change feed of the hugging face models that were added or updated since the previous run
+# the state file keeps the last modified watermark of the previous run and the last seen commit sha of every model
+# a run lists models newest first, stops at the watermark and only emits models that are new or have a new sha
+# the delta list is a model_list_file for create_queue.py --mode file, so only what changed is tested again
+TASK_NAME = ['fill-mask', 'token-classification', 'question-answering',
+             'summarization', 'text-generation', 'text-classification', 'translation']
+STRING_TO_CHECK = 'transformers'
+
+parser = argparse.ArgumentParser()
+# comma separated tasks to keep
+parser.add_argument("--tasks", type=str, default=",".join(TASK_NAME))
+# library tag the models must have
+parser.add_argument("--library", type=str, default=STRING_TO_CHECK)
+# minimum number of downloads
+parser.add_argument("--min_downloads", type=int, default=10)
+# time window in days for the first run, when there is no watermark yet, counted back from the most recently updated model
+parser.add_argument("--days", type=int, default=7)
+# state file with the watermark and the sha of every model seen, committed with the delta list so the next run continues from it
+parser.add_argument("--state_file", type=str, default="tests/config/model_change_feed_state.json")
+# delta list, one model id per line, the model_list_file for create_queue.py
+parser.add_argument("--delta_file", type=str, default="tests/config/updated_models_delta.txt")
+args = parser.parse_args()
+
+
+# function to get the last modified time of a model, older huggingface_hub versions return an iso string in lastModified
+def last_modified(model_info):
+    value = getattr(model_info, "last_modified", None) or getattr(model_info, "lastModified", None)
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    return dt.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=dt.timezone.utc)
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {"watermark": None, "models": {}}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+# function to write a file through a temp file and a rename, so a failed run never leaves a partial file
+def write_atomic(file_name, content):
+    file_dir = os.path.dirname(file_name)
+    if file_dir and not os.path.exists(file_dir):
+        os.makedirs(file_dir)
+    with open(f"{file_name}.tmp", "w") as f:
+        f.write(content)
+    os.replace(f"{file_name}.tmp", file_name)
+
+
+# function to stream the models that changed since the watermark and pass the task, library and download filters
+# models modified exactly at the watermark are listed again and dropped by their sha if they were already seen
+def stream_changes(hf_api, state, tasks, library, min_downloads, days):
+    watermark = dt.datetime.fromisoformat(state["watermark"]) if state["watermark"] else None
+    range_min = None
+    scanned = 0
+    for model_info in hf_api.list_models(full=True, sort='lastModified', direction=-1):
+        scanned = scanned + 1
+        modified = last_modified(model_info)
+        if modified is None:
+            continue
+        # the first item is the most recently updated model, it becomes the next watermark
+        if range_min is None:
+            range_min = watermark or modified - dt.timedelta(days=days)
+            state["next_watermark"] = modified.isoformat()
+        if modified < range_min:
+            break
+        tags = getattr(model_info, "tags", None) or []
+        if library not in tags or getattr(model_info, "pipeline_tag", None) not in tasks:
+            continue
+        if (getattr(model_info, "downloads", None) or 0) < min_downloads:
+            continue
+        model_id = getattr(model_info, "id", None) or getattr(model_info, "modelId", None)
+        sha = getattr(model_info, "sha", None)
+        # a model with the same revision as last time was touched without a new commit, nothing to test
+        if sha is not None and state["models"].get(model_id) == sha:
+            continue
+        yield model_id, sha
+    print (f"\nScanned {scanned} models updated since {range_min}")
+
+
+def main():
+    hf_api = HfApi()
+    state = load_state(args.state_file)
+    print (f"Reading changes since watermark {state['watermark']}, {len(state['models'])} models seen before")
+    delta = []
+    new = 0
+    for model_id, sha in stream_changes(hf_api, state, args.tasks.split(","), args.library, args.min_downloads, args.days):
+        if model_id not in state["models"]:
+            new = new + 1
+        state["models"][model_id] = sha
+        delta.append(model_id)
+        sys.stdout.write(f'{len(delta)}\r')
+        sys.stdout.flush()
+    # the listing reached the watermark, so the state can move forward
+    state["watermark"] = state.pop("next_watermark", None) or state["watermark"]
+    write_atomic(args.delta_file, "".join(model_id + "\n" for model_id in delta))
+    write_atomic(args.state_file, json.dumps(state, indent=1, sort_keys=True))
+    print (f"Wrote {len(delta)} changed models ({new} new, {len(delta) - new} updated) to {args.delta_file}, watermark {state['watermark']}")
+
+
+if __name__ == "__main__":
+    main()
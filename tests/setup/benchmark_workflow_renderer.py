@@ -0,0 +1,45 @@
+import argparse
+import shutil
+import tempfile
+from workflow_renderer import parse_workflow_template, workflow_values, workflow_file_name, write_workflow_files, DEFAULT_WRITERS
+
+# benchmark for workflow_renderer.py, reports files per second for generating workflow files
+# does not need azure access, models are synthetic and files are written to a temp dir
+parser = argparse.ArgumentParser()
+# workflow-template.yml file to render
+parser.add_argument("--workflow_template", type=str, default="../config/workflow-template-huggingface.yml")
+# comma separated list of model counts to benchmark
+parser.add_argument("--model_counts", type=str, default="1000,10000")
+# number of threads used to write workflow files
+parser.add_argument("--workflow_writers", type=int, default=DEFAULT_WRITERS)
+# number of queues to spread the synthetic models over
+parser.add_argument("--queues", type=int, default=90)
+args = parser.parse_args()
+
+
+def synthetic_workflows(count):
+    workflows = []
+    for i in range(count):
+        model = f"MLFlow-org-{i % 97}/model-{i}"
+        values = workflow_values(model, f"test-bench-{i % args.queues}", "AZURE_CREDENTIALS", "huggingface-bench", "cpu", "true", "false")
+        workflows.append((workflow_file_name(model), values))
+    return workflows
+
+
+def main():
+    template = parse_workflow_template(args.workflow_template)
+    print (f"Template fields: {sorted(key for _, key in template['fields'].values())}")
+    print ("Models|Files|Seconds|Files/s")
+    print ("------|-----|-------|-------")
+    for count in [int(c) for c in args.model_counts.split(",")]:
+        workflows = synthetic_workflows(count)
+        workflow_dir = tempfile.mkdtemp(prefix="workflow-bench-")
+        try:
+            written, elapsed = write_workflow_files(template, workflows, workflow_dir, args.workflow_writers)
+        finally:
+            shutil.rmtree(workflow_dir)
+        print (f"{count}|{written}|{elapsed:.2f}|{written/max(elapsed, 1e-6):.0f}")
+
+
+if __name__ == "__main__":
+    main()
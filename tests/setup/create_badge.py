@@ -15,19 +15,29 @@ from azure.ai.ml.entities import (
 import json
 import os
 import argparse
+from registry_catalog import load_catalog_models
 
 # argument, markdown file name
 parser = argparse.ArgumentParser()
 parser.add_argument("--markdown_file", type=str, default="../../dashboard/HuggingFace/README.md")
 # argument, models list json, logged by create_queue.py
 parser.add_argument("--models_list_json", type=str, default="../logs/get_model_containers/17May2023-231031.json")
+# argument, mode_model to read models from models_list_json (file) or from the local registry catalog (catalog)
+parser.add_argument("--mode_model", type=str, default="file")
+# argument, registry and catalog file for mode_model catalog, see registry_catalog.py
+parser.add_argument("--registry_name", type=str, default="HuggingFace")
+parser.add_argument("--catalog_db", type=str, default="")
+parser.add_argument("--catalog_refresh", type=str, default="false")
 args = parser.parse_args()
 
 templates=['transformers-cpu-small', 'transformers-cpu-medium', 'transformers-cpu-large','transformers-cpu-extra-large', 'transformers-gpu-medium']
 
 # read models_list_json file into a list
-with open(args.models_list_json) as f:
-    model_containers = json.load(f)
+if args.mode_model == "catalog":
+    model_containers = load_catalog_models(args.registry_name, args.catalog_db, args.catalog_refresh == "true", templates=templates)
+else:
+    with open(args.models_list_json) as f:
+        model_containers = json.load(f)
 
 lines=[]
 i=0  
@@ -1,6 +1,6 @@
 from azure.ai.ml import MLClient
 from azure.identity import DefaultAzureCredential
-import time, sys
+import time
 from azure.ai.ml.entities import (
     ManagedOnlineEndpoint,
     ManagedOnlineDeployment,
@@ -9,21 +9,28 @@ from azure.ai.ml.entities import (
 import json
 import os
 import argparse
-import sys
 from util import load_model_list_file, get_model_containers
+from registry_catalog import load_catalog_models
+from workflow_renderer import parse_workflow_template, workflow_values, is_github_hosted, workflow_file_name, queue_workflow_values, queue_workflow_file_name, write_workflow_files, DEFAULT_WRITERS, MATRIX_MAX_JOBS
+from workflow_manifest import manifest_file_name, sync_workflow_files
+from queue_balancer import load_durations, predict_durations, assign_longest_processing_time_first, print_makespan, load_capacities, workspace_threads
+from queue_enrichment import enrich_models, load_sku_override, DEFAULT_ENRICH_WORKERS
 from pathlib import Path
 import yaml
-import requests
 import textwrap
 # from github import Github
 # constants
 LOG = True
 # parse command line argument to specify the directory to write the workflow files to
 parser = argparse.ArgumentParser()
-# mode - options are file or registry
+# mode - options are file, registry or catalog. catalog reads the models from the local registry catalog, see registry_catalog.py
 parser.add_argument("--mode", type=str, default="file")
 # registry name if model is in registry
 parser.add_argument("--registry_name", type=str, default="HuggingFace")
+# catalog file for catalog mode, defaults to ../logs/registry_catalog/<registry_name>.db
+parser.add_argument("--catalog_db", type=str, default="")
+# catalog_refresh, to fetch new and changed models from the registry into the catalog before reading it
+parser.add_argument("--catalog_refresh", type=str, default="true")
 # argument to specify Github workflow directory. can write to local dir for testing
 # !!! main workflow files will be overwritten if set to "../../.github/workflows" !!!
 parser.add_argument("--workflow_dir", type=str, default="../../.github/workflows")
@@ -40,11 +47,49 @@ parser.add_argument("--test_keep_looping", type=str, default="false")
 parser.add_argument("--test_trigger_next_model", type=str, default="true")
 # test_sku_type, to specify sku type to use for testing
 parser.add_argument("--test_sku_type", type=str, default="cpu")
+# test_dispatcher_db, path to the shared work queue database of ../src/dispatcher.py. when set, each workflow claims
+# its next model from the dispatcher instead of the next model in its queue file, so idle queues steal from busy ones
+parser.add_argument("--test_dispatcher_db", type=str, default="")
+# test_dispatcher_shared, true when test_dispatcher_db is on a share that every runner mounts. on github hosted runners
+# every workflow run starts on a new machine, so test_dispatcher_db is refused there unless it is shared
+parser.add_argument("--test_dispatcher_shared", type=str, default="false")
+# test_batch_size, number of consecutive models of a queue that the constant library automation registers in one job
+# the queue file lists the batches, and only the first model of each batch gets a workflow
+parser.add_argument("--test_batch_size", type=int, default=1)
+# test_runs_on, runner label of the model workflows, for example the label of a self-hosted runner for test_dispatcher_db
+parser.add_argument("--test_runs_on", type=str, default="ubuntu-latest")
+# test_endpoint_pool_db, path to the database of the warm endpoint pool of ../src/endpoint_pool.py. when set, each model
+# is deployed to an endpoint leased from the pool of its workspace instead of a new endpoint that is deleted afterwards
+parser.add_argument("--test_endpoint_pool_db", type=str, default="")
 # parallel_tests, to specify number of parallel tests to run per workspace. 
 # this will be used to create multiple queues
 parser.add_argument("--parallel_tests", type=int, default=3)
+# assignment, how models are assigned to queues. options are round_robin or lpt (longest processing time first)
+parser.add_argument("--assignment", type=str, default="round_robin")
+# durations_file, results_per_model json dumped by test_status_v2.py with historical durations per model, used by lpt
+parser.add_argument("--durations_file", type=str, default="")
 # workflow-template.yml file to use as template for generating workflow files
 parser.add_argument("--workflow_template", type=str, default="../config/workflow-template-huggingface.yml")
+# layout of the generated workflows. options are model (one workflow per model) or matrix (one workflow per queue,
+# with one matrix job per model read from the queue file)
+parser.add_argument("--layout", type=str, default="model")
+# workflow template used for the matrix layout
+parser.add_argument("--matrix_workflow_template", type=str, default="../config/workflow-template-huggingface-matrix.yml")
+# number of threads used to write workflow files
+parser.add_argument("--workflow_writers", type=int, default=DEFAULT_WRITERS)
+# incremental, to only write workflow files that changed since the last run and delete the ones for removed models
+# uses a manifest of workflow file hashes stored next to the queue set as <queue_dir>/<test_set>.manifest.json
+parser.add_argument("--incremental", type=str, default="true")
+# capacity_file, usage snapshot json with the free capacity of each workspace, for example from 'az ml compute list-usage'
+# queues per workspace are sized to capacity, see load_capacities in queue_balancer.py. capacity can also be set in workspace_list
+parser.add_argument("--capacity_file", type=str, default="")
+# enrich, to resolve the task, transformers class, parameter count and instance type of every model when the queue is created
+# the results are written to the queue files under models_info, so that the per-model jobs do not look them up again
+parser.add_argument("--enrich", type=str, default="true")
+# number of threads used to look up models on the hugging face hub for enrich
+parser.add_argument("--enrich_workers", type=int, default=DEFAULT_ENRICH_WORKERS)
+# sku-override file with a fixed instance type for some models, used by enrich. defaults to ../config/sku-override/<test_set>.json
+parser.add_argument("--sku_override_file", type=str, default="")
 # workspace_list file get workspace metadata
 parser.add_argument("--workspace_list", type=str, default="../config/workspaces.json")
 # directory to write logs
@@ -69,7 +114,8 @@ def load_workspace_config():
 # function to assign models to queues
 # assign each model from models to a thread per workspace in a round robin fashion by appending to a list called 'models' in the queue dictionary
 # function to create queue files
-def create_queue_files(queue, workspace_list):
+# models_info is the output of enrich_models, the entry of each model in the queue is written with the queue
+def create_queue_files(queue, workspace_list, models_info):
     print (f"\nCreating queue files")
     # create folder queue if it does not exist
     if not os.path.exists(args.queue_dir):
@@ -92,6 +138,10 @@ def create_queue_files(queue, workspace_list):
             q_dict["environment"] = workspace_list[workspace]["environment"]
             q_dict["compute"] = workspace_list[workspace]["compute"]
             q_dict["instance_type"] = workspace_list[workspace]["instance_type"]
+            if args.test_batch_size > 1:
+                q_dict["batches"] = model_batches(queue[workspace][thread])
+            if models_info:
+                q_dict["models_info"] = {model: models_info[model] for model in queue[workspace][thread] if model in models_info}
             print("q_dict",q_dict)
             print("workspace",q_dict["workspace"])
             print("subscription",q_dict["subscription"])   
@@ -102,172 +152,137 @@ def create_queue_files(queue, workspace_list):
                 json.dump(q_dict,f,indent=4)
                 
                     
-def assign_models_to_queues(models, workspace_list):
+# function to log the queue assignment to log_dir and validate that every model was assigned exactly once
+def log_queue_assignment(queue, models):
+    if LOG:
+        print("current working directory is:", os.getcwd())
+        # if assign_models_to_queues under log_dir does not exist, create it
+        print("args.log_dir:", args.log_dir)
+        
+        if not os.path.exists(f"{args.log_dir}/assign_models_to_queues"):
+            logpath=Path(f"{args.log_dir}/assign_models_to_queues")
+            os.makedirs(logpath)
+            print("logs created:" f"{args.log_dir}/assign_models_to_queues")
+        # generate filename as DDMMMYYYY-HHMMSS.json
+        timestamp = time.strftime("%d%b%Y-%H%M%S.json")
+        # write queue to file
+        with open(f"{args.log_dir}/assign_models_to_queues/{timestamp}", 'w') as f:
+            json.dump(queue, f, indent=4)
+    # validate that count of models across all queues is equal to count of models in models list
+    model_count=0
+    for workspace in queue:
+        for thread in queue[workspace]:
+            model_count=model_count+len(queue[workspace][thread])
+    if model_count != len(models):
+        print (f"Error: Model count mismatch. Expected {len(models)} but found {model_count}")
+        exit (1)
+    else:
+        print (f"Found {model_count} models across {len(queue)} queues, which is equal to count of models in models list")
+    return queue
+
+# threads is the number of parallel queues per workspace, sized to the capacity of the workspace
+def assign_models_to_queues(models, workspace_list, threads):
     queue = {}
     i=0
     while i < len(models):
         for workspace in workspace_list:
-            print (f"workspace instance: {workspace}")
-            for thread in range(parallel_tests):
-                print (f"thread instance: {thread}")
+            for thread in range(threads[workspace]):
                 if i < len(models):
                     if workspace not in queue:
                         queue[workspace] = {}
-                        print("queue[workspace]",queue[workspace])
                     if thread not in queue[workspace]:
                         queue[workspace][thread] = []
                     queue[workspace][thread].append("MLFlow-"+models[i])
-                    print("queue[workspace][thread]",queue[workspace][thread])
                     i=i+1
                     #print (f"Adding model {models[i]} at index {i} to queue {workspace}-{thread}")
-                else:
-                    #print (f"Reached end of models list, breaking out of loop")
-                    if LOG:
-                        print("current working directory is:", os.getcwd())
-                        # if assign_models_to_queues under log_dir does not exist, create it
-                        print("args.log_dir:", args.log_dir)
-                        
-                        if not os.path.exists(f"{args.log_dir}/assign_models_to_queues"):
-                            logpath=Path(f"{args.log_dir}/assign_models_to_queues")
-                            os.makedirs(logpath)
-                            print("logs created:" f"{args.log_dir}/assign_models_to_queues")
-                        # generate filename as DDMMMYYYY-HHMMSS.json
-                        timestamp = time.strftime("%d%b%Y-%H%M%S.json")
-                        # write queue to file
-                        with open(f"{args.log_dir}/assign_models_to_queues/{timestamp}", 'w') as f:
-                            json.dump(queue, f, indent=4)
-                    # validate that count of models across all queues is equal to count of models in models list
-                    model_count=0
-                    for workspace in queue:
-                        for thread in queue[workspace]:
-                            model_count=model_count+len(queue[workspace][thread])
-                    if model_count != len(models):
-                        print (f"Error: Model count mismatch. Expected {len(models)} but found {model_count}")
-                        exit (1)
-                    else:
-                        print (f"Found {model_count} models across {len(queue)} queues, which is equal to count of models in models list")
-                    return queue
+    return log_queue_assignment(queue, models)
+
+# function to assign models to queues with longest processing time first bin packing
+# uses historical durations from test_status_v2.py (--durations_file) and estimates the rest from model size
+# so that every queue is predicted to finish at about the same time
+# the tasks resolved by enrich refine the estimates of models without history
+def assign_models_to_queues_lpt(models, workspace_list, threads, models_info):
+    durations = load_durations(args.durations_file) if args.durations_file else {}
+    entries = ["MLFlow-"+model for model in models]
+    tasks = {entry: models_info[entry]["task"] for entry in entries if models_info.get(entry, {}).get("task")}
+    predicted = predict_durations(entries, durations, tasks)
+    queue_names = [(workspace, thread) for workspace in workspace_list for thread in range(threads[workspace])]
+    queue, loads = assign_longest_processing_time_first(entries, queue_names, predicted)
+    print_makespan(loads)
+    return log_queue_assignment(queue, models)
+# function to split the models of a queue into the batches registered in one job, consecutive so the queue order is kept
+def model_batches(models):
+    return [models[i:i + args.test_batch_size] for i in range(0, len(models), args.test_batch_size)]
 # function to create workflow files
 # !!! any existing workflow files in workflow_dir will be overwritten. backup... !!!
+# the template is parsed once and every workflow is rendered in memory, then written by a bounded pool of writer threads
 def create_workflow_files(q,workspace_list):
-    counter=0
     print (f"Creating workflow files")
-    # check if workflow_dir exists
-    if not os.path.exists(args.workflow_dir):
-        os.makedirs(args.workflow_dir)
-    # generate workflow files
+    if args.layout == "matrix":
+        template = parse_workflow_template(args.matrix_workflow_template)
+    else:
+        template = parse_workflow_template(args.workflow_template)
+    workflows = []
     for workspace in q:
-        print("entered q loop:",workspace)
         for thread in q[workspace]:
-            print("entered q of workspace loop:",thread)
-            for model in q[workspace][thread]:
-                # for model in models:
-                print("entered q of workspace of thread loop:",model)
-                # print("entered model of workspace of thread loop:",workflownames)
-                write_single_workflow_file(model,f"{workspace}-{thread}", workspace_list[workspace]['secret_name'])
-                # print progress
-                counter=counter+1
-                print("counter:",counter)
-                sys.stdout.write(f'{counter}\r')
-                sys.stdout.flush()
-    print (f"\nCreated {counter} workflow files")
-# function to write a single workflow file
-def write_single_workflow_file(model, q, secret_name):
-    # print a single dot without a newline to show progress
-    print (".", end="", flush=True)
-    workflowname=model.replace('/','-')
-    # workflowname=model.replace('/','-')
-    # os.system(f"sed -i 's/name: .*/name: {model}/g' {args.workflow_template}")
-    workflow_file=f"{args.workflow_dir}/{workflowname}.yml"
-    os.system(f"rm -rf {args.workflow_dir}/demo_{workflowname}.yml") 
-    # print("yml file----------------------------------------",workflow_file)
-    # # print(workflow_file['env']['test_queue'])
-    print (f"Generating workflow file: {workflow_file}")
-    os.system(f"cp {args.workflow_template} {workflow_file}")
-    MLFlow_Model=f"MLFlow-{model}"
-    print(MLFlow_Model)
-    MLmodel="MLFlow-"+model
-    print("MLmodel:",model)
-    os.system(f"sed -i s/name: .*/name: {model}/g' {workflow_file}")
-    # replace <test_queue> with q
-    os.system(f"sed -i 's/test_queue: .*/test_queue: {q}/g' {workflow_file}")
-    # os.system(f"sed -i 's/test-norwayeast-02/{q}/g' {workflow_file}")
-    # replace <test_sku_type> with test_sku_type in workflow_file
-    os.system(f"sed -i 's/test_sku_type: .*/test_sku_type: {args.test_sku_type}/g' {workflow_file}")
-    # replace <test_registry> with test_registry in workflow_file
-    os.system(f"sed -i 's/test_trigger_next_model: .*/test_trigger_next_model: {args.test_trigger_next_model}/g' {workflow_file}")
-    # replace <test_keep_looping> with test_keep_looping in workflow_file
-    os.system(f"sed -i 's/test_keep_looping: .*/test_keep_looping: {args.test_keep_looping}/g' {workflow_file}")
-    # replace <test_model_name> with model_container.name in workflow_file
-    os.system(f"sed -i 's=test_model_name: .*=test_model_name: {model}=g' {workflow_file}")
-    # replace <test_set> with test_set in workflow_file
-    os.system(f"sed -i 's/test_set: .*/test_set: {args.test_set}/g' {workflow_file}")
-    # replace <test_secret_name> 
-    os.system(f"sed -i 's/test_secret_name: .*/test_secret_name: {secret_name}/g' {workflow_file}")
-    # # Read in the file
-    # github_token="GITHUB_TOKEN"
-    repository_owner="Konjarla-Vindya"
-    repository_name="son-azureml-oss-models"
-    workflow_filename=f".github/workflows/{workflowname}.yml"
-    # workflow_sha="main"  # You need to provide the correct SHA
-    new_workflow_name={model}
-    new_job_name={model}
-    # Construct the API URL
-    api_url = f"https://api.github.com/repositories/655633575/contents/{workflow_filename}"
-    print("api url is genrating:--------------------",api_url)
-    print("type of api_url=============",type(api_url))
-    print("type of workflow_file=============",type(workflow_file))
-    github_token = os.environ.get("GITHUB_TOKEN")
-    # print("github_token: is ------------------------------------",github_token)
-   
-    # Prepare the request headers
-    headers = {
-        "Authorization": f"Bearer {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    print("header---------------------",headers)
-    # Make the GET request
-    response = requests.get(api_url, headers=headers)
-    print("response is genrating:--------------------",response)
-    
-    if response.status_code == 200:
-        file_info = response.json()
-        file_sha = file_info["sha"]
-        print(f"SHA of '{workflow_filename}': {file_sha}")
-    else:
-        print(f"Failed to fetch file info. Status code: {response.status_code}")
-    
-    with open(workflow_file, 'rt') as f:
-        yaml_content = f.read()
-        # yaml_content=yaml.safe_load(f)
-    
-    updated_yaml_content = yaml_content.replace("distl", model)
-    yml_content='"""'+'\n'+updated_yaml_content+'\n'+'"""'
-    print("updated_yaml_content-----------------------",yml_content)
-    modified_yaml_content = yml_content.replace('"""', '')
-    with open(workflow_file, 'w') as yaml_file:
-        yaml_file.write(updated_yaml_content)
-    
+            if args.layout == "matrix":
+                # the matrix of a queue without models would be empty, which github rejects, so it gets no workflow
+                if len(q[workspace][thread]) == 0:
+                    print (f"::warning:: Queue {workspace}-{thread} has no models, skipping its workflow")
+                    continue
+                values = queue_workflow_values(f"{workspace}-{thread}", workspace_list[workspace]['secret_name'], args.test_set, args.test_sku_type, args.test_keep_looping)
+                workflows.append((queue_workflow_file_name(args.test_set, f"{workspace}-{thread}"), values))
+                if len(q[workspace][thread]) > MATRIX_MAX_JOBS:
+                    print (f"::warning:: Queue {workspace}-{thread} has {len(q[workspace][thread])} models, it will be tested in chunks of {MATRIX_MAX_JOBS} models, one workflow run per chunk. Increase parallel_tests to avoid this")
+                continue
+            # the workflow of the first model of a batch registers the whole batch
+            for model in [batch[0] for batch in model_batches(q[workspace][thread])]:
+                values = workflow_values(model, f"{workspace}-{thread}", workspace_list[workspace]['secret_name'], args.test_set, args.test_sku_type, args.test_trigger_next_model, args.test_keep_looping, args.test_dispatcher_db, args.test_endpoint_pool_db, args.test_runs_on)
+                workflows.append((workflow_file_name(model), values))
+    if args.incremental == "true":
+        report = sync_workflow_files(template, workflows, args.workflow_dir, manifest_file_name(args.queue_dir, args.test_set), args.workflow_writers)
+        print (f"\nWorkflow files: {report['added']} added, {report['changed']} changed, {report['removed']} removed, {report['unchanged']} unchanged in {report['elapsed']:.2f}s")
+        return report
+    counter, elapsed = write_workflow_files(template, workflows, args.workflow_dir, args.workflow_writers)
+    print (f"\nCreated {counter} workflow files in {elapsed:.2f}s ({counter/max(elapsed, 1e-6):.0f} files/s)")
+    return {"added": counter, "changed": 0, "removed": 0, "unchanged": 0}
+# function to resolve the task, class, size and instance type of all models in one batch before they are queued
+def enrich_queue_models(models):
+    if args.enrich != "true":
+        return {}
+    sku_override_file = args.sku_override_file or f"../config/sku-override/{args.test_set}.json"
+    models_info = enrich_models(["MLFlow-"+model for model in models], args.test_sku_type, load_sku_override(sku_override_file), args.enrich_workers)
+    if LOG:
+        if not os.path.exists(f"{args.log_dir}/enrich_models"):
+            os.makedirs(f"{args.log_dir}/enrich_models")
+        timestamp = time.strftime("%d%b%Y-%H%M%S.json")
+        with open(f"{args.log_dir}/enrich_models/{timestamp}", 'w') as f:
+            json.dump(models_info, f, indent=4)
+    return models_info
 def workflow_names(models):
-    workflownames=[]
-    j=1
-    while j < len(models):
-        for names in models:
-            workflow_modelname=names.replace('/','-')
-            # print(f"workflow_modelname: {workflow_modelname}")
-            # print("beforeworkflow names",workflownames)
-            workflownames.append(workflow_modelname)
-            # print("in loop workflow names",workflownames)
-        j=j+1
+    workflownames=[names.replace('/','-') for names in models]
     print("out of loop workflow names:",workflownames)
     return workflownames
 def main():
+    if args.layout not in ["model", "matrix"]:
+        print (f"::error Invalid layout {args.layout}")
+        exit (1)
+    if args.test_batch_size > 1 and (args.test_dispatcher_db or args.layout == "matrix"):
+        print ("::error test_batch_size needs the model layout without test_dispatcher_db, the dispatcher and the matrix test one model per run")
+        exit (1)
+    if args.test_dispatcher_db and is_github_hosted(args.test_runs_on) and args.test_dispatcher_shared != "true":
+        print (f"::error test_dispatcher_db {args.test_dispatcher_db} is not shared between the github hosted runners of {args.test_runs_on}, every workflow run starts on a new machine. "
+               "Run the workflows on a self-hosted runner with --test_runs_on, or pass --test_dispatcher_shared true if every runner mounts the path")
+        exit (1)
     
     # get list of models from registry
     if args.mode == "registry":
-        models = get_model_containers(args.registry_name)
+        models = get_model_containers(args.registry_name, templates)
     elif args.mode == "file":
         models = load_model_list_file(args.model_list_file)
+    elif args.mode == "catalog":
+        # leave out the environment templates like test_status_v2.py does, so both list the same models
+        models = load_catalog_models(args.registry_name, args.catalog_db, args.catalog_refresh == "true", templates=templates)
     else:
         print (f"::error Invalid mode {args.mode}")
         exit (1)
@@ -279,25 +294,36 @@ def main():
     # load workspace_list_json
     workspace_list = load_workspace_config()
     print (f"Found {len(workspace_list)} workspaces")
+    # size the number of parallel queues of each workspace to its capacity
+    threads = workspace_threads(workspace_list, parallel_tests, load_capacities(workspace_list, args.capacity_file))
+    # resolve what the per-model jobs need for all models at once
+    models_info = enrich_queue_models(models)
     # assign models to queues
-    queue = assign_models_to_queues(models, workspace_list)
+    if args.assignment == "lpt":
+        queue = assign_models_to_queues_lpt(models, workspace_list, threads, models_info)
+    elif args.assignment == "round_robin":
+        queue = assign_models_to_queues(models, workspace_list, threads)
+    else:
+        print (f"::error Invalid assignment {args.assignment}")
+        exit (1)
     # q=assign_models_to_workflowq(workflownames, workspace_list)
     q=queue
     print("q",q)
     print("queue",queue)
     print (f"Created queues")
     # create queue files
-    create_queue_files(queue, workspace_list)
+    create_queue_files(queue, workspace_list, models_info)
     print (f"Created queue files")
     # create workflow files
-    create_workflow_files(q, workspace_list)
+    report = create_workflow_files(q, workspace_list)
     print (f"Created workflow files")
     print (f"Summary:")
     print (f"  Models: {len(models)}")
     print (f"  Workspaces: {len(workspace_list)}")
     print (f"  Parallel tests: {parallel_tests}")
-    print (f"  Total queues: {len(workspace_list)*parallel_tests}")
-    print (f"  Average models per queue: {int(len(models)/(len(workspace_list)*parallel_tests))}")
+    print (f"  Total queues: {sum(threads.values())}")
+    print (f"  Average models per queue: {int(len(models)/sum(threads.values()))}")
+    print (f"  Workflow files added: {report['added']}, changed: {report['changed']}, removed: {report['removed']}")
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,196 @@
+import re
+import json
+import heapq
+import statistics
+
+# duration in minutes used when there is no history at all, see "Note on scaling" in README.md
+DEFAULT_DURATION = 30
+# prefix create_queue.py adds to model names in the queue files
+MODEL_PREFIX = "MLFlow-"
+
+# relative cost of a model by the size hint in its name, checked in this order
+SIZE_HINTS = [("xxl", 3.0), ("xlarge", 2.0), ("-xl", 2.0), ("large", 1.5), ("medium", 1.2), ("base", 1.0), ("small", 0.7), ("mini", 0.5), ("tiny", 0.5)]
+# relative cost of a model by task, generation tasks produce more tokens and need bigger skus
+TASK_FACTORS = {
+    "text-generation": 2.0,
+    "text2text-generation": 1.5,
+    "summarization": 1.5,
+    "translation": 1.5,
+    "conversational": 1.5,
+    "question-answering": 1.0,
+    "table-question-answering": 1.0,
+    "token-classification": 1.0,
+    "text-classification": 1.0,
+    "zero-shot-classification": 1.0,
+    "sentence-similarity": 1.0,
+    "fill-mask": 1.0,
+}
+# parameter count in the model name, for example llama-7b, pythia-1.4b, bloom-560m
+BILLION_PATTERN = re.compile(r"(?<![0-9.])(\d+(?:\.\d+)?)b(?![a-z])", re.IGNORECASE)
+MILLION_PATTERN = re.compile(r"(?<![0-9.])(\d+(?:\.\d+)?)m(?![a-z])", re.IGNORECASE)
+
+
+# function to load historical per-model durations in minutes
+# accepts the results_per_model json dumped by test_status_v2.py, keyed by workflow name
+# models that were never tested or have no duration are left out so that they get an estimate
+def load_durations(durations_file):
+    with open(durations_file) as f:
+        results_per_model = json.load(f)
+    durations = {}
+    for model, result in results_per_model.items():
+        if isinstance(result, dict):
+            if result.get("last_tested") and result.get("duration", 0) > 0:
+                durations[model] = float(result["duration"])
+        elif result:
+            durations[model] = float(result)
+    print (f"Loaded historical durations for {len(durations)} models from {durations_file}")
+    return durations
+
+
+# function to look up the history of a queue entry, with or without the MLFlow- prefix
+def historical_duration(model, durations):
+    if model in durations:
+        return durations[model]
+    if model.startswith(MODEL_PREFIX) and model[len(MODEL_PREFIX):] in durations:
+        return durations[model[len(MODEL_PREFIX):]]
+    if MODEL_PREFIX + model in durations:
+        return durations[MODEL_PREFIX + model]
+    return None
+
+
+# function to guess the parameter count of a model in billions from its name, returns None if there is no hint
+def parameters_from_name(model):
+    match = BILLION_PATTERN.search(model)
+    if match:
+        return float(match.group(1))
+    match = MILLION_PATTERN.search(model)
+    if match:
+        return float(match.group(1)) / 1000
+    return None
+
+
+# function to estimate the duration of a model without history
+# starts from the median of the known durations and scales it by the size and task of the model
+def estimate_duration(model, base_duration=DEFAULT_DURATION, task=None):
+    name = model.lower()
+    factor = 1.0
+    parameters = parameters_from_name(name)
+    if parameters is not None:
+        # a 7b model takes roughly 4.5 times as long as a base sized model
+        factor = max(0.5, 1 + parameters / 2)
+    else:
+        for hint, hint_factor in SIZE_HINTS:
+            if hint in name:
+                factor = hint_factor
+                break
+    if task is not None:
+        factor = factor * TASK_FACTORS.get(task, 1.0)
+    return base_duration * factor
+
+
+# function to get the predicted duration of every model, historical where known and estimated otherwise
+# tasks is an optional dictionary of model to task used to refine the estimates
+def predict_durations(models, durations, tasks=None):
+    tasks = tasks or {}
+    known = [d for d in durations.values() if d > 0]
+    base_duration = statistics.median(known) if known else DEFAULT_DURATION
+    predicted = {}
+    estimated = 0
+    for model in models:
+        duration = historical_duration(model, durations)
+        if duration is None:
+            duration = estimate_duration(model, base_duration, tasks.get(model))
+            estimated = estimated + 1
+        predicted[model] = duration
+    print (f"Predicted durations: {len(models) - estimated} from history, {estimated} estimated (base {base_duration:.1f} min)")
+    return predicted
+
+
+# function to assign models to queues with longest processing time first
+# the next longest model always goes to the queue that is predicted to finish first
+# queue_names is a list of (workspace, thread) tuples, ties are broken by the order of queue_names
+# returns the queue in the same shape as assign_models_to_queues and the predicted minutes per queue
+def assign_longest_processing_time_first(models, queue_names, predicted):
+    heap = [(0.0, order, name) for order, name in enumerate(queue_names)]
+    heapq.heapify(heap)
+    loads = {name: 0.0 for name in queue_names}
+    assigned = {name: [] for name in queue_names}
+    # sort by duration, longest first, and by original position to keep the assignment deterministic
+    order = sorted(range(len(models)), key=lambda i: (-predicted[models[i]], i))
+    for i in order:
+        load, position, name = heapq.heappop(heap)
+        assigned[name].append(models[i])
+        load = load + predicted[models[i]]
+        loads[name] = load
+        heapq.heappush(heap, (load, position, name))
+    queue = {}
+    for workspace, thread in queue_names:
+        if not assigned[(workspace, thread)]:
+            continue
+        if workspace not in queue:
+            queue[workspace] = {}
+        queue[workspace][thread] = assigned[(workspace, thread)]
+    return queue, loads
+
+
+# function to print the predicted makespan of each queue and of the whole test set
+def print_makespan(loads):
+    print ("Queue|Predicted minutes")
+    print ("-----|-----------------")
+    for (workspace, thread), load in loads.items():
+        print (f"{workspace}-{thread}|{load:.1f}")
+    makespan = max(loads.values()) if loads else 0
+    print (f"Predicted makespan: {int(makespan / 60)}h {int(makespan % 60)}m")
+    return makespan
+
+
+# function to load the capacity of every workspace, used as a weight for the number of queues it gets
+# capacity can be declared as "capacity" in workspaces.json, for example the dedicated cores quota for its instance_type
+# or read from a usage snapshot file, a json of workspace name to either a number
+# or a usage entry with "limit" and "current_value" as returned by 'az ml compute list-usage'
+# the snapshot wins over workspaces.json, workspaces with no capacity anywhere get the average of the others
+def load_capacities(workspace_list, capacity_file=""):
+    snapshot = {}
+    if capacity_file:
+        with open(capacity_file) as f:
+            snapshot = json.load(f)
+    capacities = {}
+    for workspace in workspace_list:
+        usage = snapshot.get(workspace)
+        if isinstance(usage, dict):
+            capacities[workspace] = max(0.0, float(usage.get("limit", 0)) - float(usage.get("current_value", 0)))
+        elif usage is not None:
+            capacities[workspace] = max(0.0, float(usage))
+        elif "capacity" in workspace_list[workspace]:
+            capacities[workspace] = max(0.0, float(workspace_list[workspace]["capacity"]))
+    known = list(capacities.values())
+    default = sum(known) / len(known) if known else 1.0
+    for workspace in workspace_list:
+        if workspace not in capacities:
+            capacities[workspace] = default
+    return capacities
+
+
+# function to size the number of parallel queues of each workspace to its capacity
+# keeps the total number of queues at parallel_tests per workspace, split proportionally to capacity
+# with the largest remainder method. workspaces with capacity get at least 1 queue, workspaces with no capacity get none
+def workspace_threads(workspace_list, parallel_tests, capacities):
+    total_capacity = sum(capacities[workspace] for workspace in workspace_list)
+    if total_capacity <= 0:
+        print ("::warning:: No workspace has capacity, falling back to parallel_tests per workspace")
+        return {workspace: parallel_tests for workspace in workspace_list}
+    active = [workspace for workspace in workspace_list if capacities[workspace] > 0]
+    total_threads = max(parallel_tests * len(workspace_list), len(active))
+    shares = {workspace: total_threads * capacities[workspace] / total_capacity for workspace in workspace_list}
+    threads = {workspace: (max(1, int(shares[workspace])) if workspace in active else 0) for workspace in workspace_list}
+    remaining = total_threads - sum(threads.values())
+    # hand out the remaining queues to the workspaces that lost the most to rounding down
+    by_remainder = sorted(active, key=lambda workspace: (-(shares[workspace] - threads[workspace]), list(workspace_list).index(workspace)))
+    i = 0
+    while remaining > 0 and by_remainder:
+        threads[by_remainder[i % len(by_remainder)]] += 1
+        remaining = remaining - 1
+        i = i + 1
+    for workspace in workspace_list:
+        print (f"workspace {workspace}: capacity {capacities[workspace]:.0f}, parallel queues {threads[workspace]}")
+    return threads
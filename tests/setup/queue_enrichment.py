@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue_balancer import MODEL_PREFIX, parameters_from_name
+# hf_model_info.py is shared with the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from hf_model_info import HfModelInfoClient
+from model_inspection import parameters_from_info
+
+# resolves what every per-model job used to discover at runtime, once for the whole queue set
+# task, transformers class to load the model with, estimated parameter count and instance type
+# create_queue.py embeds the result in the queue files under models_info, keyed by queue entry
+DEFAULT_TASK_AND_LIBRARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "automation_for_constant_library", "task_and_library.json")
+DEFAULT_ENRICH_WORKERS = 16
+# instance type by sku type for models up to the given parameter count in billions, checked in this order
+# a float32 model needs about 4 GB of memory per billion parameters, plus room for the scoring server
+SKU_TIERS = {
+    "cpu": [(1, "Standard_DS3_v2"), (3, "Standard_DS4_v2"), (7, "Standard_DS5_v2"), (None, "Standard_E64s_v3")],
+    "gpu": [(7, "Standard_NC6s_v3"), (None, "Standard_NC24s_v3")],
+}
+
+
+# function to load the transformers class used to load the model of each supported task
+def load_task_and_library(task_and_library_file=DEFAULT_TASK_AND_LIBRARY_FILE):
+    with open(task_and_library_file) as f:
+        return json.load(f)
+
+
+# function to get the hugging face model id of a queue entry
+def model_id_of(entry):
+    return entry[len(MODEL_PREFIX):] if entry.startswith(MODEL_PREFIX) else entry
+
+
+# function to estimate the parameter count of a model in billions
+# uses the safetensors metadata or the size of the weight files of the model info, then the model name
+def estimate_parameters(info, model_id):
+    parameters, _ = parameters_from_info(info)
+    if parameters is not None:
+        return parameters / 1e9
+    return parameters_from_name(model_id)
+
+
+# function to pick the instance type for a model, returns None if the size is unknown so that the queue default is used
+def target_instance_type(parameters, sku_type):
+    if parameters is None or sku_type not in SKU_TIERS:
+        return None
+    for limit, instance_type in SKU_TIERS[sku_type]:
+        if limit is None or parameters <= limit:
+            return instance_type
+
+
+# function to enrich one queue entry, a model that cannot be looked up gets None values and is discovered at runtime as before
+def enrich_model(entry, info_client, task_and_library, sku_type, sku_override):
+    model_id = model_id_of(entry)
+    model_info = {"model_id": model_id, "sha": None, "task": None, "auto_class": None, "architecture": None, "parameters": None, "instance_type": None}
+    try:
+        info = info_client.get(model_id)
+    except Exception as e:
+        print (f"::warning:: Could not get model info of {model_id}, it will be resolved by its job: \n{e}")
+        model_info["parameters"] = parameters_from_name(model_id)
+        model_info["instance_type"] = target_instance_type(model_info["parameters"], sku_type)
+    else:
+        task = info.get("pipeline_tag") if "transformers" in (info.get("tags") or []) else None
+        architectures = (info.get("config") or {}).get("architectures") or []
+        model_info["sha"] = info.get("sha")
+        # tasks the tests do not support keep an empty task, same as hf_task_index.get_task
+        model_info["task"] = task if task in task_and_library else ""
+        model_info["architecture"] = architectures[0] if architectures else None
+        # the auto class of the task can load any architecture, the architecture of the config is the fallback
+        model_info["auto_class"] = task_and_library.get(task) or model_info["architecture"]
+        model_info["parameters"] = estimate_parameters(info, model_id)
+        model_info["instance_type"] = target_instance_type(model_info["parameters"], sku_type)
+    # the sku-override file of the test set wins over the estimate, it is keyed by workflow name
+    override = sku_override.get(model_id.replace("/", "-")) or sku_override.get(entry.replace("/", "-"))
+    if override:
+        model_info["instance_type"] = override["sku"]
+    return model_info
+
+
+# function to enrich all queue entries concurrently, returns a dictionary of queue entry to model info
+def enrich_models(entries, sku_type, sku_override=None, max_workers=DEFAULT_ENRICH_WORKERS, info_client=None, task_and_library_file=DEFAULT_TASK_AND_LIBRARY_FILE):
+    start = time.time()
+    info_client = info_client or HfModelInfoClient()
+    task_and_library = load_task_and_library(task_and_library_file)
+    sku_override = sku_override or {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        models_info = list(executor.map(lambda entry: enrich_model(entry, info_client, task_and_library, sku_type, sku_override), entries))
+    resolved = len([model_info for model_info in models_info if model_info["task"] is not None])
+    print (f"Enriched {resolved} of {len(entries)} models in {time.time() - start:.1f}s")
+    return dict(zip(entries, models_info))
+
+
+# function to load the sku-override file of a test set, returns an empty dictionary if there is none
+def load_sku_override(sku_override_file):
+    if not sku_override_file or not os.path.exists(sku_override_file):
+        return {}
+    with open(sku_override_file) as f:
+        return json.load(f)
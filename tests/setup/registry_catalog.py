@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from util import get_registry_client, list_model_versions, DEFAULT_LIST_WORKERS
+
+# local catalog of the models in a registry, backed by a sqlite database
+# a refresh lists the model containers, which is a single paged call, and only lists the versions of containers
+# that are new or were modified since the last refresh. containers that are gone from the registry are marked removed
+# queries such as the latest version of a model or all models of a task are then answered locally
+DEFAULT_CATALOG_DIR = "../logs/registry_catalog"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS containers (
+    name TEXT PRIMARY KEY,
+    latest_version TEXT,
+    version_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    last_modified TEXT,
+    removed INTEGER NOT NULL DEFAULT 0,
+    refreshed_at REAL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    task TEXT,
+    tags TEXT,
+    flavors TEXT,
+    created_at TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (name, version)
+);
+CREATE INDEX IF NOT EXISTS versions_task ON versions (task);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# function to get the default catalog file of a registry
+def catalog_file_name(registry_name, catalog_dir=DEFAULT_CATALOG_DIR):
+    return os.path.join(catalog_dir, f"{registry_name}.db")
+
+
+def connect(db):
+    db_dir = os.path.dirname(db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    connection = sqlite3.connect(db)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_meta(connection, key, default=None):
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(connection, key, value):
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+# function to get the created and last modified time of a registry asset as iso strings
+def asset_times(asset):
+    creation_context = getattr(asset, "creation_context", None)
+    created_at = getattr(creation_context, "created_at", None)
+    last_modified = getattr(creation_context, "last_modified_at", None) or created_at
+    return (created_at.isoformat() if created_at else None, last_modified.isoformat() if last_modified else None)
+
+
+# function to pick the latest of the versions of a model, the highest number if all versions are numbers
+# otherwise the last one listed, same as get_model_containers
+def latest_version(versions):
+    if not versions:
+        return None
+    if all(str(version.version).isdigit() for version in versions):
+        return max(versions, key=lambda version: int(version.version))
+    return versions[-1]
+
+
+# function to check if a container changed since it was stored in the catalog
+# containers without a last modified time or latest version are always fetched again
+def container_changed(container, stored):
+    if stored is None or stored["removed"]:
+        return True
+    _, last_modified = asset_times(container)
+    latest = getattr(container, "latest_version", None)
+    if last_modified is None and latest is None:
+        return True
+    if last_modified is not None and last_modified != stored["last_modified"]:
+        return True
+    # archived containers have no versions to compare with, they only change with their last modified time
+    return latest is not None and stored["version_count"] > 0 and str(latest) != stored["latest_version"]
+
+
+# function to write the versions of a container to the catalog, replacing the ones stored before
+def store_container(connection, container, versions, now):
+    created_at, last_modified = asset_times(container)
+    latest = latest_version(versions)
+    connection.execute("DELETE FROM versions WHERE name = ?", (container.name,))
+    for version in versions:
+        version_created_at, version_last_modified = asset_times(version)
+        tags = getattr(version, "tags", None) or {}
+        flavors = getattr(version, "flavors", None) or {}
+        connection.execute("INSERT INTO versions (name, version, task, tags, flavors, created_at, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (container.name, str(version.version), tags.get("task"), json.dumps(tags, sort_keys=True), json.dumps(flavors, sort_keys=True, default=str), version_created_at, version_last_modified))
+    # a container without versions is archived, see get_model_versions in util.py
+    connection.execute("INSERT OR REPLACE INTO containers (name, latest_version, version_count, created_at, last_modified, removed, refreshed_at) VALUES (?, ?, ?, ?, ?, 0, ?)",
+                       (container.name, str(latest.version) if latest else None, len(versions), created_at, last_modified, now))
+
+
+# function to bring the catalog up to date with the registry
+# full refetches the versions of every container, otherwise only new and changed containers are fetched
+# returns a dictionary with the count of added, changed, removed and unchanged containers
+def refresh_catalog(db, registry_name, full=False, max_workers=DEFAULT_LIST_WORKERS):
+    start = time.time()
+    connection = connect(db)
+    connection.row_factory = sqlite3.Row
+    stored = {row["name"]: row for row in connection.execute("SELECT * FROM containers")}
+    registry_ml_client = get_registry_client(registry_name)
+    print (f"Refreshing catalog {db} from registry {registry_name}, watermark {get_meta(connection, 'watermark')}")
+    containers = list(registry_ml_client.models.list())
+    changed = [container for container in containers if full or container_changed(container, stored.get(container.name))]
+    report = {"added": 0, "changed": 0, "removed": 0, "unchanged": len(containers) - len(changed)}
+    now = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(list_model_versions, registry_ml_client, container.name) for container in changed]
+        for container, future in zip(changed, futures):
+            store_container(connection, container, future.result(), now)
+            if container.name in stored and not stored[container.name]["removed"]:
+                report["changed"] += 1
+            else:
+                report["added"] += 1
+            sys.stdout.write(f'{report["added"] + report["changed"]}\r')
+            sys.stdout.flush()
+    listed = set(container.name for container in containers)
+    for name, row in stored.items():
+        if name not in listed and not row["removed"]:
+            connection.execute("UPDATE containers SET removed = 1, refreshed_at = ? WHERE name = ?", (now, name))
+            report["removed"] += 1
+    # the watermark is the last modified time of the most recently changed container in the registry
+    watermark = max([asset_times(container)[1] for container in containers if asset_times(container)[1]] + [get_meta(connection, "watermark") or ""])
+    set_meta(connection, "watermark", watermark)
+    set_meta(connection, "registry_name", registry_name)
+    set_meta(connection, "refreshed_at", str(now))
+    connection.commit()
+    connection.close()
+    report["elapsed"] = time.time() - start
+    print (f"\nCatalog refreshed: {report['added']} added, {report['changed']} changed, {report['removed']} removed, {report['unchanged']} unchanged in {report['elapsed']:.1f}s")
+    return report
+
+
+# function to list the models in the catalog that have at least one version, in name order
+# task filters on the task tag of the latest version, templates are left out like in get_model_containers
+def list_models(db, task=None, templates=None):
+    templates = templates or []
+    connection = connect(db)
+    query = "SELECT c.name FROM containers c"
+    params = []
+    if task:
+        query = query + " JOIN versions v ON v.name = c.name AND v.version = c.latest_version AND v.task = ?"
+        params.append(task)
+    query = query + " WHERE c.removed = 0 AND c.version_count > 0 ORDER BY c.name"
+    models = [row[0] for row in connection.execute(query, params) if row[0] not in templates]
+    connection.close()
+    return models
+
+
+# function to get the latest version of a model with its tags and flavors, returns None if the model is not in the catalog
+def get_latest_version(db, model_name):
+    connection = connect(db)
+    connection.row_factory = sqlite3.Row
+    row = connection.execute("SELECT v.* FROM containers c JOIN versions v ON v.name = c.name AND v.version = c.latest_version WHERE c.name = ? AND c.removed = 0", (model_name,)).fetchone()
+    connection.close()
+    if row is None:
+        return None
+    return {"name": row["name"], "version": row["version"], "task": row["task"], "tags": json.loads(row["tags"]), "flavors": json.loads(row["flavors"]),
+            "created_at": row["created_at"], "last_modified": row["last_modified"]}
+
+
+# function to load models from the catalog of a registry, refreshing it first if asked
+# used by create_queue.py, test_status_v2.py and create_badge.py in place of the timestamped get_model_containers dumps
+def load_catalog_models(registry_name, catalog_db="", refresh=True, task=None, templates=None):
+    db = catalog_db or catalog_file_name(registry_name)
+    if refresh:
+        refresh_catalog(db, registry_name)
+    elif not os.path.exists(db):
+        print (f"::error Catalog {db} does not exist, run 'python registry_catalog.py refresh --registry_name {registry_name}' first")
+        exit (1)
+    models = list_models(db, task, templates)
+    print (f"Loaded {len(models)} models from catalog {db}")
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local catalog of the models in a registry")
+    # registry to catalog, the catalog file defaults to ../logs/registry_catalog/<registry_name>.db
+    parser.add_argument("--registry_name", type=str, default="HuggingFace")
+    parser.add_argument("--catalog_db", type=str, default="")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # refresh, fetch new and changed models from the registry
+    refresh_parser = subparsers.add_parser("refresh")
+    refresh_parser.add_argument("--full", action="store_true")
+    refresh_parser.add_argument("--max_workers", type=int, default=DEFAULT_LIST_WORKERS)
+    # list, print model names one per line, can be used as model_list_file
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("--task", type=str, default=None)
+    # latest, print the latest version of a model
+    latest_parser = subparsers.add_parser("latest")
+    latest_parser.add_argument("--model", type=str, required=True)
+    args = parser.parse_args()
+
+    db = args.catalog_db or catalog_file_name(args.registry_name)
+    if args.command == "refresh":
+        refresh_catalog(db, args.registry_name, args.full, args.max_workers)
+    elif args.command == "list":
+        for model in list_models(db, args.task):
+            print (model)
+    elif args.command == "latest":
+        latest = get_latest_version(db, args.model)
+        if latest is None:
+            print (f"::error {args.model} is not in catalog {db}")
+            exit (1)
+        print (json.dumps(latest, indent=4))
+
+
+if __name__ == "__main__":
+    main()
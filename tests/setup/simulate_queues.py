@@ -0,0 +1,252 @@
+import os
+import glob
+import json
+import heapq
+import random
+import argparse
+import statistics
+from queue_balancer import load_durations, predict_durations, load_capacities
+
+# offline discrete event simulator for the queue files written by create_queue.py
+# replays a test set in simulated minutes to predict its wall clock time before spending any compute
+# each queue tests its models in sequence, like the chain of workflow runs started by 'gh workflow run'
+# each workspace runs at most 'slots' tests at a time, a queue that finds no free slot waits for one
+# a failed model is retried on the same queue up to 'retries' times, and with keep looping a queue starts over
+parser = argparse.ArgumentParser()
+# root dir of the queue files, same as create_queue.py
+parser.add_argument("--queue_dir", type=str, default="../config/queue")
+# comma separated test sets to simulate, for example the same models generated with --assignment round_robin and lpt
+parser.add_argument("--test_sets", type=str, default="huggingface-all")
+# results_per_model json written by test_status_v2.py, gives the historical duration and failures per model
+parser.add_argument("--durations_file", type=str, default="")
+# failure rate used for models without history, defaults to the average failure rate of the models with history
+parser.add_argument("--failure_rate", type=float, default=None)
+# number of times a failed model is tested again before the queue moves on
+parser.add_argument("--retries", type=int, default=0)
+# number of passes over each queue, more than 1 simulates test_keep_looping
+parser.add_argument("--loops", type=int, default=1)
+# minutes between the end of a model and the start of the next one, to start the next workflow run
+parser.add_argument("--trigger_overhead", type=float, default=2)
+# workspace_list and capacity_file as in create_queue.py, capacity is divided by cores_per_test to get the slots
+parser.add_argument("--workspace_list", type=str, default="../config/workspaces.json")
+parser.add_argument("--capacity_file", type=str, default="")
+parser.add_argument("--cores_per_test", type=float, default=8)
+# number of simulated runs, failures are random so makespan is reported as a distribution
+parser.add_argument("--runs", type=int, default=20)
+parser.add_argument("--seed", type=int, default=0)
+# number of jobs on the critical path to print
+parser.add_argument("--critical_path_length", type=int, default=20)
+args = parser.parse_args()
+
+
+# function to load the queue files of a test set, returns a dictionary of queue name to queue
+def load_queues(queue_dir, test_set):
+    queues = {}
+    for queue_file in sorted(glob.glob(os.path.join(queue_dir, test_set, "*.json"))):
+        with open(queue_file) as f:
+            queue = json.load(f)
+        queues[queue["queue_name"]] = queue
+    return queues
+
+
+# function to get the failure rate of each model from the results_per_model json dumped by test_status_v2.py
+def load_failure_rates(durations_file):
+    if not durations_file:
+        return {}
+    with open(durations_file) as f:
+        results_per_model = json.load(f)
+    rates = {}
+    for model, result in results_per_model.items():
+        if not isinstance(result, dict):
+            continue
+        tested = result.get("success", 0) + result.get("failure", 0) + result.get("unknown", 0)
+        if tested:
+            rates[model] = (result.get("failure", 0) + result.get("unknown", 0)) / tested
+    return rates
+
+
+# function to look up the failure rate of a queue entry, same prefix rules as the durations
+def failure_rate(model, rates, default_rate):
+    for name in [model, model[len("MLFlow-"):] if model.startswith("MLFlow-") else "MLFlow-" + model]:
+        if name in rates:
+            return rates[name]
+    return default_rate
+
+
+# function to get the number of tests each workspace can run at the same time
+# without any declared capacity every queue gets its own slot, so queues never wait for each other
+def workspace_slots(queues, workspace_list, capacity_file, cores_per_test):
+    workspaces = sorted(set(queue["workspace"] for queue in queues.values()))
+    queue_counts = {workspace: sum(1 for queue in queues.values() if queue["workspace"] == workspace) for workspace in workspaces}
+    known = {workspace: workspace_list.get(workspace, {}) for workspace in workspaces}
+    if not capacity_file and not any("capacity" in workspace for workspace in known.values()):
+        return queue_counts
+    capacities = load_capacities(known, capacity_file)
+    return {workspace: max(1, int(capacities[workspace] // cores_per_test)) for workspace in workspaces}
+
+
+# function to replay a test set once in simulated time
+# returns the jobs that ran, as dictionaries with queue, model, attempt, start, end, failed and the job that freed its slot
+def simulate(queues, predicted, rates, default_rate, slots, retries, loops, trigger_overhead, rng):
+    # events are (time, sequence, kind, queue), the sequence keeps the order of events at the same time deterministic
+    events = []
+    sequence = 0
+    free = dict(slots)
+    waiting = {workspace: [] for workspace in slots}
+    # last job that released a slot of each workspace, a queue that waited for a slot depends on it
+    last_release = {workspace: None for workspace in slots}
+    state = {}
+    jobs = []
+    for name, queue in queues.items():
+        entries = [model for _ in range(loops) for model in queue["models"]]
+        state[name] = {"entries": entries, "index": 0, "attempt": 0, "previous": None, "ready": 0.0}
+        if entries:
+            heapq.heappush(events, (0.0, sequence, "ready", name))
+            sequence = sequence + 1
+    while events:
+        now, _, kind, name = heapq.heappop(events)
+        workspace = queues[name]["workspace"]
+        if kind == "ready":
+            state[name]["ready"] = now
+            if free[workspace] > 0:
+                free[workspace] = free[workspace] - 1
+                blocked_by = None
+            else:
+                waiting[workspace].append(name)
+                continue
+        elif kind == "slot":
+            # a slot was handed over by a finishing job of the same workspace
+            blocked_by = last_release[workspace]
+        else:
+            # kind is "done", release the slot and move the queue to its next model
+            job = state[name]["job"]
+            last_release[workspace] = job
+            if waiting[workspace]:
+                heapq.heappush(events, (now, sequence, "slot", waiting[workspace].pop(0)))
+                sequence = sequence + 1
+            else:
+                free[workspace] = free[workspace] + 1
+            if job["failed"] and state[name]["attempt"] < retries:
+                state[name]["attempt"] = state[name]["attempt"] + 1
+            else:
+                state[name]["index"] = state[name]["index"] + 1
+                state[name]["attempt"] = 0
+            state[name]["previous"] = job
+            if state[name]["index"] < len(state[name]["entries"]):
+                heapq.heappush(events, (now + trigger_overhead, sequence, "ready", name))
+                sequence = sequence + 1
+            continue
+        # start the current model of the queue
+        model = state[name]["entries"][state[name]["index"]]
+        failed = rng.random() < failure_rate(model, rates, default_rate)
+        job = {"queue": name, "model": model, "attempt": state[name]["attempt"], "ready": state[name]["ready"], "start": now, "end": now + predicted[model],
+               "failed": failed, "previous": state[name]["previous"], "blocked_by": blocked_by}
+        jobs.append(job)
+        state[name]["job"] = job
+        heapq.heappush(events, (job["end"], sequence, "done", name))
+        sequence = sequence + 1
+    return jobs
+
+
+# function to summarize a simulated run, returns the makespan and the busy, waiting and idle minutes of each queue
+def summarize(queues, jobs):
+    makespan = max((job["end"] for job in jobs), default=0.0)
+    summary = {name: {"models": 0, "attempts": 0, "failed": 0, "busy": 0.0, "waiting": 0.0, "finish": 0.0} for name in queues}
+    for job in jobs:
+        queue = summary[job["queue"]]
+        queue["attempts"] = queue["attempts"] + 1
+        if job["attempt"] == 0:
+            queue["models"] = queue["models"] + 1
+        if job["failed"]:
+            queue["failed"] = queue["failed"] + 1
+        queue["busy"] = queue["busy"] + job["end"] - job["start"]
+        queue["waiting"] = queue["waiting"] + job["start"] - job["ready"]
+        queue["finish"] = max(queue["finish"], job["end"])
+    for queue in summary.values():
+        # idle is everything that is not testing, waiting for a slot, starting the next run and finishing before the others
+        queue["idle"] = makespan - queue["busy"]
+    return makespan, summary
+
+
+# function to get the critical path, the chain of jobs that ends with the last job of the test set
+# each job depends on the previous job of its queue, or on the job that freed its slot if it had to wait for one
+def critical_path(jobs):
+    if not jobs:
+        return []
+    job = max(jobs, key=lambda job: job["end"])
+    path = []
+    while job is not None:
+        path.append(job)
+        if job["blocked_by"] is not None and job["blocked_by"]["end"] >= job["ready"]:
+            job = job["blocked_by"]
+        else:
+            job = job["previous"]
+    path.reverse()
+    return path
+
+
+def format_minutes(minutes):
+    return f"{int(minutes / 60)}h {int(minutes % 60)}m"
+
+
+# function to simulate a test set runs times and print the makespan distribution and the details of the median run
+def simulate_test_set(test_set, durations, rates, workspace_list):
+    queues = load_queues(args.queue_dir, test_set)
+    if not queues:
+        print (f"::error:: No queue files found in {args.queue_dir}/{test_set}")
+        exit (1)
+    models = sorted(set(model for queue in queues.values() for model in queue["models"]))
+    print (f"\nTest set {test_set}: {len(queues)} queues, {len(models)} models")
+    predicted = predict_durations(models, durations)
+    default_rate = args.failure_rate
+    if default_rate is None:
+        default_rate = statistics.mean(rates.values()) if rates else 0.0
+    slots = workspace_slots(queues, workspace_list, args.capacity_file, args.cores_per_test)
+    rng = random.Random(args.seed)
+    results = []
+    for _ in range(max(1, args.runs)):
+        jobs = simulate(queues, predicted, rates, default_rate, slots, args.retries, args.loops, args.trigger_overhead, rng)
+        makespan, summary = summarize(queues, jobs)
+        results.append((makespan, summary, jobs))
+    results.sort(key=lambda result: result[0])
+    makespans = [result[0] for result in results]
+    makespan, summary, jobs = results[len(results) // 2]
+    print ("Queue|Workspace|Models|Attempts|Failed|Busy|Waiting for slot|Idle|Finish")
+    print ("-----|---------|------|--------|------|----|----------------|----|------")
+    for name, queue in summary.items():
+        print (f"{name}|{queues[name]['workspace']}|{queue['models']}|{queue['attempts']}|{queue['failed']}|{format_minutes(queue['busy'])}|{format_minutes(queue['waiting'])}|{format_minutes(queue['idle'])}|{format_minutes(queue['finish'])}")
+    path = critical_path(jobs)
+    print (f"\nCritical path of the median run: {len(path)} jobs")
+    print ("Queue|Model|Attempt|Start|End")
+    print ("-----|-----|-------|-----|---")
+    for job in path[-args.critical_path_length:]:
+        print (f"{job['queue']}|{job['model']}|{job['attempt']}|{format_minutes(job['start'])}|{format_minutes(job['end'])}")
+    return {
+        "test_set": test_set,
+        "queues": len(queues),
+        "models": len(models),
+        "makespan_p50": statistics.median(makespans),
+        "makespan_p90": makespans[min(len(makespans) - 1, int(len(makespans) * 0.9))],
+        "idle": sum(queue["idle"] for queue in summary.values()),
+        "busy": sum(queue["busy"] for queue in summary.values()),
+    }
+
+
+def main():
+    durations = load_durations(args.durations_file) if args.durations_file else {}
+    rates = load_failure_rates(args.durations_file)
+    workspace_list = {}
+    if os.path.exists(args.workspace_list):
+        with open(args.workspace_list) as f:
+            workspace_list = json.load(f)
+    reports = [simulate_test_set(test_set, durations, rates, workspace_list) for test_set in args.test_sets.split(",")]
+    print (f"\nSummary of {max(1, args.runs)} simulated runs per test set, {args.retries} retries, {args.loops} loops")
+    print ("Test set|Queues|Models|Makespan p50|Makespan p90|Queue idle|Utilization")
+    print ("--------|------|------|------------|------------|----------|-----------")
+    for report in reports:
+        utilization = report["busy"] / (report["busy"] + report["idle"]) if report["busy"] + report["idle"] else 0
+        print (f"{report['test_set']}|{report['queues']}|{report['models']}|{format_minutes(report['makespan_p50'])}|{format_minutes(report['makespan_p90'])}|{format_minutes(report['idle'])}|{utilization:.0%}")
+
+
+if __name__ == "__main__":
+    main()
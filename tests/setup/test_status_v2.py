@@ -1,8 +1,10 @@
 import os
+import glob
 import json
 import requests
 from datetime import datetime
 from util import load_model_list_file, get_model_containers
+from registry_catalog import load_catalog_models
 from azure.ai.ml import MLClient
 from azure.identity import DefaultAzureCredential
 
@@ -14,12 +16,21 @@ parser.add_argument("--model_list_file", type=str, default="../logs/get_model_co
 parser.add_argument("--github_workflows_file", type=str, default="../logs/get_github_workflows/18May2023-211807.json")
 # mode parameter to get workflow status from api or file
 parser.add_argument("--mode_workflow", type=str, default="api")
-# mode_model parameter to get model status from api or file
+# mode_model parameter to get model status from api, file or catalog (the local registry catalog, see registry_catalog.py)
 parser.add_argument("--mode_model", type=str, default="file")
+# catalog file for mode_model catalog, defaults to ../logs/registry_catalog/<registry_name>.db
+parser.add_argument("--catalog_db", type=str, default="")
+# catalog_refresh, to fetch new and changed models from the registry into the catalog before reading it
+parser.add_argument("--catalog_refresh", type=str, default="true")
 # parameter to get markdown file name
 parser.add_argument("--markdown_file", type=str, default="../../dashboard/HuggingFace/README.md")
 # parameter to get registry name
 parser.add_argument("--registry_name", type=str, default="HuggingFace")
+# layout of the test workflows, model (one workflow per model) or matrix (one workflow per queue, one job per model)
+parser.add_argument("--layout", type=str, default="model")
+# queue files of the test set, with the matrix layout only the runs of its queue workflows are read
+parser.add_argument("--queue_dir", type=str, default="../config/queue")
+parser.add_argument("--test_set", type=str, default="huggingface-all")
 args = parser.parse_args()
 
 # constants
@@ -71,6 +82,55 @@ def get_github_workflows(token):
         json.dump(runs, f, indent=4)
     return runs
     
+# function to get the names of the queue workflows of a test set, <test_set>-<queue> as create_queue.py names them
+def get_queue_workflow_names(queue_dir, test_set):
+    names = set()
+    for queue_file in glob.glob(os.path.join(queue_dir, test_set, "*.json")):
+        with open(queue_file) as f:
+            names.add(f"{test_set}-{json.load(f)['queue_name']}")
+    return names
+
+# function to get the jobs of queue workflow runs of the matrix layout
+# each matrix job is named after its model, so the jobs are returned in the same shape as runs to reuse calculate_test_status
+# runs are newest first, so the jobs of the latest run of a model come first
+# only the runs of the queue workflows of the test set are read, one jobs api call per run
+def get_github_jobs(token, runs):
+    queue_workflows = get_queue_workflow_names(args.queue_dir, args.test_set)
+    runs = [run for run in runs if run['name'] in queue_workflows]
+    print (f"Runs of the {len(queue_workflows)} queue workflows of {args.test_set}: {len(runs)}")
+    headers = { "Authorization": f"Bearer {token}",
+                "X-GitHub-Api-Version": "2022-11-28",
+                "Accept": "application/vnd.github+json"
+    }
+    jobs = []
+    for run in runs:
+        current_page = 1
+        while True:
+            params = { "per_page": 100, "page": current_page }
+            response = requests.get(run['jobs_url'], headers=headers, params=params)
+            if response.status_code != 200:
+                print (f"Error: {response.status_code} {response.text}")
+                exit(1)
+            json_response = response.json()
+            for job in json_response['jobs']:
+                jobs.append({"name": job['name'],
+                             "status": job['status'],
+                             "conclusion": job['conclusion'],
+                             "created_at": job['started_at'] or run['created_at'],
+                             "updated_at": job['completed_at'] or job['started_at'] or run['updated_at'],
+                             "html_url": job['html_url']})
+            if current_page * 100 >= json_response['total_count']:
+                break
+            current_page += 1
+        print (f"\rJobs fetched: {len(jobs)}", end="", flush=True)
+    print (f"\n")
+    # dump jobs in ../logs/get_github_jobs, can be passed back as github_workflows_file with mode_workflow file
+    if not os.path.exists("../logs/get_github_jobs"):
+        os.makedirs("../logs/get_github_jobs")
+    with open(f"../logs/get_github_jobs/{datetime.now().strftime('%d%b%Y-%H%M%S')}.json", "w") as f:
+        json.dump(jobs, f, indent=4)
+    return jobs
+
 # function to calculate test status based on models - total tests, success, failure, not_tested, total test duration
 def calculate_test_status(runs, models):
 # get the latest run for each model
@@ -116,6 +176,16 @@ def calculate_test_status(runs, models):
 
     return results_per_model, clock_time
 
+# function to dump results_per_model as json in ../logs/calculate_test_status folder with filename as DDMMMYYYY-HHMMSS.json
+def dump_test_status(results_per_model):
+    if not os.path.exists("../logs/calculate_test_status"):
+        os.makedirs("../logs/calculate_test_status")
+    results_file = f"../logs/calculate_test_status/{datetime.now().strftime('%d%b%Y-%H%M%S')}.json"
+    with open(results_file, "w") as f:
+        json.dump(results_per_model, f, indent=4)
+    print (f"Test status per model written to {results_file}")
+    return results_file
+
 def summarize_test_status(results_per_model):
     status = {"total": 0, "success": 0, "failure": 0, "unknown": 0, "not_tested": 0, "total_duration": 0}
     #print (json.dumps(status, indent=4))
@@ -149,6 +219,12 @@ def create_badge(results_per_model, status, clock_time):
     lines.append("|-----|-----|")
     for model in results_per_model:
         # print model to stdout if label is Failure or Unknown or Not Tested         
+        if args.layout == "matrix":
+            # there is no workflow per model to show a badge for, so show the status of its latest job
+            result = results_per_model[model]
+            label = "✅" if result["success"] else "❌" if result["failure"] else "❔" if result["unknown"] else "🧪"
+            lines.append(f"{model}|{label}")
+            continue
         lines.append(f"{model}|[![{model}](https://github.com/Azure/azureml-oss-models/actions/workflows/{model}.yml/badge.svg)](https://github.com/Azure/azureml-oss-models/actions/workflows/{model}.yml)")
 
 
@@ -175,15 +251,23 @@ def main():
         print (f"Error: Invalid mode_workflow {args.mode_workflow}")
         exit(1)
     print (f"Total runs: {len(runs)}")
+    # with the matrix layout a run tests a whole queue, the status of each model is in the jobs of the run
+    if args.layout == "matrix" and args.mode_workflow == "api":
+        runs = get_github_jobs(get_github_token(), runs)
+        print (f"Total jobs: {len(runs)}")
     # if mode_model is api, get model containers using azure ml sdk
     if args.mode_model == "api":
         models = get_model_containers(args.registry_name, templates)
     elif args.mode_model == "file":
     # else, load model containers from file
         models = load_model_list_file(args.model_list_file)
+    elif args.mode_model == "catalog":
+        models = load_catalog_models(args.registry_name, args.catalog_db, args.catalog_refresh == "true", templates=templates)
     print (f"Total models: {len(models)}")
     results_per_model, clock_time = calculate_test_status(runs, models)
     print (f"Total results: {len(results_per_model)}")
+    # dump results_per_model so that create_queue.py --assignment lpt can balance queues by historical duration
+    dump_test_status(results_per_model)
     # print
     status = summarize_test_status(results_per_model)
     # dump status to STDOUT
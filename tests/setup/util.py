@@ -4,6 +4,8 @@ from azure.ai.ml import MLClient
 from azure.identity import DefaultAzureCredential
 import time, sys, os
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 # function to load model_list_file
@@ -16,40 +18,81 @@ def load_model_list_file(model_list_file):
     with open(model_list_file) as f:
         return f.read().splitlines()
 
-# function to query models from registry
-def get_model_containers(registry_name, templates):
-    counter=0
-    print (f"Getting models from registry {registry_name}")
-    models=[]
-    model_details={}
+# number of threads used to list model versions, each thread makes one blocking call to the registry at a time
+DEFAULT_LIST_WORKERS = 16
+# number of times a failed registry call is retried, waiting backoff, 2 x backoff, 4 x backoff... seconds in between
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 2
+
 
+# function to get the registry client, exits if auth fails
+def get_registry_client(registry_name):
     try:
         credential = DefaultAzureCredential()
         credential.get_token("https://management.azure.com/.default")
     except Exception as ex:
-        print ("::error Auth failed, DefaultAzureCredential not working: \n{e}")
+        print (f"::error Auth failed, DefaultAzureCredential not working: \n{ex}")
         exit (1)
-    registry_ml_client = MLClient(credential, registry_name=registry_name)
-    model_containers=registry_ml_client.models.list()
-    
-    for model_container in model_containers:
-        # if model_container.name is in templates, skip
-        if model_container.name in templates:
-            continue
+    return MLClient(credential, registry_name=registry_name)
+
+# function to list all versions of a model, retried with exponential backoff
+def list_model_versions(registry_ml_client, model_name, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    for attempt in range(retries + 1):
+        try:
+            return list(registry_ml_client.models.list(name=model_name))
+        except Exception as e:
+            if attempt == retries:
+                print (f"\n::error Listing versions of {model_name} failed after {retries + 1} attempts: \n{e}")
+                raise
+            wait = backoff * (2 ** attempt)
+            print (f"\n::warning:: Listing versions of {model_name} failed, retrying in {wait}s: \n{e}")
+            time.sleep(wait)
+
+# function to count the versions of a model and get the latest one
+# bug - registry_ml_client.models.list() is not supposed to return archived models
+# workaround to check if model is archived - get all versions and check if count is 0
+def get_model_versions(registry_ml_client, model_name, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    model_versions = list_model_versions(registry_ml_client, model_name, retries, backoff)
+    if not model_versions:
+        return 0, None
+    return len(model_versions), model_versions[-1]
 
-        # bug - registry_ml_client.models.list() is not supposed to return archived models
-        # workaround to check if model is archived - get all versions and check if count is 0 
-        model_versions=registry_ml_client.models.list(name=model_container.name)
-        model_version_count=0
-        # can't just check len(model_versions) because it is a iterator
-        latest_model=None
-        for model in model_versions:
-            model_version_count = model_version_count + 1
-            latest_model=model
-        if model_version_count == 0:
-            continue
-        models.append(model_container.name)
-        model_details[model_container.name] = latest_model
+# function to stream models from registry as (name, latest model version) tuples
+# versions are listed on a bounded thread pool, but models are yielded in the order of the registry listing
+# so callers can start working on the first models before the enumeration finishes and the output is deterministic
+def iter_model_containers(registry_name, templates=None, max_workers=DEFAULT_LIST_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    templates = templates or []
+    registry_ml_client = get_registry_client(registry_name)
+    # keep a bounded window of pending lookups, so a slow model holds back at most this many finished ones
+    window = max(1, max_workers) * 4
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for model_container in registry_ml_client.models.list():
+            # if model_container.name is in templates, skip
+            if model_container.name in templates:
+                continue
+            pending.append((model_container.name, executor.submit(get_model_versions, registry_ml_client, model_container.name, retries, backoff)))
+            while len(pending) >= window or (pending and pending[0][1].done()):
+                name, future = pending.popleft()
+                model_version_count, latest_model = future.result()
+                if model_version_count > 0:
+                    yield name, latest_model
+        while pending:
+            name, future = pending.popleft()
+            model_version_count, latest_model = future.result()
+            if model_version_count > 0:
+                yield name, latest_model
+
+# function to query models from registry
+def get_model_containers(registry_name, templates=None, max_workers=DEFAULT_LIST_WORKERS):
+    counter=0
+    print (f"Getting models from registry {registry_name}")
+    models=[]
+    model_details={}
+
+    for name, latest_model in iter_model_containers(registry_name, templates, max_workers):
+        models.append(name)
+        model_details[name] = latest_model
         # print progress
         counter=counter+1
         sys.stdout.write(f'{counter}\r')
@@ -63,4 +106,3 @@ def get_model_containers(registry_name, templates):
         json.dump(models, f, indent=4)
 
     return models
-
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import hashlib
+from workflow_renderer import render_workflow, write_rendered_files, DEFAULT_WRITERS
+
+# the manifest records the hash of every workflow file generated for a test set
+# so that the next create_queue.py run only touches the files that actually changed
+MANIFEST_VERSION = 1
+
+
+# function to get the manifest file for a test set, stored next to the queue set folder
+def manifest_file_name(queue_dir, test_set):
+    return os.path.join(queue_dir, f"{test_set}.manifest.json")
+
+
+# function to hash rendered workflow content
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# function to load the manifest, returns an empty manifest if the file does not exist or cannot be read
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {"version": MANIFEST_VERSION, "workflows": {}}
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except Exception as e:
+        print (f"::warning:: Could not read manifest {manifest_file}, regenerating all workflow files: \n{e}")
+        return {"version": MANIFEST_VERSION, "workflows": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        print (f"::warning:: Manifest {manifest_file} has version {manifest.get('version')}, expected {MANIFEST_VERSION}. Regenerating all workflow files")
+        return {"version": MANIFEST_VERSION, "workflows": {}}
+    return manifest
+
+
+def save_manifest(manifest_file, manifest):
+    manifest_dir = os.path.dirname(manifest_file)
+    if manifest_dir and not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    # write to a temp file and rename so an interrupted run never leaves a half written manifest
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+# function to hash a workflow file already on disk, returns None if the file does not exist
+def hash_existing_file(workflow_dir, file_name):
+    workflow_file = os.path.join(workflow_dir, file_name)
+    if not os.path.exists(workflow_file):
+        return None
+    with open(workflow_file) as f:
+        return content_hash(f.read())
+
+
+# function to render all workflows and write only the ones that are new or changed since the last run
+# workflows for models that are in the manifest but not in this run are deleted from workflow_dir
+# workflows is a list of (file_name, values) tuples, same as workflow_renderer.write_workflow_files
+# returns a dictionary with the count of added, changed, removed and unchanged files
+def sync_workflow_files(template, workflows, workflow_dir, manifest_file, max_writers=DEFAULT_WRITERS):
+    start = time.time()
+    manifest = load_manifest(manifest_file)
+    previous = manifest["workflows"]
+    current = {}
+    to_write = []
+    report = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    for file_name, values in workflows:
+        content = render_workflow(template, values)
+        digest = content_hash(content)
+        current[file_name] = {"model": values.get("test_model_name"), "hash": digest}
+        if file_name in previous:
+            # trust the manifest, but make sure nobody deleted or edited the file by hand
+            if previous[file_name]["hash"] == digest and hash_existing_file(workflow_dir, file_name) == digest:
+                report["unchanged"] += 1
+                continue
+            report["changed"] += 1
+        else:
+            # first run with a manifest, files that already have the same content are not rewritten
+            if hash_existing_file(workflow_dir, file_name) == digest:
+                report["unchanged"] += 1
+                continue
+            report["added"] += 1
+        to_write.append((file_name, content))
+    write_rendered_files(to_write, workflow_dir, max_writers)
+    # delete workflows for models that were removed from the test set
+    for file_name in previous:
+        if file_name in current:
+            continue
+        workflow_file = os.path.join(workflow_dir, file_name)
+        if os.path.exists(workflow_file):
+            os.remove(workflow_file)
+        report["removed"] += 1
+    manifest["workflows"] = current
+    manifest["workflow_dir"] = workflow_dir
+    save_manifest(manifest_file, manifest)
+    report["elapsed"] = time.time() - start
+    return report
@@ -0,0 +1,144 @@
+import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# fields in the workflow template that are substituted for every model
+# the template is the source of truth for the layout, we only swap the values of these keys
+WORKFLOW_FIELDS = ["test_model_name", "test_sku_type", "test_trigger_next_model", "test_queue", "test_set", "test_keep_looping", "test_secret_name", "test_dispatcher_db", "test_endpoint_pool_db", "test_max_jobs", "runs-on"]
+
+# labels of the github hosted runners, every job on them starts on a new machine, so a local database is not shared between jobs
+GITHUB_HOSTED_PREFIXES = ("ubuntu-", "windows-", "macos-")
+
+# default number of threads used to write workflow files
+DEFAULT_WRITERS = 8
+
+# github allows at most 256 jobs in a matrix, a queue workflow tests longer queues in chunks of this size
+MATRIX_MAX_JOBS = 256
+
+# pattern to find the top level workflow name, this is the name shown in the github actions UI
+NAME_PATTERN = re.compile(r"^name: .*$")
+# pattern to find a 'key: value' line, keeping the indentation so that yaml stays valid
+FIELD_PATTERN = re.compile(r"^(\s*)(" + "|".join(WORKFLOW_FIELDS) + r"): .*$")
+
+
+# function to parse the workflow template once
+# returns the template lines and the line numbers of the fields that are substituted per model
+# the template is never modified, unlike the old 'cp + sed -i' flow
+def parse_workflow_template(workflow_template):
+    with open(workflow_template) as f:
+        lines = f.read().split("\n")
+    fields = {}
+    for index, line in enumerate(lines):
+        if NAME_PATTERN.match(line):
+            fields[index] = ("", "name")
+            continue
+        match = FIELD_PATTERN.match(line)
+        if match:
+            fields[index] = (match.group(1), match.group(2))
+    if not fields:
+        print (f"::warning:: No substitution fields found in workflow template {workflow_template}")
+    return {"lines": lines, "fields": fields}
+
+
+# function to render a workflow in memory
+# values is a dictionary with the workflow 'name' and the WORKFLOW_FIELDS to substitute
+# fields not present in values are left as they are in the template
+def render_workflow(template, values):
+    lines = list(template["lines"])
+    for index, (indent, key) in template["fields"].items():
+        if key in values:
+            lines[index] = f"{indent}{key}: {values[key]}"
+    return "\n".join(lines)
+
+
+# function to get the workflow file name for a model, same naming as the github workflow badges
+def workflow_file_name(model):
+    return model.replace('/', '-') + ".yml"
+
+
+# function to quote a path for a workflow env value
+# a bare 'key: ' is null in yaml and github rejects null env values, and a path can have characters yaml would parse
+# a json string is a valid double quoted yaml string
+def yaml_string(value):
+    return json.dumps(value or "")
+
+
+# function to tell whether a runs-on label is a github hosted runner
+def is_github_hosted(runs_on):
+    return runs_on.startswith(GITHUB_HOSTED_PREFIXES)
+
+
+# function to build the substitution values for a single model workflow
+def workflow_values(model, queue_name, secret_name, test_set, test_sku_type, test_trigger_next_model, test_keep_looping, test_dispatcher_db="", test_endpoint_pool_db="", runs_on="ubuntu-latest"):
+    return {
+        "name": model,
+        "test_model_name": model,
+        "test_queue": queue_name,
+        "test_sku_type": test_sku_type,
+        "test_trigger_next_model": test_trigger_next_model,
+        "test_keep_looping": test_keep_looping,
+        "test_set": test_set,
+        "test_secret_name": secret_name,
+        "test_dispatcher_db": yaml_string(test_dispatcher_db),
+        "test_endpoint_pool_db": yaml_string(test_endpoint_pool_db),
+        "runs-on": runs_on,
+    }
+
+
+# function to get the workflow file name for a queue, used by the matrix layout
+# the test set is part of the name so that queues of different test sets do not overwrite each other
+def queue_workflow_file_name(test_set, queue_name):
+    return f"{test_set}-{queue_name}.yml"
+
+
+# function to build the substitution values for a queue workflow of the matrix layout
+# the models are not part of the workflow, the matrix is read from the queue file when the workflow runs
+def queue_workflow_values(queue_name, secret_name, test_set, test_sku_type, test_keep_looping, test_max_jobs=MATRIX_MAX_JOBS):
+    return {
+        "name": f"{test_set}-{queue_name}",
+        "test_queue": queue_name,
+        "test_sku_type": test_sku_type,
+        "test_keep_looping": test_keep_looping,
+        "test_set": test_set,
+        "test_secret_name": secret_name,
+        "test_max_jobs": test_max_jobs,
+    }
+
+
+# function to write a single rendered workflow file
+def write_workflow_file(workflow_dir, file_name, content):
+    # clean up the demo_ copy left over by older versions of create_queue.py
+    demo_file = os.path.join(workflow_dir, f"demo_{file_name}")
+    if os.path.exists(demo_file):
+        os.remove(demo_file)
+    with open(os.path.join(workflow_dir, file_name), "w") as f:
+        f.write(content)
+
+
+# function to write already rendered workflow files on a bounded pool of writer threads
+# files is a list of (file_name, content) tuples
+# returns the number of files written
+def write_rendered_files(files, workflow_dir, max_writers=DEFAULT_WRITERS):
+    if not os.path.exists(workflow_dir):
+        os.makedirs(workflow_dir)
+    counter = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_writers)) as executor:
+        futures = [executor.submit(write_workflow_file, workflow_dir, file_name, content) for file_name, content in files]
+        # surface any write error, the executor keeps going for the rest of the files
+        for future in futures:
+            future.result()
+            counter = counter + 1
+    return counter
+
+
+# function to render and write all workflow files in one pass
+# workflows is a list of (file_name, values) tuples
+# rendering happens on the calling thread, writing happens on a bounded pool of writer threads
+# returns the number of files written and the time taken in seconds
+def write_workflow_files(template, workflows, workflow_dir, max_writers=DEFAULT_WRITERS):
+    start = time.time()
+    files = [(file_name, render_workflow(template, values)) for file_name, values in workflows]
+    counter = write_rendered_files(files, workflow_dir, max_writers)
+    return counter, time.time() - start
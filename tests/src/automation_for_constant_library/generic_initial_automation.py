@@ -8,10 +8,17 @@ import mlflow
 import json
 import os
 import sys
+import shutil
+import tempfile
 from box import ConfigBox
 
 # constants
 check_override = True
+# modules of tests/src the register job imports, directly or through the other modules
+REGISTER_MODULES = ["hf_model_info.py", "hf_task_index.py", "model_inspection.py", "registered_revision.py", "shard_downloader.py",
+                    "signature_stage.py", "snapshot_cache.py", "zero_copy_logging.py"]
+# files of this folder the register job runs or reads
+REGISTER_FILES = ["generic_model_download_and_register.py", "task_and_library.json", "sample_inputs"]
 
 
 def get_error_messages():
@@ -34,6 +41,10 @@ test_trigger_next_model = os.environ.get('test_trigger_next_model')
 # test queue name - the queue file contains the list of models to test with with a specific workspace
 test_queue = os.environ.get('test_queue')
 
+# queue of the worker that runs this model, differs from test_queue when the model was stolen from another queue
+# through ../dispatcher.py. the model runs on the workspace of the worker queue, so stealing uses the idle workspace
+test_worker_queue = os.environ.get('test_worker_queue') or test_queue
+
 # test set - the set of queues to test with. a test queue belongs to a test set
 test_set = os.environ.get('test_set')
 
@@ -41,14 +52,17 @@ test_set = os.environ.get('test_set')
 # which means that the first model in the queue is triggered again after the last model is tested
 test_keep_looping = os.environ.get('test_keep_looping')
 
+# shared work queue database of ../dispatcher.py, when set the next model is claimed from it in a later workflow step
+test_dispatcher_db = os.environ.get('test_dispatcher_db', '')
+
 # function to load the workspace details from test queue file
 # even model we need to test belongs to a queue. the queue name is passed as environment variable test_queue
 # the queue file contains the list of models to test with with a specific workspace
 # the queue file also contains the details of the workspace, registry, subscription, resource group
 
 
-def get_test_queue() -> ConfigBox:
-    queue_file = f"../../config/queue/{test_set}/{test_queue}.json"
+def get_test_queue(queue_name=None) -> ConfigBox:
+    queue_file = f"../../config/queue/{test_set}/{queue_name or test_queue}.json"
     with open(queue_file) as f:
         return ConfigBox(json.load(f))
 # function to load the sku override details from sku-override file
@@ -68,12 +82,17 @@ def get_sku_override():
 # so that the next step in this job can pick it up and trigger the next model using 'gh workflow run' cli command
 def set_next_trigger_model(queue):
     print("In set_next_trigger_model...")
+    if test_dispatcher_db:
+        print(f"::notice:: next model is claimed from dispatcher {test_dispatcher_db}")
+        return
 # file the index of test_model_name in models list queue dictionary
     model_list = list(queue.models)
     #model_name_without_slash = test_model_name.replace('/', '-')
     check_mlflow_model = "MLFlow-"+test_model_name
     index = model_list.index(check_mlflow_model)
     #index = model_list.index(test_model_name)
+    # the models of the batch of test_model_name are registered by this job, the next model is the one after them
+    index = index + len(get_model_batch(queue, test_model_name)) - 1
     print(f"index of {test_model_name} in queue: {index}")
 # if index is not the last element in the list, get the next element in the list
     if index < len(model_list) - 1:
@@ -90,6 +109,42 @@ def set_next_trigger_model(queue):
         print(f'NEXT_MODEL={next_model}', file=fh)
 
 
+# function to get the model info resolved by create_queue.py --enrich, the queue entries have the MLFlow- prefix
+def get_model_info(queue, model_name):
+    models_info = queue.get("models_info", {})
+    return models_info.get("MLFlow-"+model_name) or models_info.get(model_name) or {}
+
+
+# function to get the models registered in one job with model_name, the batch of create_queue.py --test_batch_size
+# that starts with it, named like model_name. without batches in the queue file the model is registered on its own
+def get_model_batch(queue, model_name):
+    for batch in queue.get("batches", []):
+        if model_name in batch:
+            return list(batch)
+        names = [model[len("MLFlow-"):] if model.startswith("MLFlow-") else model for model in batch]
+        if model_name in names:
+            return names
+    return [model_name]
+
+
+# function to stage the code of the register job in a temp folder, the register script with the files it reads and the
+# modules it imports from tests/src, in the same layout, instead of uploading all of tests/src for every job
+def get_register_code():
+    code_dir = tempfile.mkdtemp(prefix="register-code-")
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in REGISTER_MODULES:
+        shutil.copy(os.path.join(os.path.dirname(folder), module), code_dir)
+    os.makedirs(os.path.join(code_dir, os.path.basename(folder)))
+    for file_name in REGISTER_FILES:
+        source = os.path.join(folder, file_name)
+        target = os.path.join(code_dir, os.path.basename(folder), file_name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy(source, target)
+    return code_dir
+
+
 def create_or_get_compute_target(ml_client,  compute):
     cpu_compute_target = compute
     try:
@@ -130,6 +185,8 @@ if __name__ == "__main__":
         exit(1)
 
     queue = get_test_queue()
+    # the workspace comes from the worker queue, the model info from the queue the model was assigned to
+    worker_queue = queue if test_worker_queue == test_queue else get_test_queue(test_worker_queue)
 
     # sku_override = get_sku_override()
     # if sku_override is None:
@@ -138,14 +195,15 @@ if __name__ == "__main__":
     if test_trigger_next_model == "true":
         set_next_trigger_model(queue)
     # print values of all above variables
-    print (f"test_subscription_id: {queue['subscription']}")
-    print (f"test_resource_group: {queue['subscription']}")
-    print (f"test_workspace_name: {queue['workspace']}")
+    print (f"test_subscription_id: {worker_queue['subscription']}")
+    print (f"test_resource_group: {worker_queue['subscription']}")
+    print (f"test_workspace_name: {worker_queue['workspace']}")
     print (f"test_model_name: {test_model_name}")
     print (f"test_sku_type: {test_sku_type}")
     print (f"test_registry: queue['registry']")
     print (f"test_trigger_next_model: {test_trigger_next_model}")
     print (f"test_queue: {test_queue}")
+    print (f"test_worker_queue: {test_worker_queue}")
     print (f"test_set: {test_set}")
     print("Here is my test model name : ", test_model_name)
     try:
@@ -154,43 +212,56 @@ if __name__ == "__main__":
     except Exception as ex:
         # Fall back to InteractiveBrowserCredential in case DefaultAzureCredential not work
         credential = InteractiveBrowserCredential()
-    print("workspace_name : ", queue.workspace)
+    print("workspace_name : ", worker_queue.workspace)
     try:
         workspace_ml_client = MLClient.from_config(credential=credential)
     except:
         workspace_ml_client = MLClient(
             credential=credential,
-            subscription_id=queue.subscription,
-            resource_group_name=queue.resource_group,
-            workspace_name=queue.workspace
+            subscription_id=worker_queue.subscription,
+            resource_group_name=worker_queue.resource_group,
+            workspace_name=worker_queue.workspace
         )
     ws = Workspace(
-        subscription_id=queue.subscription,
-        resource_group=queue.resource_group,
-        workspace_name=queue.workspace
+        subscription_id=worker_queue.subscription,
+        resource_group=worker_queue.resource_group,
+        workspace_name=worker_queue.workspace
     )
     mlflow.set_tracking_uri(ws.get_mlflow_tracking_uri())
     compute_target = create_or_get_compute_target(
-        workspace_ml_client, queue.compute)
-    environment_variables = {"test_model_name": test_model_name}
-    env_list = workspace_ml_client.environments.list(name=queue.environment)
+        workspace_ml_client, worker_queue.compute)
+    # the task and class resolved by create_queue.py --enrich, empty values make the job look them up itself
+    model_info = get_model_info(queue, test_model_name)
+    print (f"model_info: {model_info}")
+    batch = get_model_batch(queue, test_model_name)
+    environment_variables = {"test_model_name": test_model_name, "test_model_task": model_info.get("task") or "", "test_model_auto_class": model_info.get("auto_class") or "", "test_model_sha": model_info.get("sha") or "",
+                             "test_signature_mode": os.environ.get("test_signature_mode", "inference"),
+                             "test_zero_copy_logging": os.environ.get("test_zero_copy_logging", "false"),
+                             "test_score_unchanged": os.environ.get("test_score_unchanged", "false")}
+    if len(batch) > 1:
+        # register all models of the batch in one job, each with the values resolved for it when the queue was created
+        environment_variables["test_model_batch"] = json.dumps([dict(get_model_info(queue, model), model_id=model) for model in batch])
+        print (f"Registering a batch of {len(batch)} models: {batch}")
+    env_list = workspace_ml_client.environments.list(name=worker_queue.environment)
     latest_version = 0
     for env in env_list:
         if latest_version <= int(env.version):
             latest_version = int(env.version)
     print("Latest Environment Version:", latest_version)
     latest_env = workspace_ml_client.environments.get(
-        name=queue.environment, version=str(latest_version))
+        name=worker_queue.environment, version=str(latest_version))
     print("Latest Environment :", latest_env)
-    command_job = run_azure_ml_job(code="./", command_to_run="python generic_model_download_and_register.py",
-                                   environment=latest_env, compute=queue.compute, environment_variables=environment_variables)
+    # upload the register script with the shared modules of tests/src it imports, and run from this folder as before
+    command_job = run_azure_ml_job(code=get_register_code(), command_to_run="cd automation_for_constant_library && python generic_model_download_and_register.py",
+                                   environment=latest_env, compute=worker_queue.compute, environment_variables=environment_variables)
     create_and_get_job_studio_url(command_job, workspace_ml_client)
 
-    InferenceAndDeployment = ModelInferenceAndDeployemnt(
-        test_model_name=test_model_name,
-        workspace_ml_client=workspace_ml_client,
-        registry=queue.registry
-    )
-    InferenceAndDeployment.model_infernce_and_deployment(
-        instance_type=queue.instance_type
-    )
+    for model in batch:
+        InferenceAndDeployment = ModelInferenceAndDeployemnt(
+            test_model_name=model,
+            workspace_ml_client=workspace_ml_client,
+            registry=worker_queue.registry
+        )
+        InferenceAndDeployment.model_infernce_and_deployment(
+            instance_type=get_model_info(queue, model).get("instance_type") or worker_queue.instance_type
+        )
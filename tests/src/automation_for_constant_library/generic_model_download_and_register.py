@@ -5,17 +5,24 @@ import transformers
 #from azureml.mlflow import get_mlflow_tracking_uri
 from urllib.request import urlopen
 from box import ConfigBox
-from mlflow.models import infer_signature
-from mlflow.transformers import generate_signature_output
 from mlflow.tracking.client import MlflowClient
 from mlflow.store.artifact.models_artifact_repo import ModelsArtifactRepository
-from transformers import pipeline
-from huggingface_hub import HfApi
-import pandas as pd
 import os
 import mlflow
-import re
 import json
+import sys
+import shutil
+import tempfile
+import gc
+import time
+# hf_task_index.py is shared by the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hf_task_index import get_task
+from snapshot_cache import SnapshotCache
+from registered_revision import RegisteredRevisionCache, hub_revision, COMMIT_SHA_TAG, REGISTERED, SKIPPED_UNCHANGED
+from signature_stage import build_pipeline, get_signature
+from model_inspection import inspect_model, loading_kwargs
+from zero_copy_logging import layout_model_dir, log_model_dir, pipeline_flavor, tokenizer_files
 
 
 # import json
@@ -32,75 +39,40 @@ STRING_TO_CHECK = 'transformers'
 FILE_NAME = "task_and_library.json"
 
 test_model_name = os.environ.get('test_model_name')
+# task and transformers class of the model resolved when the queue was created, empty if they were not
+test_model_task = os.environ.get('test_model_task', '')
+test_model_auto_class = os.environ.get('test_model_auto_class', '')
+test_model_sha = os.environ.get('test_model_sha', '')
+# log the model by linking the files of its cached snapshot instead of saving the pipeline again
+test_zero_copy_logging = os.environ.get('test_zero_copy_logging', 'false')
+# score the registered model also when its registration was skipped, this downloads and loads the registered model
+test_score_unchanged = os.environ.get('test_score_unchanged', 'false')
+# json list of models to register one after the other in this process, each a model name or a dictionary with
+# model_id, task, auto_class and sha as in the models_info of the queue. test_model_name is used when it is not set
+test_model_batch = os.environ.get('test_model_batch', '')
+# file the outcome of every model of the batch is written to, files under outputs are uploaded with the job
+test_batch_results_file = os.environ.get('test_batch_results_file', '../outputs/batch_registration_results.json')
+# shared by all models of the process, so the hub session and the model info cache are reused
+snapshot_cache = SnapshotCache()
 
 
 class Model:
-    def __init__(self, model_name) -> None:
+    def __init__(self, model_name, task=test_model_task, auto_class=test_model_auto_class, sha=test_model_sha) -> None:
         self.model_name = model_name
+        self.task = task
+        self.auto_class = auto_class
+        self.sha = sha
 
     def get_task(self) -> str:
-        """ This method will read the huggin face api url data in a dataframe. Then it will findout 
-        the model which is of transformer type . Then it will find that particular model and its task
+        """ This method will use the task resolved when the queue was created, or look it up in the
+        local hugging face task index. The index is refreshed incrementally, so this does not list all the models on the hub
 
         Returns:
-            str: task name
+            str: task name, empty if the model is not a transformers model with a supported task
         """
-        # response = urlopen(URL)
-        # # Load all the data with the help of json
-        # data_json = json.loads(response.read())
-        # # Convert it into dataframe and mention the specific column
-        # df = pd.DataFrame(data_json, columns=COLUMNS_TO_READ)
-        # # Find the data with the model which will be having trasnfomer tag
-        # df = df[df.tags.apply(lambda x: STRING_TO_CHECK in x)]
-        # # Find the data with that particular name
-        # required_data = df[df.modelId.apply(lambda x: x == self.model_name)]
-        # # Get the task
-        # required_data = required_data["pipeline_tag"].to_string()
-        # pattern = r'[0-9\s+]'
-        # final_data = re.sub(pattern, '', required_data)
-        # return final_data
-
-        hf_api = HfApi()
-        # Get all the1 models in the list
-        models = hf_api.list_models(
-            full=True, sort='lastModified', direction=-1)
-        # Unpack all values from the generator object
-        required_data = [i for i in models]
-
-        daata_dict = {}
-        # Loop through the list
-        for data in required_data:
-            # Loop through all the column present in the list
-            for key in data.__dict__.keys():
-                if key in LIST_OF_COLUMNS:
-                    # Check the dictionary already contains a value for that particular column
-                    if daata_dict.get(key) is None:
-                        # If the column and its value is not present then insert column and an empty list pair to the dictionary
-                        daata_dict[key] = []
-                    # Get the value for that particular column
-                    values = daata_dict.get(key)
-                    if key == 'tags':
-                        # If its tag column extract value if it is nonne then bydefault return a list with string Empty
-                        values.append(data.__dict__.get(key, ["Empty"]))
-                    else:
-                        values.append(data.__dict__.get(key, "Empty"))
-                    daata_dict[key] = values
-        # Convert dictionary to the dataframe
-        df = pd.DataFrame(daata_dict)
-        # Find the data with the model which will be having trasnfomer tag
-        df = df[df.tags.apply(lambda x: STRING_TO_CHECK in x)]
-        # Retrive the data whose task is in the list
-        df = df[df['pipeline_tag'].isin(TASK_NAME)]
-
-        # Find the data with that particular name
-        required_data = df[df.modelId.apply(lambda x: x == self.model_name)]
-        # Get the task
-        required_data = required_data["pipeline_tag"].to_string()
-        # Create pattern fiel number and space
-        pattern = r'[0-9\s+]'
-        # Replace number and space
-        final_data = re.sub(pattern, '', required_data)
-        return final_data
+        task = self.task or get_task(self.model_name)
+        print(f"The specified task is this one : {task}")
+        return task
 
     def get_sample_input_data(self, task: str):
         """This method will load the sample input data based on the task name
@@ -133,6 +105,8 @@ class Model:
         Returns:
             str: return the library name
         """
+        if self.auto_class:
+            return self.auto_class
         try:
             with open(FILE_NAME) as f:
                 model_with_library = ConfigBox(json.load(f))
@@ -161,18 +135,20 @@ class Model:
         #     model_library_name = rare_model_dict.get(self.model_name)
         #model_library_name = model_detail.to_dict()["architectures"][0]
 
-        # Get the library name from this method from which we will load the model
-        model_library_name = self.get_library_to_load_model(task=task)
+        # Inspect the size and architecture of the model before loading any weights
+        inspection = inspect_model(self.model_name, info_client=snapshot_cache.info_client)
+        # Get the library name from this method from which we will load the model, the architecture if the task has none
+        model_library_name = self.get_library_to_load_model(task=task) or inspection["architecture"]
         print("Library name is this one : ", model_library_name)
         # Load the library from the transformer
         model_library = getattr(transformers, model_library_name)
-        # From the library load the model
-        model = model_library.from_pretrained(self.model_name)
-        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # From the library load the model, through the snapshot cache so that an unchanged model is not downloaded again
+        model = snapshot_cache.from_pretrained(model_library, self.model_name, revision=self.sha, **loading_kwargs(inspection))
+        tokenizer = snapshot_cache.from_pretrained(AutoTokenizer, self.model_name, revision=self.sha)
         model_and_tokenizer = {"model": model, "tokenizer": tokenizer}
         return model_and_tokenizer
 
-    def register_model_in_workspace(self, model_and_tokenizer: dict, scoring_input: ConfigBox, task: str, registered_model_name: str, client):
+    def register_model_in_workspace(self, model_and_tokenizer: dict, scoring_input: ConfigBox, task: str, registered_model_name: str, client, revision=None):
         """ I will load the pipeline with the model name if its a fill mask task then it will get the 
         masked token and convert the input to that model type . It will generate the model signature . 
         It will log and register the model with mlflow
@@ -183,8 +159,7 @@ class Model:
             task (str): task name
         """
         # Load the transformer pipeline with the help of model and task
-        model_pipeline = transformers.pipeline(
-            task=task, model=model_and_tokenizer["model"], tokenizer=model_and_tokenizer["tokenizer"])
+        model_pipeline = build_pipeline(task, model_and_tokenizer)
         # If the task is fill-mask then get the mask_token and replace the input data with that mask token
         if task == "fill-mask":
             pipeline_tokenizer = model_pipeline.tokenizer
@@ -192,30 +167,42 @@ class Model:
                 scoring_input.input_data[index] = scoring_input.input_data[index].replace(
                     "<mask>", pipeline_tokenizer.mask_token).replace("[MASK]", pipeline_tokenizer.mask_token)
 
-        # Generate the transformer model output for that particular model
-        output = generate_signature_output(
-            model_pipeline, scoring_input.input_data)
-        # It will infer the signature directly from input and output
-        signature = infer_signature(scoring_input.input_data, output)
+        # Get the signature of the task from the cache, or from the pipeline output or the sample inputs (test_signature_mode)
+        signature = get_signature(task, scoring_input.input_data, model_pipeline)
 
         artifact_path = registered_model_name + "-artifact"
-        # With the help of mlflow log and register the model in the workspace
-        mlflow.transformers.log_model(
-            transformers_model=model_pipeline,
-            task=task,
-            artifact_path=artifact_path,
-            registered_model_name=registered_model_name,
-            signature=signature,
-            input_example=scoring_input.input_data
-        )
+        snapshot_path = snapshot_cache.snapshot_path(self.model_name, self.sha)
+        if test_zero_copy_logging == "true" and os.path.isdir(snapshot_path):
+            # Lay out the mlflow model next to the snapshot, so its files are hardlinked, and upload it as it is
+            model_dir = tempfile.mkdtemp(dir=snapshot_cache.cache_dir, prefix=".staging-")
+            try:
+                stats = layout_model_dir(
+                    snapshot_path, os.path.join(model_dir, artifact_path), task, self.model_name,
+                    pipeline_flavor(model_pipeline), signature=signature.to_dict(), tokenizer_names=tokenizer_files(model_pipeline))
+                print(f"Laid out {artifact_path}: {stats}")
+                log_model_dir(os.path.join(model_dir, artifact_path), artifact_path, registered_model_name)
+            finally:
+                shutil.rmtree(model_dir)
+        else:
+            # With the help of mlflow log and register the model in the workspace
+            mlflow.transformers.log_model(
+                transformers_model=model_pipeline,
+                task=task,
+                artifact_path=artifact_path,
+                registered_model_name=registered_model_name,
+                signature=signature,
+                input_example=scoring_input.input_data
+            )
         registered_model_list = client.get_latest_versions(
             name=registered_model_name, stages=["None"])
         model_detail = registered_model_list[0]
         # set tag for the registered model
         client.set_model_version_tag(
             name=registered_model_name, version=model_detail.version, key="model_name", value=self.model_name)
+        # tag the version with the hugging face revision, so that the next run can skip registering it again
+        RegisteredRevisionCache(client).record(registered_model_name, model_detail.version, revision)
 
-    def download_and_register_model(self, task, scoring_input, registered_model_name, client) -> dict:
+    def download_and_register_model(self, task, scoring_input, registered_model_name, client, revision=None) -> dict:
         """ This method will be controlling all execution of methods 
 
         Returns:
@@ -229,7 +216,8 @@ class Model:
             scoring_input=scoring_input,
             task=task,
             registered_model_name=registered_model_name,
-            client=client
+            client=client,
+            revision=revision
         )
         return model_and_tokenizer
 
@@ -265,17 +253,114 @@ class Model:
         print("My outupt is this : ", output)
 
 
-if __name__ == "__main__":
-    model = Model(model_name=test_model_name)
+def register(model, client) -> str:
+    """ Registers one model unless its latest registered version has the same revision,
+    then scores the registered version with the sample input. An unchanged model is only scored
+    with test_score_unchanged, so that it is not downloaded at all
+
+    Args:
+        model (Model): model to register
+        client (MlflowClient): client of the workspace
+
+    Returns:
+        str: registration outcome
+    """
     # Get the sample input data
     task = model.get_task()
     # Get the sample input data
     scoring_input = model.get_sample_input_data(task=task)
     print("This is the task associated to the model : ", task)
     # If threr will be model namr with / then replace it
-    registered_model_name = test_model_name.replace("/", "-")
-    client = MlflowClient()
-    model.download_and_register_model(
-        task=task, scoring_input=scoring_input, registered_model_name=registered_model_name, client=client)
+    registered_model_name = model.model_name.replace("/", "-")
+    # skip the download, logging and upload if the latest registered version was registered from the same revision
+    revision = hub_revision(model.model_name, info_client=snapshot_cache.info_client)
+    if RegisteredRevisionCache(client).is_registered(registered_model_name, revision):
+        print(f"::notice:: {registered_model_name} is already registered from commit {revision[COMMIT_SHA_TAG]}, skipping registration")
+        outcome = SKIPPED_UNCHANGED
+        if test_score_unchanged != "true":
+            return outcome
+    else:
+        if revision is not None:
+            # load the snapshot of the commit the version is tagged with, the sha of the queue file can be older
+            model.sha = revision[COMMIT_SHA_TAG]
+        model.download_and_register_model(
+            task=task, scoring_input=scoring_input, registered_model_name=registered_model_name, client=client, revision=revision)
+        outcome = REGISTERED
     model.registered_model_inference(
         task=task, scoring_input=scoring_input, registered_model_name=registered_model_name, client=client)
+    return outcome
+
+
+def free_model_memory():
+    """ Drops the models and tokenizers loaded so far, so that the next model of a batch starts with the memory of the first
+    """
+    SnapshotCache.loaded.clear()
+    gc.collect()
+    if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+        sys.modules["torch"].cuda.empty_cache()
+
+
+def register_batch(models: list, client, results_file: str) -> list:
+    """ Registers the models one after the other in this process, with the imports, mlflow client and hub session
+    of the first model. A model that fails does not stop the batch, its error is written to the results file
+
+    Args:
+        models (list): Model objects to register
+        client (MlflowClient): client of the workspace
+        results_file (str): json file the outcome of every model is written to
+
+    Returns:
+        list: outcome, error and duration of every model
+    """
+    results = []
+    for index, model in enumerate(models):
+        print(f"Registering {model.model_name}, {index + 1} of {len(models)}")
+        start = time.time()
+        result = {"model_name": model.model_name, "outcome": None, "error": None}
+        try:
+            result["outcome"] = register(model, client)
+        except Exception as e:
+            print(f"::error:: Could not register {model.model_name}: \n{e}")
+            result["outcome"] = "failed"
+            result["error"] = str(e)
+        finally:
+            free_model_memory()
+        result["seconds"] = round(time.time() - start, 1)
+        results.append(result)
+        # write after every model, so the outcomes so far are kept if the job is cancelled
+        results_dir = os.path.dirname(results_file)
+        if results_dir and not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+        with open(results_file, "w") as f:
+            json.dump(results, f, indent=4)
+        mlflow.set_tag(f"registration_outcome/{model.model_name.replace('/', '-')}", result["outcome"])
+    failed = [result["model_name"] for result in results if result["outcome"] == "failed"]
+    print(f"Registered {len(models) - len(failed)} of {len(models)} models, results in {results_file}")
+    return results
+
+
+def batch_models(model_batch: str) -> list:
+    """ Builds the models of a batch from the json list of test_model_batch
+    """
+    models = []
+    for entry in json.loads(model_batch):
+        if isinstance(entry, str):
+            models.append(Model(model_name=entry, task="", auto_class="", sha=""))
+        else:
+            models.append(Model(model_name=entry["model_id"], task=entry.get("task") or "",
+                                auto_class=entry.get("auto_class") or "", sha=entry.get("sha") or ""))
+    return models
+
+
+if __name__ == "__main__":
+    client = MlflowClient()
+    if test_model_batch:
+        results = register_batch(batch_models(test_model_batch), client, test_batch_results_file)
+        mlflow.log_artifact(test_batch_results_file)
+        if any(result["outcome"] == "failed" for result in results):
+            sys.exit(1)
+    else:
+        model = Model(model_name=test_model_name)
+        outcome = register(model, client)
+        mlflow.set_tag("registration_outcome", outcome)
+        print(f"Registration outcome : {outcome}")
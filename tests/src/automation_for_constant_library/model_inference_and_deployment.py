@@ -16,6 +16,15 @@ import mlflow
 from box import ConfigBox
 import re
 import sys
+# model_version_resolver.py is shared by the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from model_version_resolver import ModelVersionResolver
+from endpoint_pool import EndpointPool
+from deployment_orchestrator import run_together
+from package_environment_cache import PackageEnvironmentCache
+
+# database of the warm endpoint pool of endpoint_pool.py, when set the model is deployed to a leased endpoint of the pool
+test_endpoint_pool_db = os.environ.get('test_endpoint_pool_db', '')
 
 
 class ModelInferenceAndDeployemnt:
@@ -23,6 +32,7 @@ class ModelInferenceAndDeployemnt:
         self.test_model_name = test_model_name
         self.workspace_ml_client = workspace_ml_client
         self.registry = registry
+        self.endpoint_pool = EndpointPool(workspace_ml_client, workspace_ml_client.workspace_name, test_endpoint_pool_db) if test_endpoint_pool_db else None
 
     def get_error_messages(self):
         # load ../../config/errors.json into a dictionary
@@ -51,22 +61,9 @@ class ModelInferenceAndDeployemnt:
 
     def get_latest_model_version(self, workspace_ml_client, model_name):
         print("In get_latest_model_version...")
-        version_list = list(workspace_ml_client.models.list(model_name))
-        if len(version_list) == 0:
-            print("Model not found in registry")
-        else:
-            model_version = version_list[0].version
-            foundation_model = workspace_ml_client.models.get(
-                model_name, model_version)
-            print(
-                "\n\nUsing model name: {0}, version: {1}, id: {2} for inferencing".format(
-                    foundation_model.name, foundation_model.version, foundation_model.id
-                )
-            )
-        print(
-            f"Latest model {foundation_model.name} version {foundation_model.version} created at {foundation_model.creation_context.created_at}")
-        #print(f"Model Config : {latest_model.config}")
-        return foundation_model
+        # the model was just registered, so the versions are listed without the cache, see model_version_resolver.py in tests/src
+        resolver = ModelVersionResolver(workspace_ml_client, workspace_ml_client.workspace_name, cache=False)
+        return resolver.resolve(model_name)
 
     def cloud_inference(self, scoring_file, scoring_input, online_endpoint_name, deployment_name):
         try:
@@ -94,30 +91,36 @@ class ModelInferenceAndDeployemnt:
             print(f"::error:: Could not invoke endpoint: \n")
             print(f"{e}\n\n check logs:\n\n")
 
+    # endpoint is None for a warm endpoint leased from the pool, it already exists and only the package is built
     def create_model_package(self, latest_model, endpoint):
         print("In create_model_package...")
         model_configuration = ModelConfiguration(mode="download")
-        package_name = f"package-v2-{latest_model.name}"
-        package_config = ModelPackage(
+        # the package environment is named after the model name and version,
+        # a model version that was packaged before, for example by an earlier run, reuses its environment
+        package_cache = PackageEnvironmentCache(self.workspace_ml_client)
+        package_config = lambda package_name: ModelPackage(
             target_environment_name=package_name,
             inferencing_server=AzureMLOnlineInferencingServer(),
             model_configuration=model_configuration
         )
-        model_package = self.workspace_ml_client.models.package(
-            latest_model.name,
-            latest_model.version,
-            package_config
+        if endpoint is None:
+            model_package = package_cache.package(latest_model, package_config)
+            package_cache.report()
+            return model_package
+        # the package and the endpoint do not depend on each other, so the endpoint is created while the package is built
+        model_package, endpoint_result = run_together(
+            lambda: package_cache.package(latest_model, package_config),
+            lambda: self.workspace_ml_client.begin_create_or_update(endpoint).result()
         )
-        try:
-            self.workspace_ml_client.begin_create_or_update(endpoint).result()
-        except Exception as e:
-            _, _, exc_tb = sys.exc_info()
+        package_cache.report()
+        if isinstance(endpoint_result, Exception):
             print(f"::error:: Could not create endpoint: \n")
-            print(f"The exception occured at this line no : {exc_tb.tb_lineno}" +
-                  " the exception is this one :", e)
-            print(f"{e}\n\n check logs:\n\n")
-            self.prase_logs(str(e))
+            print(" the exception is this one :", endpoint_result)
+            print(f"{endpoint_result}\n\n check logs:\n\n")
+            self.prase_logs(str(endpoint_result))
             exit(1)
+        if isinstance(model_package, Exception):
+            raise model_package
         return model_package
 
     def create_online_deployment(self, latest_model, online_endpoint_name, model_package, instance_type):
@@ -148,6 +151,9 @@ class ModelInferenceAndDeployemnt:
         else:
             deployment_name = latest_model_name
         print("deployment name is this one : ", deployment_name)
+        if self.endpoint_pool is not None:
+            # recorded before it is created, so that a deployment that fails half way is deleted as well
+            self.endpoint_pool.record_deployment(online_endpoint_name, deployment_name)
         deployment_config = ManagedOnlineDeployment(
             name=deployment_name,
             model=latest_model,
@@ -168,8 +174,10 @@ class ModelInferenceAndDeployemnt:
             self.prase_logs(str(e))
             self.get_online_endpoint_logs(
                 deployment_name, online_endpoint_name)
-            self.workspace_ml_client.online_endpoints.begin_delete(
-                name=online_endpoint_name).wait()
+            # endpoints of the pool are kept, releasing them deletes the deployment
+            if self.endpoint_pool is None:
+                self.workspace_ml_client.online_endpoints.begin_delete(
+                    name=online_endpoint_name).wait()
             exit(1)
 
         return deployment_name
@@ -223,12 +231,24 @@ class ModelInferenceAndDeployemnt:
         print("Task is : ", task)
         scoring_file, scoring_input = self.get_task_specified_input(task=task)
         self.local_inference(task=task, latest_model=latest_model, scoring_input=scoring_input)
+        if self.endpoint_pool is not None:
+            # swap the deployment into a warm endpoint of the pool instead of creating and deleting an endpoint
+            # the endpoint is released also when a step below exits with an error
+            with self.endpoint_pool.leased(self.test_model_name) as online_endpoint_name:
+                if online_endpoint_name is not None:
+                    self.deploy_to_endpoint(latest_model, online_endpoint_name, instance_type, leased=True)
+                    return
         # endpoint names need to be unique in a region, hence using timestamp to create unique endpoint name
         timestamp = int(time.time())
         online_endpoint_name = task + str(timestamp)
         #online_endpoint_name = "Testing" + str(timestamp)
+        self.deploy_to_endpoint(latest_model, online_endpoint_name, instance_type)
+        self.delete_online_endpoint(online_endpoint_name=online_endpoint_name)
+
+    # leased is True for a warm endpoint of the pool, it is not created or updated, which would also drop the tags of the pool
+    def deploy_to_endpoint(self, latest_model, online_endpoint_name, instance_type, leased=False):
         print(f"online_endpoint_name: {online_endpoint_name}")
-        endpoint = ManagedOnlineEndpoint(
+        endpoint = None if leased else ManagedOnlineEndpoint(
             name=online_endpoint_name,
             auth_mode="key",
         )
@@ -246,4 +266,4 @@ class ModelInferenceAndDeployemnt:
         #     online_endpoint_name=online_endpoint_name,
         #     deployment_name=deployment_name
         # )
-        self.delete_online_endpoint(online_endpoint_name=online_endpoint_name)
+        return deployment_name
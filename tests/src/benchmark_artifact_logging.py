@@ -0,0 +1,87 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from fake_hub_server import create_fake_model
+from zero_copy_logging import layout_model_dir, upload_dir, LocalArtifactStore, DEFAULT_CHUNK_SIZE, DEFAULT_UPLOAD_WORKERS, MODEL_FILES, TOKENIZER_FILES
+
+# benchmark for zero_copy_logging.py, reports the bytes written on the register machine per registered byte
+# copy is what mlflow.transformers.log_model does, it writes the whole model to a local dir before uploading it
+# zero-copy links the snapshot files into the model dir and only writes MLmodel and the environment files
+# does not need azure or the hub, the model is random shards and the artifact store is LocalArtifactStore in a temp dir
+# the snapshot has the weights in safetensors and pytorch .bin like many hub repos, and a README and LICENSE,
+# the registered model of both modes should only have the safetensors weights, the config and the tokenizer
+parser = argparse.ArgumentParser()
+# number of safetensors shards of the synthetic model
+parser.add_argument("--shards", type=int, default=4)
+# size of each shard in MB
+parser.add_argument("--shard_mb", type=float, default=64)
+# size of the upload blocks in MB
+parser.add_argument("--chunk_mb", type=float, default=DEFAULT_CHUNK_SIZE / 1024 / 1024)
+# number of concurrent block uploads
+parser.add_argument("--upload_workers", type=int, default=DEFAULT_UPLOAD_WORKERS)
+args = parser.parse_args()
+FLAVOR = {"instance_type": "TextGenerationPipeline", "pipeline_model_type": "FakeForCausalLM", "tokenizer_type": "FakeTokenizer", "transformers_version": "bench"}
+
+
+# function to add the files a hub repo has besides the safetensors weights, a .bin copy of the weights and docs
+def add_repo_files(snapshot_path):
+    for file_name in os.listdir(snapshot_path):
+        if file_name.endswith(".safetensors"):
+            shutil.copyfile(os.path.join(snapshot_path, file_name), os.path.join(snapshot_path, "pytorch_" + file_name.replace(".safetensors", ".bin")))
+    for file_name, content in [("README.md", "# fake model\n"), ("LICENSE", "fake license\n"), ("tokenizer.json", "{}"), ("tokenizer_config.json", "{}")]:
+        with open(os.path.join(snapshot_path, file_name), "w") as f:
+            f.write(content)
+
+
+# what log_model writes: save_pretrained of the model in safetensors and of the tokenizer
+def copy_model_dir(snapshot_path, output_dir):
+    stats = {"linked_bytes": 0, "reflinked_bytes": 0, "copied_bytes": 0, "metadata_bytes": 0}
+    os.makedirs(os.path.join(output_dir, "model"))
+    os.makedirs(os.path.join(output_dir, "components", "tokenizer"))
+    for file_name in os.listdir(snapshot_path):
+        if file_name.endswith(".safetensors") or file_name == "model.safetensors.index.json" or file_name in MODEL_FILES:
+            target = os.path.join(output_dir, "model", file_name)
+        elif file_name in TOKENIZER_FILES:
+            target = os.path.join(output_dir, "components", "tokenizer", file_name)
+        else:
+            continue
+        shutil.copyfile(os.path.join(snapshot_path, file_name), target)
+        stats["copied_bytes"] = stats["copied_bytes"] + os.path.getsize(os.path.join(snapshot_path, file_name))
+    return stats
+
+
+def zero_copy_model_dir(snapshot_path, output_dir):
+    return layout_model_dir(snapshot_path, output_dir, "text-generation", "fake-org/fake-model", FLAVOR)
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="artifact-bench-")
+    try:
+        create_fake_model(work_dir, "fake-org/fake-model", args.shards, int(args.shard_mb * 1024 * 1024))
+        snapshot_path = os.path.join(work_dir, "fake-org/fake-model")
+        add_repo_files(snapshot_path)
+        snapshot_size = sum(os.path.getsize(os.path.join(snapshot_path, file_name)) for file_name in os.listdir(snapshot_path))
+        print (f"Snapshot: {snapshot_size / 1024 / 1024:.1f} MB, {sorted(os.listdir(snapshot_path))}")
+        rows = []
+        for mode, layout in [("copy", copy_model_dir), ("zero-copy", zero_copy_model_dir)]:
+            output_dir = os.path.join(work_dir, mode, "fake-org-fake-model-artifact")
+            start = time.time()
+            stats = layout(snapshot_path, output_dir)
+            layout_time = time.time() - start
+            store = LocalArtifactStore(os.path.join(work_dir, f"{mode}-store"))
+            registered, upload_time = upload_dir(output_dir, store, "fake-org-fake-model-artifact", int(args.chunk_mb * 1024 * 1024), args.upload_workers)
+            # the upload itself is the same for both modes, what differs is what is written before it
+            written = stats["copied_bytes"] + stats["metadata_bytes"]
+            rows.append(f"{mode}|{registered / 1024 / 1024:.1f}|{written / 1024 / 1024:.3f}|{written / max(registered, 1):.6f}|{layout_time:.2f}|{upload_time:.2f}")
+        print ("Mode|Registered MB|Written MB|Written/registered|Layout s|Upload s")
+        print ("----|-------------|----------|------------------|--------|--------")
+        for row in rows:
+            print (row)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
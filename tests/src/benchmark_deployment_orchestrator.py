@@ -0,0 +1,105 @@
+import time
+import argparse
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from fake_ml_client import FakeMLClient, DEFAULT_LATENCIES, entities
+from deployment_orchestrator import DeploymentOrchestrator, DEFAULT_MAX_PER_WORKSPACE, DEFAULT_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL, max_in_flight
+from package_environment_cache import PackageEnvironmentCache
+
+# benchmark for deployment_orchestrator.py, reports the wall clock time to deploy a test set against fake_ml_client.py
+# sequential is what the test drivers do today, every stage of a model blocks on result() before the next one starts,
+# with max_per_workspace models per workspace at a time like the parallel queues. orchestrated overlaps the package
+# and endpoint stages and drives all models from one event loop. orchestrated rerun tests the same model versions
+# again on the same workspaces, as the next run of a test set does, and reuses the packages of the first run
+# does not need azure access
+parser = argparse.ArgumentParser()
+# number of workspaces and models per workspace of the synthetic test set
+parser.add_argument("--workspaces", type=int, default=3)
+parser.add_argument("--models_per_workspace", type=int, default=6)
+parser.add_argument("--max_per_workspace", type=int, default=DEFAULT_MAX_PER_WORKSPACE)
+# seconds of simulated time per real second, the default latencies are minutes, see DEFAULT_LATENCIES of fake_ml_client.py
+parser.add_argument("--time_scale", type=float, default=0.002)
+# chance of a deployment to fail, to check that failed models still delete their endpoint
+parser.add_argument("--deployment_failure_rate", type=float, default=0.1)
+parser.add_argument("--seed", type=int, default=1)
+args = parser.parse_args()
+
+
+def synthetic_specs(clients):
+    specs = []
+    for workspace in clients:
+        for i in range(args.models_per_workspace):
+            model = SimpleNamespace(name=f"{workspace}-model-{i}", version="1", id=f"azureml:{workspace}-model-{i}:1")
+            specs.append({"workspace": workspace, "model": model, "endpoint_name": f"ep-{workspace}-{i}", "deployment_name": "demo",
+                          "instance_type": "Standard_DS3_v2", "package": True, "scoring_file": "sample.json"})
+    return specs
+
+
+def fake_clients():
+    return {f"ws-{i}": FakeMLClient(f"ws-{i}", time_scale=args.time_scale, failures={"deployment_create": args.deployment_failure_rate}, seed=args.seed + i)
+            for i in range(args.workspaces)}
+
+
+# the lifecycle of a model as the test drivers run it, every stage waits for the previous one
+def sequential_deploy(client, spec):
+    result = {"workspace": spec["workspace"], "status": "success", "start": time.monotonic()}
+    try:
+        package_config = entities.ModelPackage(target_environment_name=f"package-v2-{spec['model'].name}")
+        model_package = client.models.package(spec["model"].name, spec["model"].version, package_config)
+        client.online_endpoints.begin_create_or_update(entities.ManagedOnlineEndpoint(name=spec["endpoint_name"], auth_mode="key")).result()
+        client.online_deployments.begin_create_or_update(entities.ManagedOnlineDeployment(
+            name=spec["deployment_name"], endpoint_name=spec["endpoint_name"], model=spec["model"], environment=model_package,
+            instance_type=spec["instance_type"], instance_count=1)).result()
+        client.online_endpoints.invoke(endpoint_name=spec["endpoint_name"], deployment_name=spec["deployment_name"], request_file=spec["scoring_file"])
+    except Exception:
+        result["status"] = "failure"
+    finally:
+        client.online_endpoints.begin_delete(name=spec["endpoint_name"]).wait()
+    result["end"] = time.monotonic()
+    return result
+
+
+def run_sequential(clients, specs):
+    executors = {workspace: ThreadPoolExecutor(max_workers=args.max_per_workspace) for workspace in clients}
+    futures = [executors[spec["workspace"]].submit(sequential_deploy, clients[spec["workspace"]], spec) for spec in specs]
+    results = [future.result() for future in futures]
+    for executor in executors.values():
+        executor.shutdown()
+    return results
+
+
+def run_orchestrated(clients, specs):
+    orchestrator = DeploymentOrchestrator(clients, args.max_per_workspace, poll_interval=DEFAULT_POLL_INTERVAL * args.time_scale,
+                                          max_poll_interval=DEFAULT_MAX_POLL_INTERVAL * args.time_scale, entities=entities)
+    # the build times of the fake client are scaled, keep them out of the history of real builds
+    for package_cache in orchestrator.package_caches.values():
+        package_cache.history_file = None
+    return orchestrator.run_all(specs)
+
+
+def main():
+    print (f"Latencies in seconds: {DEFAULT_LATENCIES}, scaled by {args.time_scale}")
+    rows = []
+    for mode, run in [("sequential", run_sequential), ("orchestrated", run_orchestrated), ("orchestrated rerun", run_orchestrated)]:
+        # the rerun keeps the workspaces of the orchestrated run, with the packages built by it
+        if mode != "orchestrated rerun":
+            clients = fake_clients()
+        specs = synthetic_specs(clients)
+        start = time.monotonic()
+        results = run(clients, specs)
+        elapsed = time.monotonic() - start
+        failed = len([result for result in results if result["status"] == "failure"])
+        left = sum(len(client.endpoints) for client in clients.values())
+        # report in simulated minutes, so the numbers do not depend on time_scale
+        rows.append(f"{mode}|{len(specs)}|{failed}|{elapsed / args.time_scale / 60:.1f}|{elapsed / args.time_scale / 60 / len(specs) * len(clients):.1f}|{max(max_in_flight(results).values())}|{left}")
+    print ("Mode|Models|Failed|Simulated minutes|Minutes per model per workspace|Max in flight per workspace|Endpoints left")
+    print ("----|------|------|-----------------|-------------------------------|---------------------------|--------------")
+    for row in rows:
+        print (row)
+    # build times are in real seconds here, the report scales them back to simulated minutes
+    print ("Package environment reuse of the orchestrated runs, in simulated minutes")
+    PackageEnvironmentCache(None, history_file=None).report(time_scale=args.time_scale)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,9 @@ from azure.ai.ml.entities import (
 )
 import json
 import os
+from model_version_resolver import ModelVersionResolver
+from model_inspection import inspect_model, fits_instance_type, smallest_instance_type
+from endpoint_pool import EndpointPool
 
 
 
@@ -43,6 +46,9 @@ test_set = os.environ.get('test_set')
 # which means that the first model in the queue is triggered again after the last model is tested
 test_keep_looping = os.environ.get('test_keep_looping')
 
+# database of the warm endpoint pool of endpoint_pool.py, when set the model is deployed to a leased endpoint of the pool
+test_endpoint_pool_db = os.environ.get('test_endpoint_pool_db', '')
+
 # function to load the workspace details from test queue file
 # even model we need to test belongs to a queue. the queue name is passed as environment variable test_queue
 # the queue file contains the list of models to test with with a specific workspace
@@ -84,25 +90,7 @@ def set_next_trigger_model(queue):
         print(f'NEXT_MODEL={next_model}')
         print(f'NEXT_MODEL={next_model}', file=fh)
 
-# we always test the latest version of the model
-def get_latest_model_version(registry_ml_client, model_name):
-    print ("In get_latest_model_version...")
-    # Getting latest model version from registry is not working, so get all versions and find latest
-    model_versions=registry_ml_client.models.list(name=model_name)
-    model_version_count=0
-    # can't just check len(model_versions) because it is a iterator
-    models = []
-    for model in model_versions:
-        model_version_count = model_version_count + 1
-        models.append(model)
-    # Sort models by creation time and find the latest model
-    sorted_models = sorted(models, key=lambda x: x.creation_context.created_at, reverse=True)
-    latest_model = sorted_models[0]
-    print (f"Latest model {latest_model.name} version {latest_model.version} created at {latest_model.creation_context.created_at}") 
-    print(latest_model)
-    return latest_model
-
-def get_instance_type(latest_model, sku_override, registry_ml_client, check_override):
+def get_instance_type(latest_model, sku_override, resolver, check_override):
     # determine the instance_type from the sku templates available in the model properties
     # 1. get the template name matching the sku_type
     # 2. look up template-sku.json to find the instance_type
@@ -125,7 +113,8 @@ def get_instance_type(latest_model, sku_override, registry_ml_client, check_over
     # split sku_template by / and get the 5th element into a variable called template_name
     template_name = sku_template.split("/")[5]
     print (f"template_name: {template_name}")
-    template_latest_version=get_latest_model_version(registry_ml_client, template_name)
+    # templates are shared by all models, so this is usually served from the resolver cache
+    template_latest_version=resolver.resolve(template_name)
 
     #print (template_latest_version.properties) 
     # split the properties by by the pattern "DefaultInstanceType": " and get 2nd element
@@ -137,6 +126,15 @@ def get_instance_type(latest_model, sku_override, registry_ml_client, check_over
         print (f"::error:: Could not find instance_type for {test_sku_type}")
         exit (1)
 
+    # check that the model fits in the default instance type of the template from its size, without loading it
+    # models registered by the register scripts carry their hugging face id in the model_name tag
+    inspection = inspect_model((latest_model.tags or {}).get("model_name", test_model_name))
+    if fits_instance_type(inspection, instance_type) is False:
+        larger_instance_type = smallest_instance_type(inspection)
+        if larger_instance_type is not None:
+            print (f"::warning:: {test_model_name} needs about {inspection['estimated_ram_bytes'] / 1024 ** 3:.1f} GB, more than {instance_type}. Using {larger_instance_type}")
+            instance_type = larger_instance_type
+
     if check_override:
         if latest_model.name in sku_override:
             instance_type = sku_override[test_model_name]['sku']
@@ -160,7 +158,8 @@ def create_online_endpoint(workspace_ml_client, endpoint):
     print(workspace_ml_client.online_endpoints.get(name=endpoint.name))
 
 
-def create_online_deployment(workspace_ml_client, endpoint, instance_type, latest_model):
+# endpoints of the pool are not deleted when the deployment fails, releasing them deletes the deployment instead
+def create_online_deployment(workspace_ml_client, endpoint, instance_type, latest_model, delete_endpoint_on_failure=True):
     print ("In create_online_deployment...")
     demo_deployment = ManagedOnlineDeployment(
         name="demo",
@@ -176,7 +175,8 @@ def create_online_deployment(workspace_ml_client, endpoint, instance_type, lates
         print (f"{e}\n\n check logs:\n\n")
         prase_logs(str(e))
         get_online_endpoint_logs(workspace_ml_client, endpoint.name)
-        workspace_ml_client.online_endpoints.begin_delete(name=endpoint.name).wait()
+        if delete_endpoint_on_failure:
+            workspace_ml_client.online_endpoints.begin_delete(name=endpoint.name).wait()
         exit (1)
     # online endpoints can have multiple deployments with traffic split or shadow traffic. Set traffic to 100% for demo deployment
     endpoint.traffic = {"demo": 100}
@@ -186,7 +186,8 @@ def create_online_deployment(workspace_ml_client, endpoint, instance_type, lates
         print (f"::error:: Could not create deployment\n")
         print (f"{e}\n\n check logs:\n\n")
         get_online_endpoint_logs(workspace_ml_client, endpoint.name)
-        workspace_ml_client.online_endpoints.begin_delete(name=endpoint.name).wait()
+        if delete_endpoint_on_failure:
+            workspace_ml_client.online_endpoints.begin_delete(name=endpoint.name).wait()
         exit (1)
     print(workspace_ml_client.online_deployments.get(name="demo", endpoint_name=endpoint.name))
 
@@ -313,8 +314,27 @@ def main():
         registry_name=queue['registry']
     )
 
-    latest_model = get_latest_model_version(registry_ml_client, test_model_name)
-    instance_type = get_instance_type(latest_model, sku_override, registry_ml_client, check_override)
+    # we always test the latest version of the model
+    resolver = ModelVersionResolver(registry_ml_client, queue['registry'])
+    latest_model = resolver.resolve(test_model_name)
+    if latest_model is None:
+        exit (1)
+    instance_type = get_instance_type(latest_model, sku_override, resolver, check_override)
+
+    if test_endpoint_pool_db:
+        # swap the deployment into a warm endpoint of the pool instead of creating and deleting an endpoint
+        # the endpoint is released also when a step below exits with an error
+        pool = EndpointPool(workspace_ml_client, queue['workspace'], test_endpoint_pool_db)
+        with pool.leased(test_model_name) as online_endpoint_name:
+            if online_endpoint_name is not None:
+                print (f"online_endpoint_name: {online_endpoint_name}")
+                # the leased endpoint as it is, so that setting the traffic keeps the tags of the pool
+                endpoint = workspace_ml_client.online_endpoints.get(name=online_endpoint_name)
+                pool.record_deployment(online_endpoint_name, "demo")
+                create_online_deployment(workspace_ml_client, endpoint, instance_type, latest_model, delete_endpoint_on_failure=False)
+                sample_inference(latest_model,queue['registry'], workspace_ml_client, online_endpoint_name)
+                get_online_endpoint_logs(workspace_ml_client, online_endpoint_name)
+                return
 
 # endpoint names need to be unique in a region, hence using timestamp to create unique endpoint name
 
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import glob
+import asyncio
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from model_version_resolver import ModelVersionResolver
+from package_environment_cache import PackageEnvironmentCache
+
+# drives the deployment of many models from one process, instead of one workflow run per model that waits on every step
+# the stages of a model that do not depend on each other run together: the model package is built while its endpoint
+# is created, then the deployment is created, the endpoint is scored and deleted. long running operations are polled
+# with backoff instead of blocking on result(), and models of different workspaces run concurrently, with at most
+# max_per_workspace models in flight per workspace so the quota of a workspace is not exceeded
+# the azure sdk is blocking, its calls run on a thread pool. use fake_ml_client.py to try it without a workspace
+# packages are built through package_environment_cache.py, so a model version packaged by an earlier run reuses its package
+DEFAULT_MAX_PER_WORKSPACE = 3
+# seconds between polls of a long running operation, growing by POLL_BACKOFF up to the max
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_MAX_POLL_INTERVAL = 60
+POLL_BACKOFF = 1.5
+# seconds after which a long running operation is given up
+DEFAULT_TIMEOUT = 3600
+DEPLOYMENT_NAME = "demo"
+
+
+# function to run blocking calls together and wait for all of them, returns their results in order
+# a call that failed returns its exception instead of raising it, so the caller can decide what to do for each
+def run_together(*calls):
+    async def run():
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[loop.run_in_executor(None, call) for call in calls], return_exceptions=True)
+    return asyncio.run(run())
+
+
+# function to wait for a poller of a long running azure operation without blocking the event loop
+async def wait_for(poller, description, poll_interval=DEFAULT_POLL_INTERVAL, max_poll_interval=DEFAULT_MAX_POLL_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    start = time.monotonic()
+    interval = poll_interval
+    while not poller.done():
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"{description} did not finish in {timeout}s")
+        await asyncio.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, max_poll_interval)
+    return poller.result()
+
+
+# function to get an endpoint name that is unique in the region, endpoint names are at most 32 characters
+def endpoint_name(index):
+    return f"hf-ep-{int(time.time())}-{index}"[:32]
+
+
+class DeploymentOrchestrator:
+    # workspace_clients is a dictionary of workspace name to its MLClient
+    # entities has the entity classes of azure.ai.ml.entities, or those of fake_ml_client.py
+    def __init__(self, workspace_clients, max_per_workspace=DEFAULT_MAX_PER_WORKSPACE, poll_interval=DEFAULT_POLL_INTERVAL,
+                 max_poll_interval=DEFAULT_MAX_POLL_INTERVAL, timeout=DEFAULT_TIMEOUT, entities=None):
+        self.workspace_clients = workspace_clients
+        self.max_per_workspace = max_per_workspace
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.entities = entities or importlib.import_module("azure.ai.ml.entities")
+        self.package_caches = {workspace: PackageEnvironmentCache(client) for workspace, client in workspace_clients.items()}
+        self.executor = None
+
+    async def call(self, function, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: function(*args, **kwargs))
+
+    # function to start a long running operation and poll it until it is done
+    async def long_running(self, description, begin, *args, **kwargs):
+        poller = await self.call(begin, *args, **kwargs)
+        return await wait_for(poller, description, self.poll_interval, self.max_poll_interval, self.timeout)
+
+    def package_config(self, target_environment_name):
+        return self.entities.ModelPackage(
+            target_environment_name=target_environment_name,
+            inferencing_server=self.entities.AzureMLOnlineInferencingServer(),
+            model_configuration=self.entities.ModelConfiguration(mode="download")
+        )
+
+    async def package_model(self, workspace, model):
+        # models.package blocks until the package is built, it has no poller
+        return await self.call(self.package_caches[workspace].package, model, self.package_config)
+
+    async def create_endpoint(self, client, name):
+        endpoint = self.entities.ManagedOnlineEndpoint(name=name, auth_mode="key")
+        return await self.long_running(f"endpoint {name}", client.online_endpoints.begin_create_or_update, endpoint)
+
+    async def create_deployment(self, client, spec, model_package):
+        deployment = self.entities.ManagedOnlineDeployment(
+            name=spec["deployment_name"],
+            endpoint_name=spec["endpoint_name"],
+            model=spec["model"] if model_package is not None else spec["model"].id,
+            environment=model_package,
+            instance_type=spec["instance_type"],
+            instance_count=1
+        )
+        return await self.long_running(f"deployment {spec['deployment_name']} of {spec['endpoint_name']}", client.online_deployments.begin_create_or_update, deployment)
+
+    # function to drive the lifecycle of one model, returns its outcome with the seconds spent in each stage
+    # spec has workspace, model (the latest model version), endpoint_name, deployment_name, instance_type,
+    # package (build a model package for the deployment), scoring_file (optional) and delete_endpoint
+    async def deploy(self, spec):
+        client = self.workspace_clients[spec["workspace"]]
+        result = {"model": spec["model"].name, "workspace": spec["workspace"], "endpoint": spec["endpoint_name"], "status": "success", "error": None,
+                  "stages": {}, "start": time.monotonic(), "end": None, "response": None}
+
+        async def stage(name, coroutine):
+            start = time.monotonic()
+            try:
+                return await coroutine
+            finally:
+                result["stages"][name] = round(time.monotonic() - start, 2)
+
+        try:
+            # the package only depends on the model and the endpoint only on its name, so they are built together
+            stages = [stage("endpoint", self.create_endpoint(client, spec["endpoint_name"]))]
+            if spec.get("package"):
+                stages.append(stage("package", self.package_model(spec["workspace"], spec["model"])))
+            outcomes = await asyncio.gather(*stages, return_exceptions=True)
+            for outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    raise outcome
+            model_package = outcomes[1] if spec.get("package") else None
+            await stage("deployment", self.create_deployment(client, spec, model_package))
+            if spec.get("scoring_file"):
+                result["response"] = await stage("invoke", self.call(client.online_endpoints.invoke, endpoint_name=spec["endpoint_name"],
+                                                                      deployment_name=spec["deployment_name"], request_file=spec["scoring_file"]))
+        except Exception as e:
+            print (f"::error:: Could not deploy {spec['model'].name} to {spec['endpoint_name']}: \n{e}")
+            result["status"] = "failure"
+            result["error"] = str(e)
+        finally:
+            if spec.get("delete_endpoint", True):
+                try:
+                    await stage("delete", self.long_running(f"delete of {spec['endpoint_name']}", client.online_endpoints.begin_delete, name=spec["endpoint_name"]))
+                except Exception as e:
+                    print (f"::warning:: Could not delete endpoint {spec['endpoint_name']}: \n{e}")
+        result["end"] = time.monotonic()
+        print (f"{result['status']}: {result['model']} on {result['workspace']} in {result['end'] - result['start']:.1f}s {result['stages']}")
+        return result
+
+    async def run(self, specs):
+        semaphores = {workspace: asyncio.Semaphore(self.max_per_workspace) for workspace in self.workspace_clients}
+
+        async def limited(spec):
+            async with semaphores[spec["workspace"]]:
+                return await self.deploy(spec)
+
+        # every model in flight can block a thread in a call to the sdk, models.package for minutes
+        with ThreadPoolExecutor(max_workers=max(1, len(semaphores) * self.max_per_workspace * 2)) as executor:
+            self.executor = executor
+            try:
+                return await asyncio.gather(*[limited(spec) for spec in specs])
+            finally:
+                self.executor = None
+
+    # function to deploy all models of specs, returns their outcomes in the same order
+    def run_all(self, specs):
+        return asyncio.run(self.run(specs))
+
+
+# function to get the highest number of models that were in flight at the same time per workspace
+def max_in_flight(results):
+    in_flight = {}
+    for result in results:
+        overlapping = [other for other in results if other["workspace"] == result["workspace"] and other["start"] <= result["start"] < other["end"]]
+        in_flight[result["workspace"]] = max(in_flight.get(result["workspace"], 0), len(overlapping))
+    return in_flight
+
+
+# function to load the queue files of a test set, returns them by queue name
+def load_queues(queue_dir, test_set):
+    queues = {}
+    for queue_file in sorted(glob.glob(os.path.join(queue_dir, test_set, "*.json"))):
+        with open(queue_file) as f:
+            queue = json.load(f)
+        queues[queue["queue_name"]] = queue
+    return queues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="deploy, score and delete the models of a test set from one process")
+    parser.add_argument("--queue_dir", type=str, default="../config/queue")
+    parser.add_argument("--test_set", type=str, default="huggingface-all")
+    parser.add_argument("--max_per_workspace", type=int, default=DEFAULT_MAX_PER_WORKSPACE)
+    # build a model package for each deployment, as the test_with_model_package driver does
+    parser.add_argument("--package", type=str, default="false")
+    parser.add_argument("--output_file", type=str, default="../logs/deployment_orchestrator/results.json")
+    args = parser.parse_args()
+
+    from azure.ai.ml import MLClient
+    from azure.identity import DefaultAzureCredential
+    credential = DefaultAzureCredential()
+    queues = load_queues(args.queue_dir, args.test_set)
+    if not queues:
+        print (f"::error:: No queue files found in {args.queue_dir}/{args.test_set}")
+        sys.exit(1)
+    workspace_clients = {}
+    resolvers = {}
+    specs = []
+    # models whose latest version does not resolve fail without being deployed
+    unresolved = []
+    for queue in queues.values():
+        if queue["workspace"] not in workspace_clients:
+            workspace_clients[queue["workspace"]] = MLClient(credential=credential, subscription_id=queue["subscription"],
+                                                             resource_group_name=queue["resource_group"], workspace_name=queue["workspace"])
+        if queue["registry"] not in resolvers:
+            resolvers[queue["registry"]] = ModelVersionResolver(MLClient(credential=credential, registry_name=queue["registry"]), queue["registry"])
+        latest_models = resolvers[queue["registry"]].resolve_many(queue["models"])
+        for model_name, latest_model in latest_models.items():
+            if latest_model is None:
+                print (f"::error:: Could not find the latest version of {model_name} in {queue['registry']}")
+                now = time.monotonic()
+                unresolved.append({"model": model_name, "workspace": queue["workspace"], "endpoint": None, "status": "failure",
+                                   "error": "latest version not found", "stages": {}, "start": now, "end": now, "response": None})
+                continue
+            model_info = queue.get("models_info", {}).get(model_name) or {}
+            # the task of the transformers flavor, as the test drivers read it, the task tag of the registry model otherwise
+            task = ((latest_model.flavors or {}).get("transformers") or {}).get("task") or (latest_model.tags or {}).get("task")
+            scoring_file = f"../config/sample_inputs/{queue['registry']}/{task}.json"
+            specs.append({
+                "workspace": queue["workspace"],
+                "model": latest_model,
+                "endpoint_name": endpoint_name(len(specs)),
+                "deployment_name": DEPLOYMENT_NAME,
+                "instance_type": model_info.get("instance_type") or queue["instance_type"],
+                "package": args.package == "true",
+                "scoring_file": scoring_file if os.path.exists(scoring_file) else None,
+            })
+    print (f"Deploying {len(specs)} models to {len(workspace_clients)} workspaces, at most {args.max_per_workspace} per workspace")
+    start = time.monotonic()
+    results = DeploymentOrchestrator(workspace_clients, args.max_per_workspace).run_all(specs) + unresolved
+    print (f"Deployed {len([result for result in results if result['status'] == 'success'])} of {len(results)} models in {time.monotonic() - start:.0f}s")
+    if args.package == "true":
+        PackageEnvironmentCache(None).report()
+    output_dir = os.path.dirname(args.output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output_file, "w") as f:
+        json.dump([dict(result, response=None) for result in results], f, indent=4)
+    if any(result["status"] == "failure" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
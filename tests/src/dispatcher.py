@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import glob
+import sqlite3
+import argparse
+
+# work queue for a test set, backed by a local sqlite database
+# every model of every queue file in the test set is a row. a worker (a chain of workflow runs for one queue)
+# atomically claims the next model of its own queue, steals from the queue with the most pending models
+# when its own queue is empty, and a claim that is not finished before its lease expires goes back to pending
+# the database must be on storage that all workers can reach, for example a self-hosted runner or a mounted share
+
+# default lease for a claimed model, a model test that runs longer than this is assumed to be hung
+DEFAULT_LEASE_MINUTES = 180
+# a model whose lease expired this many times is marked as failed instead of being retried again
+DEFAULT_MAX_ATTEMPTS = 2
+# seconds to wait for the database lock held by another worker
+LOCK_TIMEOUT = 60
+# prefix of the models in the queue files
+MODEL_PREFIX = "MLFlow-"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work (
+    model TEXT PRIMARY KEY,
+    queue TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS work_queue_state ON work (queue, state, position);
+"""
+
+
+def connect(db):
+    db_dir = os.path.dirname(db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    # isolation_level None so that we control the transactions, BEGIN IMMEDIATE takes the write lock up front
+    connection = sqlite3.connect(db, timeout=LOCK_TIMEOUT, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# function to load all queue files of a test set into the work table
+# existing rows are replaced, so running init again starts the test set from scratch
+# the first model of every queue is claimed by that queue, as those are started directly with 'gh workflow run'
+def init_work(db, queue_dir, test_set, lease_minutes=DEFAULT_LEASE_MINUTES):
+    queue_files = sorted(glob.glob(os.path.join(queue_dir, test_set, "*.json")))
+    connection = connect(db)
+    rows = []
+    for queue_file in queue_files:
+        with open(queue_file) as f:
+            queue = json.load(f)
+        for position, model in enumerate(queue["models"]):
+            rows.append((model, queue["queue_name"], position))
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("DELETE FROM work")
+    connection.executemany("INSERT OR REPLACE INTO work (model, queue, position, updated_at) VALUES (?, ?, ?, ?)", [row + (now,) for row in rows])
+    connection.execute("UPDATE work SET state = 'claimed', worker = queue, lease_expires = ?, attempts = 1 WHERE position = 0", (now + lease_minutes * 60,))
+    connection.execute("COMMIT")
+    connection.close()
+    print (f"Loaded {len(rows)} models from {len(queue_files)} queue files in {queue_dir}/{test_set} into {db}")
+    return len(rows)
+
+
+# function to put claims whose lease expired back to pending, or mark them failed after max_attempts
+def release_expired(connection, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    now = time.time()
+    failed = connection.execute("UPDATE work SET state = 'failed', status = 'lease_expired', worker = NULL, updated_at = ? WHERE state = 'claimed' AND lease_expires < ? AND attempts >= ?", (now, now, max_attempts)).rowcount
+    released = connection.execute("UPDATE work SET state = 'pending', worker = NULL, lease_expires = NULL, updated_at = ? WHERE state = 'claimed' AND lease_expires < ?", (now, now)).rowcount
+    if failed or released:
+        print (f"Released {released} expired claims, {failed} models failed after {max_attempts} attempts")
+    return released, failed
+
+
+# function to mark a model as finished, status is the outcome of the test, for example success or failure
+# the model is matched with and without the MLFlow- prefix of the queue files. a model that is not in the work queue
+# is an error, otherwise the model that was tested would stay claimed until its lease expires and be tested again
+def finish(connection, model, status):
+    for name in [model, model[len(MODEL_PREFIX):] if model.startswith(MODEL_PREFIX) else MODEL_PREFIX + model]:
+        if connection.execute("UPDATE work SET state = 'done', status = ?, worker = NULL, lease_expires = NULL, updated_at = ? WHERE model = ?", (status, time.time(), name)).rowcount:
+            return name
+    raise ValueError(f"{model} is not in the work queue, it cannot be marked as finished")
+
+
+# function to pick the next model for a worker of a queue
+# own queue first, in queue order. otherwise steal the last pending model of the queue with the most pending models
+def next_pending(connection, queue):
+    row = connection.execute("SELECT model FROM work WHERE queue = ? AND state = 'pending' ORDER BY position LIMIT 1", (queue,)).fetchone()
+    if row:
+        return row[0], False
+    victim = connection.execute("SELECT queue FROM work WHERE state = 'pending' GROUP BY queue ORDER BY COUNT(*) DESC, queue LIMIT 1").fetchone()
+    if victim is None:
+        return None, False
+    row = connection.execute("SELECT model FROM work WHERE queue = ? AND state = 'pending' ORDER BY position DESC LIMIT 1", (victim[0],)).fetchone()
+    return row[0], True
+
+
+# function to atomically finish the current model of a worker and claim the next one
+# returns the claimed model or an empty string when there is no work left
+def claim(db, queue, worker, finished=None, status=None, lease_minutes=DEFAULT_LEASE_MINUTES, keep_looping=False, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    connection = connect(db)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if finished:
+            finish(connection, finished, status or "unknown")
+        release_expired(connection, max_attempts)
+        model, stolen = next_pending(connection, queue)
+        if model is None and keep_looping:
+            # start the next loop over the test set once nothing is pending or running
+            running = connection.execute("SELECT COUNT(*) FROM work WHERE state = 'claimed'").fetchone()[0]
+            if running == 0:
+                connection.execute("UPDATE work SET state = 'pending', status = NULL, attempts = 0, updated_at = ?", (time.time(),))
+                model, stolen = next_pending(connection, queue)
+        if model is not None:
+            now = time.time()
+            connection.execute("UPDATE work SET state = 'claimed', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE model = ?", (worker, now + lease_minutes * 60, now, model))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    if model is None:
+        print ("::warning:: No pending models left in the test set")
+        return ""
+    print (f"Worker {worker} claimed {model}" + (" (stolen from another queue)" if stolen else ""))
+    return model
+
+
+# function to extend the lease of a model that is still running
+def renew(db, model, lease_minutes=DEFAULT_LEASE_MINUTES):
+    connection = connect(db)
+    updated = connection.execute("UPDATE work SET lease_expires = ?, updated_at = ? WHERE model = ? AND state = 'claimed'", (time.time() + lease_minutes * 60, time.time(), model)).rowcount
+    connection.close()
+    return updated == 1
+
+
+# function to count models per queue and state
+def status(db):
+    connection = connect(db)
+    counts = {}
+    for queue, state, count in connection.execute("SELECT queue, state, COUNT(*) FROM work GROUP BY queue, state ORDER BY queue"):
+        counts.setdefault(queue, {})[state] = count
+    connection.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="work stealing dispatcher for model test queues")
+    parser.add_argument("--db", type=str, default=os.environ.get("test_dispatcher_db", "../logs/dispatcher/dispatcher.db"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # init, load the queue files of a test set
+    init_parser = subparsers.add_parser("init")
+    init_parser.add_argument("--queue_dir", type=str, default="../config/queue")
+    init_parser.add_argument("--test_set", type=str, default="huggingface-all")
+    init_parser.add_argument("--lease_minutes", type=float, default=DEFAULT_LEASE_MINUTES)
+    # claim, finish the current model of the worker and claim the next one
+    claim_parser = subparsers.add_parser("claim")
+    claim_parser.add_argument("--queue", type=str, required=True)
+    claim_parser.add_argument("--worker", type=str, default=None)
+    claim_parser.add_argument("--finished", type=str, default=None)
+    claim_parser.add_argument("--status", type=str, default=None)
+    claim_parser.add_argument("--lease_minutes", type=float, default=DEFAULT_LEASE_MINUTES)
+    claim_parser.add_argument("--max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    claim_parser.add_argument("--keep_looping", type=str, default="false")
+    # write NEXT_MODEL to github step output, same as set_next_trigger_model
+    claim_parser.add_argument("--github_output", action="store_true")
+    # renew, extend the lease of a running model
+    renew_parser = subparsers.add_parser("renew")
+    renew_parser.add_argument("--model", type=str, required=True)
+    renew_parser.add_argument("--lease_minutes", type=float, default=DEFAULT_LEASE_MINUTES)
+    # release, put expired claims back to pending
+    release_parser = subparsers.add_parser("release")
+    release_parser.add_argument("--max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    # status, print models per queue and state
+    subparsers.add_parser("status")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        init_work(args.db, args.queue_dir, args.test_set, args.lease_minutes)
+    elif args.command == "claim":
+        try:
+            next_model = claim(args.db, args.queue, args.worker or args.queue, args.finished, args.status, args.lease_minutes, args.keep_looping == "true", args.max_attempts)
+        except ValueError as e:
+            print (f"::error:: {e}")
+            sys.exit(1)
+        if args.github_output:
+            with open(os.environ['GITHUB_OUTPUT'], 'a') as fh:
+                print(f'NEXT_MODEL={next_model}')
+                print(f'NEXT_MODEL={next_model}', file=fh)
+    elif args.command == "renew":
+        if not renew(args.db, args.model, args.lease_minutes):
+            print (f"::warning:: {args.model} is not claimed, lease not renewed")
+            sys.exit(1)
+    elif args.command == "release":
+        connection = connect(args.db)
+        connection.execute("BEGIN IMMEDIATE")
+        release_expired(connection, args.max_attempts)
+        connection.execute("COMMIT")
+        connection.close()
+    elif args.command == "status":
+        print ("Queue|Pending|Claimed|Done|Failed")
+        print ("-----|-------|-------|----|------")
+        for queue, counts in status(args.db).items():
+            print (f"{queue}|{counts.get('pending', 0)}|{counts.get('claimed', 0)}|{counts.get('done', 0)}|{counts.get('failed', 0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import os
+import time
+import uuid
+import sqlite3
+import json
+import glob
+import argparse
+from contextlib import contextmanager
+
+# pool of online endpoints that are kept warm per workspace, instead of creating and deleting an endpoint for every model
+# a test leases an idle endpoint, deploys its model to it, and releases it, which deletes the deployment and
+# returns the endpoint to the pool. the pool grows up to size endpoints per workspace, a test that finds all of
+# them leased waits for one, and a lease that is not released before it expires goes back to the pool
+# the state is a local sqlite database like the one of dispatcher.py, it must be on storage that all tests can reach
+# endpoints stay up between tests, run 'python endpoint_pool.py drain' to delete the idle ones at the end of a test set
+# a database on a github hosted runner is gone when the job ends, the endpoints it tracks would never be leased or
+# drained again, so on those runners the endpoint is deleted on release instead of returned to the pool
+
+# there is no default path, a pool database in the checkout would not be shared and would leak its endpoints
+DEFAULT_POOL_DB = os.environ.get("test_endpoint_pool_db", "")
+DEFAULT_POOL_SIZE = int(os.environ.get("test_endpoint_pool_size", 2))
+# default lease of an endpoint, a test that deploys and scores for longer than this is assumed to be hung
+DEFAULT_LEASE_MINUTES = 120
+# seconds a test waits for an idle endpoint when the pool is full, after that it falls back to its own endpoint
+DEFAULT_WAIT_SECONDS = 1800
+POLL_SECONDS = 30
+# seconds to wait for the database lock held by another test
+LOCK_TIMEOUT = 60
+ENDPOINT_PREFIX = "hf-pool-"
+POOL_TAG = "endpoint_pool"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS endpoints (
+    name TEXT PRIMARY KEY,
+    workspace TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'idle',
+    worker TEXT,
+    lease_expires REAL,
+    deployment TEXT,
+    leases INTEGER NOT NULL DEFAULT 0,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS endpoints_workspace_state ON endpoints (workspace, state);
+"""
+
+
+# function to tell whether the database outlives the job, test_endpoint_pool_persistent overrides the check,
+# for example 'true' for a share mounted on a github hosted runner
+def is_persistent():
+    persistent = os.environ.get("test_endpoint_pool_persistent", "")
+    if persistent:
+        return persistent.lower() == "true"
+    return os.environ.get("RUNNER_ENVIRONMENT") != "github-hosted"
+
+
+def connect(db):
+    db_dir = os.path.dirname(db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    # isolation_level None so that we control the transactions, BEGIN IMMEDIATE takes the write lock up front
+    connection = sqlite3.connect(db, timeout=LOCK_TIMEOUT, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# function to put endpoints whose lease expired back to idle, their deployment is deleted when they are leased again
+def release_expired(connection):
+    now = time.time()
+    released = connection.execute("UPDATE endpoints SET state = 'idle', worker = NULL, lease_expires = NULL, updated_at = ? WHERE state = 'leased' AND lease_expires < ?", (now, now)).rowcount
+    if released:
+        print (f"::warning:: Released {released} endpoints whose lease expired")
+    return released
+
+
+# function to count endpoints per workspace and state
+def status(db):
+    connection = connect(db)
+    counts = {}
+    for workspace, state, count in connection.execute("SELECT workspace, state, COUNT(*) FROM endpoints GROUP BY workspace, state ORDER BY workspace"):
+        counts.setdefault(workspace, {})[state] = count
+    connection.close()
+    return counts
+
+
+class EndpointPool:
+    def __init__(self, workspace_ml_client, workspace, db=DEFAULT_POOL_DB, size=DEFAULT_POOL_SIZE, lease_minutes=DEFAULT_LEASE_MINUTES, persistent=None):
+        if not db:
+            raise ValueError("The endpoint pool needs the path of a database that all tests can reach, set test_endpoint_pool_db")
+        self.workspace_ml_client = workspace_ml_client
+        self.workspace = workspace
+        self.db = db
+        self.size = size
+        self.lease_minutes = lease_minutes
+        self.persistent = is_persistent() if persistent is None else persistent
+        if not self.persistent:
+            print (f"::warning:: Endpoint pool database {db} does not outlive the job, leased endpoints are deleted on release")
+
+    # function to atomically lease an idle endpoint, or add a new one to the pool if it is not full
+    # returns the name of the endpoint, the deployment left on it by an expired lease and whether it has to be created
+    def claim(self, worker):
+        connection = connect(self.db)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            release_expired(connection)
+            now = time.time()
+            row = connection.execute("SELECT name, deployment FROM endpoints WHERE workspace = ? AND state = 'idle' ORDER BY updated_at LIMIT 1", (self.workspace,)).fetchone()
+            if row is not None:
+                name, stale_deployment = row
+                create = False
+            elif connection.execute("SELECT COUNT(*) FROM endpoints WHERE workspace = ?", (self.workspace,)).fetchone()[0] < self.size:
+                # endpoint names must be unique in a region and at most 32 characters
+                name, stale_deployment = ENDPOINT_PREFIX + uuid.uuid4().hex[:12], None
+                create = True
+                connection.execute("INSERT INTO endpoints (name, workspace, created_at) VALUES (?, ?, ?)", (name, self.workspace, now))
+            else:
+                name = None
+            if name is not None:
+                connection.execute("UPDATE endpoints SET state = 'leased', worker = ?, lease_expires = ?, leases = leases + 1, updated_at = ? WHERE name = ?", (worker, now + self.lease_minutes * 60, now, name))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        if name is None:
+            return None, None, False
+        return name, stale_deployment, create
+
+    # function to lease an endpoint for a test, waiting up to wait_seconds when all endpoints of the pool are leased
+    # returns None if no endpoint became idle or the endpoint could not be created, the caller then creates its own as before
+    def lease(self, worker, wait_seconds=DEFAULT_WAIT_SECONDS):
+        start = time.time()
+        name, stale_deployment, create = self.claim(worker)
+        while name is None and time.time() - start < wait_seconds:
+            print (f"All {self.size} endpoints of the pool of {self.workspace} are leased, waiting for one")
+            time.sleep(POLL_SECONDS)
+            name, stale_deployment, create = self.claim(worker)
+        if name is None:
+            print (f"::warning:: No endpoint of the pool of {self.workspace} became idle in {wait_seconds}s")
+            return None
+        if stale_deployment:
+            try:
+                self.delete_deployment(name, stale_deployment)
+            except Exception as e:
+                print (f"::warning:: Could not delete deployment {stale_deployment} left on {name} by an expired lease: \n{e}")
+        try:
+            if create or not self.exists(name):
+                self.create_endpoint(name)
+        except Exception as e:
+            print (f"::warning:: Could not prepare pool endpoint {name}, removing it from the pool: \n{e}")
+            self.remove(name)
+            return None
+        self.record_deployment(name, None)
+        print (f"Leased endpoint {name} to {worker} in {time.time() - start:.1f}s" + (" (created)" if create else " (warm)"))
+        return name
+
+    def exists(self, name):
+        try:
+            self.workspace_ml_client.online_endpoints.get(name=name)
+            return True
+        except Exception:
+            return False
+
+    def create_endpoint(self, name):
+        from azure.ai.ml.entities import ManagedOnlineEndpoint
+        start = time.time()
+        endpoint = ManagedOnlineEndpoint(name=name, auth_mode="key", tags={POOL_TAG: self.workspace})
+        self.workspace_ml_client.online_endpoints.begin_create_or_update(endpoint).result()
+        print (f"Created pool endpoint {name} in {time.time() - start:.1f}s")
+
+    def delete_deployment(self, name, deployment):
+        start = time.time()
+        # a deployment that still takes traffic cannot be deleted, so its traffic is moved off it first
+        endpoint = self.workspace_ml_client.online_endpoints.get(name=name)
+        if (endpoint.traffic or {}).get(deployment):
+            endpoint.traffic = {key: 0 for key in endpoint.traffic}
+            self.workspace_ml_client.online_endpoints.begin_create_or_update(endpoint).result()
+        self.workspace_ml_client.online_deployments.begin_delete(name=deployment, endpoint_name=name).wait()
+        print (f"Deleted deployment {deployment} from {name} in {time.time() - start:.1f}s")
+
+    # function to remember the deployment of a leased endpoint, so that it is deleted even if the test never releases it
+    def record_deployment(self, name, deployment):
+        connection = connect(self.db)
+        connection.execute("UPDATE endpoints SET deployment = ?, updated_at = ? WHERE name = ?", (deployment, time.time(), name))
+        connection.close()
+
+    # function to extend the lease of an endpoint that is still in use
+    def renew(self, name):
+        connection = connect(self.db)
+        updated = connection.execute("UPDATE endpoints SET lease_expires = ?, updated_at = ? WHERE name = ? AND state = 'leased'", (time.time() + self.lease_minutes * 60, time.time(), name)).rowcount
+        connection.close()
+        return updated == 1
+
+    def remove(self, name):
+        connection = connect(self.db)
+        connection.execute("DELETE FROM endpoints WHERE name = ?", (name,))
+        connection.close()
+
+    # function to delete an endpoint and remove it from the pool, the deployments on it are deleted with it
+    # an endpoint that could not be deleted stays in the pool as draining, so that the next drain tries again
+    def delete_endpoint(self, name):
+        try:
+            self.workspace_ml_client.online_endpoints.begin_delete(name=name).wait()
+        except Exception as e:
+            print (f"::warning:: Could not delete endpoint {name}, the next drain tries again: \n{e}")
+            connection = connect(self.db)
+            connection.execute("UPDATE endpoints SET state = 'draining', worker = NULL, lease_expires = NULL, updated_at = ? WHERE name = ?", (time.time(), name))
+            connection.close()
+            return False
+        self.remove(name)
+        return True
+
+    # function to swap the deployment of a test out of the endpoint and return the endpoint to the pool
+    # deployment defaults to the one recorded with record_deployment
+    # an endpoint whose deployment cannot be deleted is deleted and removed from the pool, it is replaced on a later lease
+    # without a persistent database no later test could lease the endpoint, so it is deleted as well
+    def release(self, name, deployment=None):
+        if not self.persistent:
+            print (f"Deleting endpoint {name}, the pool database does not outlive the job")
+            self.delete_endpoint(name)
+            return
+        if deployment is None:
+            connection = connect(self.db)
+            row = connection.execute("SELECT deployment FROM endpoints WHERE name = ?", (name,)).fetchone()
+            connection.close()
+            deployment = row[0] if row else None
+        try:
+            if deployment:
+                self.delete_deployment(name, deployment)
+        except Exception as e:
+            print (f"::warning:: Could not delete deployment {deployment} from {name}, removing the endpoint from the pool: \n{e}")
+            self.delete_endpoint(name)
+            return
+        connection = connect(self.db)
+        connection.execute("UPDATE endpoints SET state = 'idle', worker = NULL, lease_expires = NULL, deployment = NULL, updated_at = ? WHERE name = ?", (time.time(), name))
+        connection.close()
+        print (f"Returned endpoint {name} to the pool")
+
+    # context manager to lease an endpoint for the body and release it afterwards, also when the test exits with an error
+    # yields the endpoint name, None if no endpoint could be leased. the body records its deployment with record_deployment
+    @contextmanager
+    def leased(self, worker, wait_seconds=DEFAULT_WAIT_SECONDS):
+        name = self.lease(worker, wait_seconds)
+        try:
+            yield name
+        finally:
+            if name is not None:
+                self.release(name)
+
+    # function to tell whether tests of the workspace still use the pool, a drain would make them create the endpoints again
+    # an endpoint with a lease that did not expire is in use, and so is a model of the queues that is pending or claimed
+    # in the dispatcher database, a queue between two models holds no lease
+    def in_use(self, dispatcher_db=None, queues=None):
+        connection = connect(self.db)
+        leased = connection.execute("SELECT COUNT(*) FROM endpoints WHERE workspace = ? AND state = 'leased' AND lease_expires >= ?", (self.workspace, time.time())).fetchone()[0]
+        connection.close()
+        if leased:
+            print (f"{leased} endpoints of the pool of {self.workspace} are leased")
+            return True
+        if dispatcher_db and queues:
+            from dispatcher import status as dispatcher_status
+            counts = dispatcher_status(dispatcher_db)
+            remaining = sum(counts.get(queue, {}).get("pending", 0) + counts.get(queue, {}).get("claimed", 0) for queue in queues)
+            if remaining:
+                print (f"{remaining} models of the queues of {self.workspace} are pending or claimed")
+                return True
+        return False
+
+    # function to delete the idle endpoints of the workspace, for example at the end of a test set
+    # endpoints that a previous drain could not delete are deleted again
+    def drain(self):
+        connection = connect(self.db)
+        connection.execute("BEGIN IMMEDIATE")
+        release_expired(connection)
+        names = [row[0] for row in connection.execute("SELECT name FROM endpoints WHERE workspace = ? AND state IN ('idle', 'draining')", (self.workspace,))]
+        connection.execute("UPDATE endpoints SET state = 'draining', updated_at = ? WHERE workspace = ? AND state = 'idle'", (time.time(), self.workspace))
+        connection.execute("COMMIT")
+        connection.close()
+        deleted = [name for name in names if self.delete_endpoint(name)]
+        print (f"Deleted {len(deleted)} of {len(names)} idle endpoints of {self.workspace}")
+        return deleted
+
+
+# function to get the queues of a test set that run on a workspace, from the queue files
+def workspace_queues(test_set, workspace):
+    queues = []
+    for queue_file in glob.glob(f"../config/queue/{test_set}/*.json"):
+        with open(queue_file) as f:
+            if json.load(f).get("workspace") == workspace:
+                queues.append(os.path.splitext(os.path.basename(queue_file))[0])
+    return queues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pool of warm online endpoints shared by the model tests of a workspace")
+    parser.add_argument("--db", type=str, default=DEFAULT_POOL_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # status, print endpoints per workspace and state
+    subparsers.add_parser("status")
+    # release, put endpoints whose lease expired back to idle
+    subparsers.add_parser("release")
+    # drain, delete the idle endpoints of a workspace, given directly or as the workspace of a queue file
+    drain_parser = subparsers.add_parser("drain")
+    drain_parser.add_argument("--subscription", type=str)
+    drain_parser.add_argument("--resource_group", type=str)
+    drain_parser.add_argument("--workspace", type=str)
+    drain_parser.add_argument("--test_set", type=str)
+    drain_parser.add_argument("--queue", type=str)
+    # dispatcher database of the test set, the drain is skipped while models of the queues of the workspace are pending or claimed
+    drain_parser.add_argument("--dispatcher_db", type=str)
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("--db or test_endpoint_pool_db is required, the pool database must be on storage that all tests can reach")
+
+    if args.command == "status":
+        print ("Workspace|Idle|Leased|Draining")
+        print ("---------|----|------|--------")
+        for workspace, counts in status(args.db).items():
+            print (f"{workspace}|{counts.get('idle', 0)}|{counts.get('leased', 0)}|{counts.get('draining', 0)}")
+    elif args.command == "release":
+        connection = connect(args.db)
+        connection.execute("BEGIN IMMEDIATE")
+        release_expired(connection)
+        connection.execute("COMMIT")
+        connection.close()
+    elif args.command == "drain":
+        if args.queue:
+            # the workspace of the queue, as the tests of the queue used it
+            with open(f"../config/queue/{args.test_set}/{args.queue}.json") as f:
+                queue = json.load(f)
+            args.subscription, args.resource_group, args.workspace = queue['subscription'], queue['resource_group'], queue['workspace']
+        if not (args.subscription and args.resource_group and args.workspace):
+            parser.error("drain needs --queue and --test_set, or --subscription, --resource_group and --workspace")
+        if args.dispatcher_db and not args.test_set:
+            parser.error("drain needs --test_set with --dispatcher_db, to find the queues of the workspace")
+        from azure.ai.ml import MLClient
+        from azure.identity import DefaultAzureCredential
+        workspace_ml_client = MLClient(credential=DefaultAzureCredential(), subscription_id=args.subscription, resource_group_name=args.resource_group, workspace_name=args.workspace)
+        pool = EndpointPool(workspace_ml_client, args.workspace, args.db)
+        queues = workspace_queues(args.test_set, args.workspace) if args.dispatcher_db else None
+        if pool.in_use(args.dispatcher_db, queues):
+            print (f"Not draining the pool of {args.workspace}, the last test of the workspace drains it")
+            return
+        pool.drain()
+
+
+if __name__ == "__main__":
+    main()
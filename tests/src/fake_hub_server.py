@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local stand-in of the hugging face hub for trying shard_downloader.py and snapshot_cache.py without the network
+# creates a fake sharded model of random bytes and serves it with the same urls as the hub:
+#   /api/models/<model>                     model info with the size and sha256 of every file
+#   /<model>/resolve/<revision>/<file>      file content, with range requests
+# drop_after_bytes closes the first response of every file after that many bytes, to test resuming
+# run it and point the scripts at it, for example
+#   python fake_hub_server.py --root /tmp/fake_hub --shards 8 --shard_mb 64 --drop_after_bytes 1000000
+#   python shard_downloader.py --model fake-org/fake-model --output_dir /tmp/shards --endpoint http://localhost:8765
+FAKE_SHA = "0" * 40
+RESOLVE_PATTERN = re.compile(r"^/(?P<model>.+)/resolve/(?P<revision>[^/]+)/(?P<file>.+)$")
+
+
+# function to write a fake model with shards of random bytes and its safetensors index under root/<model>
+def create_fake_model(root, model, shards, shard_bytes):
+    model_dir = os.path.join(root, model)
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
+    weight_map = {}
+    for i in range(shards):
+        shard = f"model-{i + 1:05d}-of-{shards:05d}.safetensors"
+        with open(os.path.join(model_dir, shard), "wb") as f:
+            f.write(os.urandom(shard_bytes))
+        weight_map[f"layers.{i}.weight"] = shard
+    with open(os.path.join(model_dir, "model.safetensors.index.json"), "w") as f:
+        json.dump({"metadata": {"total_size": shards * shard_bytes}, "weight_map": weight_map}, f, indent=2)
+    with open(os.path.join(model_dir, "config.json"), "w") as f:
+        json.dump({"architectures": ["FakeForCausalLM"], "model_type": "fake"}, f, indent=2)
+    print (f"Created {shards} shards of {shard_bytes / 1024 / 1024:.1f} MB for {model} in {model_dir}")
+
+
+# function to build the model info the hub returns for /api/models/<model>?blobs=true
+def model_info(root, model):
+    model_dir = os.path.join(root, model)
+    siblings = []
+    for file_name in sorted(os.listdir(model_dir)):
+        with open(os.path.join(model_dir, file_name), "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        size = os.path.getsize(os.path.join(model_dir, file_name))
+        siblings.append({"rfilename": file_name, "size": size, "lfs": {"sha256": sha256, "size": size}})
+    with open(os.path.join(model_dir, "config.json")) as f:
+        config = json.load(f)
+    return {"id": model, "sha": FAKE_SHA, "pipeline_tag": "text-generation", "library_name": "transformers", "tags": ["transformers"], "config": config, "siblings": siblings}
+
+
+def make_handler(root, drop_after_bytes):
+    dropped = set()
+
+    class FakeHubHandler(BaseHTTPRequestHandler):
+        def send_json(self, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path.startswith("/api/models/"):
+                model = path[len("/api/models/"):]
+                if not os.path.isdir(os.path.join(root, model)):
+                    self.send_error(404)
+                    return
+                self.send_json(model_info(root, model))
+                return
+            match = RESOLVE_PATTERN.match(path)
+            file_path = os.path.join(root, match.group("model"), match.group("file")) if match else None
+            if file_path is None or not os.path.isfile(file_path):
+                self.send_error(404)
+                return
+            size = os.path.getsize(file_path)
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header:
+                start = int(range_header.split("=")[1].split("-")[0])
+                if start >= size:
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(size - start))
+            self.end_headers()
+            with open(file_path, "rb") as f:
+                f.seek(start)
+                data = f.read()
+            # cut the first response of each file short, the client sees an incomplete read and resumes
+            if drop_after_bytes and file_path not in dropped and len(data) > drop_after_bytes:
+                dropped.add(file_path)
+                self.wfile.write(data[:drop_after_bytes])
+                self.close_connection = True
+                return
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeHubHandler
+
+
+def serve(root, port, drop_after_bytes=0):
+    return ThreadingHTTPServer(("127.0.0.1", port), make_handler(root, drop_after_bytes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local stand-in of the hugging face hub serving a fake sharded model")
+    parser.add_argument("--root", type=str, default="../logs/fake_hub")
+    parser.add_argument("--model", type=str, default="fake-org/fake-model")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--shard_mb", type=float, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--drop_after_bytes", type=int, default=0)
+    args = parser.parse_args()
+    create_fake_model(args.root, args.model, args.shards, int(args.shard_mb * 1024 * 1024))
+    server = serve(args.root, args.port, args.drop_after_bytes)
+    print (f"Serving {args.root} on http://127.0.0.1:{args.port}, set HF_ENDPOINT to it")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
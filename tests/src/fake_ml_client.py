@@ -0,0 +1,185 @@
+import time
+import json
+import random
+import threading
+from types import SimpleNamespace
+
+# local stand-in of azure.ai.ml MLClient for trying deployment_orchestrator.py without a workspace
+# every operation takes the latency configured for it, in seconds multiplied by time_scale, so a test set of many models
+# can be simulated in seconds. long running operations return a poller like the azure sdk, done() turns true
+# once the latency has passed and result() blocks until then. failures is the chance an operation fails, per operation
+# the operations used by the test drivers are supported:
+#   models.package, models.get, models.list, environments.get of a packaged environment
+#   online_endpoints.begin_create_or_update, begin_delete, get, invoke
+#   online_deployments.begin_create_or_update, begin_delete, get_logs
+#   begin_create_or_update of an endpoint on the client itself, as in create_model_package
+DEFAULT_LATENCIES = {
+    "package": 600,
+    "endpoint_create": 300,
+    "endpoint_delete": 120,
+    "deployment_create": 900,
+    "deployment_delete": 120,
+    "invoke": 2,
+    "get": 0.5,
+}
+
+
+# entities with the same constructor arguments as azure.ai.ml.entities, the fake client only reads their attributes
+class Entity:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ManagedOnlineEndpoint(Entity):
+    pass
+
+
+class ManagedOnlineDeployment(Entity):
+    pass
+
+
+class ModelPackage(Entity):
+    pass
+
+
+class ModelConfiguration(Entity):
+    pass
+
+
+class AzureMLOnlineInferencingServer(Entity):
+    pass
+
+
+entities = SimpleNamespace(ManagedOnlineEndpoint=ManagedOnlineEndpoint, ManagedOnlineDeployment=ManagedOnlineDeployment, ModelPackage=ModelPackage,
+                           ModelConfiguration=ModelConfiguration, AzureMLOnlineInferencingServer=AzureMLOnlineInferencingServer)
+
+
+class FakePoller:
+    def __init__(self, latency, value=None, error=None):
+        self.end = time.monotonic() + latency
+        self.value = value
+        self.error = error
+
+    def done(self):
+        return time.monotonic() >= self.end
+
+    def status(self):
+        if not self.done():
+            return "InProgress"
+        return "Failed" if self.error else "Succeeded"
+
+    def result(self, timeout=None):
+        time.sleep(max(0, self.end - time.monotonic()))
+        if self.error:
+            raise self.error
+        return self.value
+
+    def wait(self, timeout=None):
+        time.sleep(max(0, self.end - time.monotonic()))
+
+
+class FakeMLClient:
+    def __init__(self, workspace_name="fake-ws", latencies=None, time_scale=1.0, failures=None, seed=None):
+        self.workspace_name = workspace_name
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.time_scale = time_scale
+        self.failures = failures or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.deployments = {}
+        self.environments_by_name = {}
+        # every call as (operation, name, start, end) on the monotonic clock, to check what ran concurrently
+        self.calls = []
+        self.models = SimpleNamespace(package=self.package, get=self.get_model, list=self.list_models)
+        self.environments = SimpleNamespace(get=self.get_environment)
+        self.online_endpoints = SimpleNamespace(begin_create_or_update=self.begin_create_endpoint, begin_delete=self.begin_delete_endpoint,
+                                                get=self.get_endpoint, invoke=self.invoke)
+        self.online_deployments = SimpleNamespace(begin_create_or_update=self.begin_create_deployment, begin_delete=self.begin_delete_deployment,
+                                                  get_logs=self.get_logs)
+
+    def latency(self, operation):
+        return self.latencies[operation] * self.time_scale
+
+    def error(self, operation, name):
+        if self.random.random() < self.failures.get(operation, 0):
+            return Exception(f"fake {operation} failure for {name}")
+        return None
+
+    def record(self, operation, name, latency):
+        start = time.monotonic()
+        with self.lock:
+            self.calls.append((operation, name, start, start + latency))
+
+    def poller(self, operation, name, value=None):
+        latency = self.latency(operation)
+        self.record(operation, name, latency)
+        return FakePoller(latency, value, self.error(operation, name))
+
+    def package(self, name, version, package_config):
+        self.record("package", name, self.latency("package"))
+        time.sleep(self.latency("package"))
+        error = self.error("package", name)
+        if error:
+            raise error
+        environment = SimpleNamespace(name=package_config.target_environment_name, version="1", id=f"azureml:{package_config.target_environment_name}:1")
+        with self.lock:
+            self.environments_by_name[environment.name] = environment
+        return environment
+
+    def get_environment(self, name, version=None, label=None):
+        time.sleep(self.latency("get"))
+        if name not in self.environments_by_name:
+            raise Exception(f"environment {name} not found")
+        return self.environments_by_name[name]
+
+    def get_model(self, name, version=None):
+        time.sleep(self.latency("get"))
+        return SimpleNamespace(name=name, version=version or "1", id=f"azureml:{name}:{version or '1'}", tags={}, properties={},
+                               creation_context=SimpleNamespace(created_at="2023-01-01T00:00:00"))
+
+    def list_models(self, name=None):
+        return [self.get_model(name)]
+
+    def begin_create_or_update(self, entity):
+        return self.begin_create_endpoint(entity)
+
+    def begin_create_endpoint(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint.name] = endpoint
+        return self.poller("endpoint_create", endpoint.name, endpoint)
+
+    def begin_delete_endpoint(self, name):
+        with self.lock:
+            self.endpoints.pop(name, None)
+            self.deployments = {key: value for key, value in self.deployments.items() if key[0] != name}
+        return self.poller("endpoint_delete", name)
+
+    def get_endpoint(self, name):
+        time.sleep(self.latency("get"))
+        if name not in self.endpoints:
+            raise Exception(f"endpoint {name} not found")
+        return self.endpoints[name]
+
+    def begin_create_deployment(self, deployment):
+        if deployment.endpoint_name not in self.endpoints:
+            raise Exception(f"endpoint {deployment.endpoint_name} not found")
+        with self.lock:
+            self.deployments[(deployment.endpoint_name, deployment.name)] = deployment
+        return self.poller("deployment_create", deployment.name, deployment)
+
+    def begin_delete_deployment(self, name, endpoint_name):
+        with self.lock:
+            self.deployments.pop((endpoint_name, name), None)
+        return self.poller("deployment_delete", name)
+
+    def invoke(self, endpoint_name, deployment_name=None, request_file=None):
+        self.record("invoke", endpoint_name, self.latency("invoke"))
+        time.sleep(self.latency("invoke"))
+        error = self.error("invoke", endpoint_name)
+        if error:
+            raise error
+        return json.dumps([{"endpoint": endpoint_name, "deployment": deployment_name}])
+
+    def get_logs(self, name, endpoint_name, lines=None):
+        return f"fake logs of {endpoint_name}/{name}"
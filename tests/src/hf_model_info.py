@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.parse
+import urllib.request
+
+# client for the metadata of a single hugging face model, shared by the register and deploy scripts
+# one small request to /api/models/<model> per model instead of downloading and filtering the model listing
+# responses are cached on disk, one file per model, for ttl seconds. the cache is bounded to max_bytes
+# and the least recently used models are evicted first
+# HF_ENDPOINT is the same variable huggingface_hub uses, it can point at a mirror or a local stand-in of the hub
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co")
+DEFAULT_CACHE_DIR = os.environ.get("hf_model_info_cache_dir", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "hf_model_info"))
+DEFAULT_TTL = int(os.environ.get("hf_model_info_cache_ttl", 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.environ.get("hf_model_info_cache_max_bytes", 64 * 1024 * 1024))
+DEFAULT_TIMEOUT = 30
+# fields of the model info that are kept in the cache, the rest of the response is dropped
+FIELDS = ["id", "sha", "pipeline_tag", "library_name", "tags", "mask_token", "lastModified", "safetensors", "config"]
+STRING_TO_CHECK = 'transformers'
+
+
+class HfModelInfoClient:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, token=None, endpoint=HF_ENDPOINT):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.token = token or os.environ.get("HF_TOKEN")
+        self.endpoint = endpoint
+        self.lock = threading.Lock()
+
+    def cache_file(self, model_id):
+        return os.path.join(self.cache_dir, hashlib.sha256(model_id.encode("utf-8")).hexdigest() + ".json")
+
+    # function to read a model from the cache, returns None if it is missing or older than ttl
+    # a hit refreshes the modified time of the file, which is the clock of the lru eviction
+    def read_cache(self, model_id):
+        cache_file = self.cache_file(model_id)
+        try:
+            with open(cache_file) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        os.utime(cache_file)
+        return entry["info"]
+
+    def write_cache(self, model_id, info):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = self.cache_file(model_id)
+        # write to a temp file and rename so a concurrent reader never sees a half written entry
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"model_id": model_id, "fetched_at": time.time(), "info": info}, f)
+        os.replace(tmp_file, cache_file)
+        self.evict()
+
+    # function to delete the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        with self.lock:
+            entries = []
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, file_name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+                total = total - size
+
+    # function to fetch the model info from the hub, siblings are reduced to file names, sizes and the sha256 of lfs files
+    def fetch(self, model_id):
+        request = urllib.request.Request(f"{self.endpoint}/api/models/{urllib.parse.quote(model_id)}?blobs=true")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request, timeout=DEFAULT_TIMEOUT) as response:
+            data = json.load(response)
+        info = {field: data.get(field) for field in FIELDS}
+        info["siblings"] = [{"rfilename": sibling["rfilename"], "size": sibling.get("size"), "sha256": (sibling.get("lfs") or {}).get("sha256")} for sibling in data.get("siblings", [])]
+        info["safetensors_size"] = sum(sibling["size"] or 0 for sibling in info["siblings"] if sibling["rfilename"].endswith(".safetensors"))
+        return info
+
+    # function to get the info of a model, from the cache or from the hub
+    def get(self, model_id):
+        info = self.read_cache(model_id)
+        if info is None:
+            info = self.fetch(model_id)
+            self.write_cache(model_id, info)
+        return info
+
+    # function to get the task of a transformers model, returns an empty string for other models
+    def get_task(self, model_id):
+        info = self.get(model_id)
+        if STRING_TO_CHECK not in (info.get("tags") or []):
+            return ""
+        return info.get("pipeline_tag") or ""
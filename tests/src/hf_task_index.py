@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from huggingface_hub import HfApi
+from hf_model_info import HfModelInfoClient
+
+# local index of the hugging face hub models, backed by a sqlite database
+# replaces listing every model on the hub to look up the task of one model
+# the index is refreshed incrementally, newest models first, until the last modified watermark of the previous refresh
+# a model that is not in the index yet is fetched with a single request through hf_model_info.py and added to it
+DEFAULT_INDEX_DB = os.environ.get("hf_task_index_db", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "hf_task_index.db"))
+# tasks that the tests support, models with other tasks get an empty task like before
+TASK_NAME = ['fill-mask', 'token-classification', 'question-answering',
+             'summarization', 'text-generation', 'text-classification', 'translation']
+STRING_TO_CHECK = 'transformers'
+# rows written per transaction during a refresh
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model_id TEXT PRIMARY KEY,
+    pipeline_tag TEXT,
+    library TEXT,
+    downloads INTEGER,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def connect(db=DEFAULT_INDEX_DB):
+    db_dir = os.path.dirname(db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    connection = sqlite3.connect(db)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# function to convert a hub ModelInfo to an index row, older huggingface_hub versions use modelId and lastModified
+def model_row(model_info):
+    model_id = getattr(model_info, "id", None) or getattr(model_info, "modelId", None)
+    last_modified = getattr(model_info, "last_modified", None) or getattr(model_info, "lastModified", None)
+    if last_modified is not None and not isinstance(last_modified, str):
+        last_modified = last_modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    tags = getattr(model_info, "tags", None) or []
+    # the tests only support models with the transformers tag, same filter as the old full hub scan
+    library = STRING_TO_CHECK if STRING_TO_CHECK in tags else getattr(model_info, "library_name", None)
+    return (model_id, getattr(model_info, "pipeline_tag", None), library, getattr(model_info, "downloads", None), last_modified)
+
+
+def upsert(connection, rows):
+    connection.executemany("INSERT OR REPLACE INTO models (model_id, pipeline_tag, library, downloads, last_modified) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+# function to bring the index up to date with the hub
+# models are listed newest first and the listing stops at the watermark, so a refresh only reads what changed
+# full ignores the watermark and reads the whole hub, which is only needed once to build the index
+def refresh_index(db=DEFAULT_INDEX_DB, full=False, limit=None, hf_api=None):
+    start = time.time()
+    hf_api = hf_api or HfApi()
+    connection = connect(db)
+    stored = connection.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+    watermark = None if full or stored is None else stored[0]
+    print (f"Refreshing hugging face task index {db}, watermark {watermark}")
+    newest = None
+    counter = 0
+    batch = []
+    # a listing cut short by limit leaves a gap, so it does not move the watermark unless it reached the old one
+    complete = limit is None
+    for model_info in hf_api.list_models(sort="lastModified", direction=-1, limit=limit, full=True):
+        row = model_row(model_info)
+        if watermark is not None and row[4] is not None and row[4] < watermark:
+            complete = True
+            break
+        newest = newest or row[4]
+        batch.append(row)
+        counter = counter + 1
+        if len(batch) >= BATCH_SIZE:
+            upsert(connection, batch)
+            connection.commit()
+            batch = []
+            sys.stdout.write(f'{counter}\r')
+            sys.stdout.flush()
+    upsert(connection, batch)
+    # only move the watermark after the whole range was read, an interrupted refresh starts over from the old one
+    if complete and newest is not None and (watermark is None or newest > watermark):
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (newest,))
+    connection.commit()
+    connection.close()
+    print (f"\nIndexed {counter} models in {time.time() - start:.1f}s")
+    return counter
+
+
+# function to look up a model in the index, returns None if it is not indexed
+def lookup(model_id, db=DEFAULT_INDEX_DB):
+    connection = connect(db)
+    row = connection.execute("SELECT model_id, pipeline_tag, library, downloads, last_modified FROM models WHERE model_id = ?", (model_id,)).fetchone()
+    connection.close()
+    if row is None:
+        return None
+    return {"model_id": row[0], "pipeline_tag": row[1], "library": row[2], "downloads": row[3], "last_modified": row[4]}
+
+
+# function to get the task of a model, from the index or from a single model info request if it is not indexed
+# returns an empty string for models that are not transformers models or have a task the tests do not support
+def get_task(model_id, db=DEFAULT_INDEX_DB, info_client=None):
+    model = lookup(model_id, db)
+    if model is None:
+        info_client = info_client or HfModelInfoClient()
+        try:
+            info = info_client.get(model_id)
+            tags = info.get("tags") or []
+            row = (model_id, info.get("pipeline_tag"), STRING_TO_CHECK if STRING_TO_CHECK in tags else info.get("library_name"), None, info.get("lastModified"))
+        except Exception as e:
+            print (f"::warning:: Could not get model info of {model_id} from the hub: \n{e}")
+            return ""
+        connection = connect(db)
+        upsert(connection, [row])
+        connection.commit()
+        connection.close()
+        model = {"model_id": row[0], "pipeline_tag": row[1], "library": row[2], "downloads": row[3], "last_modified": row[4]}
+    if model["library"] != STRING_TO_CHECK or model["pipeline_tag"] not in TASK_NAME:
+        return ""
+    return model["pipeline_tag"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local index of hugging face models and their tasks")
+    parser.add_argument("--db", type=str, default=DEFAULT_INDEX_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # refresh, read new and changed models from the hub into the index
+    refresh_parser = subparsers.add_parser("refresh")
+    refresh_parser.add_argument("--full", action="store_true")
+    refresh_parser.add_argument("--limit", type=int, default=None)
+    # task, print the task of a model
+    task_parser = subparsers.add_parser("task")
+    task_parser.add_argument("--model", type=str, required=True)
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        refresh_index(args.db, args.full, args.limit)
+    elif args.command == "task":
+        print (get_task(args.model, args.db))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import argparse
+from hf_model_info import HfModelInfoClient
+from shard_downloader import ShardDownloader, INDEX_FILE
+
+# inspects a hugging face model without loading its weights, for the stages that only need its size or architecture
+# such as choosing a sku, falling back from an unknown task or picking the class to load the model with
+# the parameter count and dtype come from the safetensors metadata of the model info, then the total size in the
+# safetensors index, and only then from instantiating the model from its config with empty weights on the meta device
+# estimated_ram_bytes is what loading the model for registration or scoring needs, weights plus RAM_OVERHEAD
+RAM_OVERHEAD = 1.2
+DTYPE_BYTES = {"F64": 8, "F32": 4, "BF16": 2, "F16": 2, "I64": 8, "I32": 4, "I16": 2, "I8": 1, "U8": 1, "BOOL": 1,
+               "float64": 8, "float32": 4, "bfloat16": 2, "float16": 2, "int8": 1}
+DEFAULT_DTYPE = "F32"
+# memory of the instance types the tests deploy to, in GB
+INSTANCE_MEMORY_GB = {
+    "Standard_DS2_v2": 7,
+    "Standard_DS3_v2": 14,
+    "Standard_DS11_v2": 14,
+    "Standard_DS4_v2": 28,
+    "Standard_DS5_v2": 56,
+    "Standard_D13": 56,
+    "Standard_D16as_v4": 64,
+    "Standard_D64as_v4": 256,
+    "Standard_E64s_v3": 432,
+    "Standard_E96as_v4": 672,
+}
+# fraction of the memory of a machine a model can use before it is loaded with low_cpu_mem_usage
+LOW_MEMORY_FRACTION = 0.5
+
+
+def dtype_bytes(dtype):
+    return DTYPE_BYTES.get(str(dtype).replace("torch.", ""), DTYPE_BYTES[DEFAULT_DTYPE])
+
+
+# function to get the parameter count and dtype from the model info, (None, None) if the info has neither
+# the safetensors metadata has the exact count per dtype, otherwise the size of the weight files is divided by float32
+def parameters_from_info(info):
+    safetensors = info.get("safetensors") or {}
+    if safetensors.get("total"):
+        by_dtype = safetensors.get("parameters") or {}
+        dtype = max(by_dtype, key=by_dtype.get) if by_dtype else DEFAULT_DTYPE
+        return safetensors["total"], dtype
+    # pytorch_model.bin and model.safetensors are usually both present, so take the largest of the two formats
+    sizes = {}
+    for sibling in info.get("siblings") or []:
+        for extension in (".safetensors", ".bin"):
+            if sibling["rfilename"].endswith(extension):
+                sizes[extension] = sizes.get(extension, 0) + (sibling.get("size") or 0)
+    if sizes and max(sizes.values()) > 0:
+        return int(max(sizes.values()) / dtype_bytes(DEFAULT_DTYPE)), None
+    return None, None
+
+
+# function to count the parameters of a model by instantiating it from its config with empty weights
+# nothing is allocated, the tensors live on the meta device. needs transformers and accelerate
+def parameters_from_config(model_id, revision="main"):
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModel
+    config = AutoConfig.from_pretrained(model_id, revision=revision)
+    with init_empty_weights():
+        model = AutoModel.from_config(config)
+    dtype = getattr(config, "torch_dtype", None)
+    return model.num_parameters(), str(dtype).replace("torch.", "") if dtype else None
+
+
+# function to inspect a model, returns its architecture, parameter count, dtype and estimated ram
+# values that cannot be found are None, so callers can fall back to what they did before
+def inspect_model(model_id, revision="main", info_client=None):
+    start = time.time()
+    info_client = info_client or HfModelInfoClient()
+    inspection = {"model_id": model_id, "architecture": None, "model_type": None, "parameters": None, "dtype": None, "estimated_ram_bytes": None, "source": None}
+    try:
+        info = info_client.get(model_id)
+        config = info.get("config") or {}
+        architectures = config.get("architectures") or []
+        inspection["architecture"] = architectures[0] if architectures else None
+        inspection["model_type"] = config.get("model_type")
+        parameters, dtype = parameters_from_info(info)
+        source = "model_info"
+        siblings = [sibling["rfilename"] for sibling in info.get("siblings") or []]
+        if (parameters is None or dtype is None) and INDEX_FILE in siblings:
+            # the index is a few kilobytes and has the total size of the weights in bytes
+            with ShardDownloader(model_id, revision, info_client=info_client).open_url(INDEX_FILE) as response:
+                total_size = json.load(response).get("metadata", {}).get("total_size")
+            if total_size:
+                parameters = int(total_size / dtype_bytes(dtype or DEFAULT_DTYPE))
+                source = "safetensors_index"
+        if parameters is None:
+            parameters, dtype = parameters_from_config(model_id, revision)
+            source = "meta_device"
+        inspection["parameters"] = parameters
+        inspection["dtype"] = dtype or DEFAULT_DTYPE
+        inspection["estimated_ram_bytes"] = int(parameters * dtype_bytes(inspection["dtype"]) * RAM_OVERHEAD)
+        inspection["source"] = source
+    except Exception as e:
+        print (f"::warning:: Could not inspect {model_id}: \n{e}")
+    print (f"Inspected {model_id} in {time.time() - start:.2f}s: {inspection}")
+    return inspection
+
+
+# function to check if a model fits in an instance type, returns None if the size of the model or the instance type is unknown
+def fits_instance_type(inspection, instance_type):
+    if inspection.get("estimated_ram_bytes") is None or instance_type not in INSTANCE_MEMORY_GB:
+        return None
+    return inspection["estimated_ram_bytes"] <= INSTANCE_MEMORY_GB[instance_type] * 1024 ** 3
+
+
+# function to get the smallest known instance type the model fits in, returns None if it fits in none
+def smallest_instance_type(inspection):
+    for instance_type in sorted(INSTANCE_MEMORY_GB, key=INSTANCE_MEMORY_GB.get):
+        if fits_instance_type(inspection, instance_type):
+            return instance_type
+    return None
+
+
+# function to get the from_pretrained arguments for loading a model on this machine
+# models that need more than LOW_MEMORY_FRACTION of the memory are loaded in their own dtype without a second copy of the weights
+def loading_kwargs(inspection):
+    if inspection.get("estimated_ram_bytes") is None:
+        return {}
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    if inspection["estimated_ram_bytes"] > memory:
+        print (f"::warning:: {inspection['model_id']} needs about {inspection['estimated_ram_bytes'] / 1024 ** 3:.1f} GB, this machine has {memory / 1024 ** 3:.1f} GB")
+    if inspection["estimated_ram_bytes"] > memory * LOW_MEMORY_FRACTION:
+        return {"low_cpu_mem_usage": True, "torch_dtype": "auto"}
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inspect the size and architecture of a hugging face model without loading its weights")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--revision", type=str, default="main")
+    args = parser.parse_args()
+    inspection = inspect_model(args.model, args.revision)
+    inspection["smallest_instance_type"] = smallest_instance_type(inspection)
+    print (json.dumps(inspection, indent=4))
+    if inspection["parameters"] is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# resolves the latest version of models in a registry or workspace, shared by the deploy scripts
+# the latest version is the one created last. listing the versions of a model returns full model objects,
+# so a miss costs one list call and no extra models.get
+# resolved versions are cached in memory for the life of the process, and on disk for ttl seconds
+# a disk hit costs one models.get for the cached version instead of listing all versions
+# workspace lookups right after a model was registered must not use the cache, they would return the previous version,
+# so those resolvers are created with cache=False and always list the versions
+DEFAULT_TTL = int(os.environ.get("model_version_cache_ttl", 3600))
+DEFAULT_CACHE_FILE = os.environ.get("model_version_cache_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "model_version_cache.json"))
+DEFAULT_WORKERS = 8
+
+
+class ModelVersionResolver:
+    # resolved models of all resolvers in this process, keyed by scope and name
+    # shared so that callers can create a resolver where they need one without losing the cache
+    memory = {}
+    lock = threading.Lock()
+
+    # ml_client is a registry or workspace MLClient, scope is a name for it such as the registry name
+    # so that versions from different registries do not mix in the disk cache
+    # cache=False skips the memory and disk caches, for models that were just registered
+    def __init__(self, ml_client, scope, ttl=DEFAULT_TTL, cache_file=DEFAULT_CACHE_FILE, cache=True):
+        self.ml_client = ml_client
+        self.scope = scope
+        self.ttl = ttl
+        self.cache_file = cache_file if cache else None
+        self.cache = cache
+
+    def load_disk_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except Exception as e:
+            print (f"::warning:: Could not read model version cache {self.cache_file}: \n{e}")
+            return {}
+
+    def save_disk_cache(self, name, version):
+        if not self.cache_file:
+            return
+        with self.lock:
+            cache = self.load_disk_cache()
+            cache[f"{self.scope}/{name}"] = {"version": version, "resolved_at": time.time()}
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # write to a temp file and rename so a concurrent reader never sees a half written cache
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=4, sort_keys=True)
+            os.replace(tmp_file, self.cache_file)
+
+    # function to get the cached version of a model from disk, returns None if missing or older than ttl
+    def cached_version(self, name):
+        entry = self.load_disk_cache().get(f"{self.scope}/{name}")
+        if entry is None or time.time() - entry["resolved_at"] > self.ttl:
+            return None
+        return entry["version"]
+
+    # function to list all versions of a model and pick the one created last, returns None if there are none
+    def fetch_latest(self, name):
+        models = list(self.ml_client.models.list(name=name))
+        if not models:
+            return None
+        return max(models, key=lambda model: model.creation_context.created_at)
+
+    # function to resolve the latest version of a model, from memory, disk or the registry in that order
+    def resolve(self, name):
+        if self.cache and (self.scope, name) in self.memory:
+            return self.memory[(self.scope, name)]
+        latest_model = None
+        version = self.cached_version(name)
+        if version is not None:
+            try:
+                latest_model = self.ml_client.models.get(name, version)
+            except Exception as e:
+                # the cached version was archived or deleted, list the versions again
+                print (f"::warning:: Cached version {version} of {name} not found, resolving again: \n{e}")
+        if latest_model is None:
+            latest_model = self.fetch_latest(name)
+            if latest_model is None:
+                print (f"::error:: Model {name} not found in {self.scope}")
+                return None
+            self.save_disk_cache(name, latest_model.version)
+        print (f"Latest model {latest_model.name} version {latest_model.version} created at {latest_model.creation_context.created_at}")
+        if self.cache:
+            self.memory[(self.scope, name)] = latest_model
+        return latest_model
+
+    # function to resolve many models concurrently, returns a dictionary of name to model in the order of names
+    def resolve_many(self, names, max_workers=DEFAULT_WORKERS):
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            models = list(executor.map(self.resolve, names))
+        return dict(zip(names, models))
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+
+# reuses model package environments between tests of the same model version
+# models.package builds a container image for every test, even when the same model version was packaged by an earlier run
+# a package is bound to the model version it was built for, so the environment is named after the model name and
+# version, and a model version that was packaged before gets the existing environment with one environments.get.
+# only a new model version builds a package, models are never packaged with the environment of another model
+# hits, builds and build times of this process are reported by report(), build times are kept on disk to estimate
+# the minutes a hit saves
+PACKAGE_PREFIX = "package-v2-"
+DEFAULT_HISTORY_FILE = os.environ.get("package_environment_history_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "package_environment_history.json"))
+# number of recent build times kept to estimate the time of a build
+HISTORY_SIZE = 50
+
+
+# function to get the name of the package environment of a model version
+def package_name(model):
+    return f"{PACKAGE_PREFIX}{model.name}-{model.version}"
+
+
+class PackageEnvironmentCache:
+    # hits and builds of all caches in this process, for report()
+    stats = {"hits": 0, "builds": 0, "build_seconds": 0.0, "models": []}
+    lock = threading.Lock()
+    # one lock per workspace and package environment, so that concurrent tests of the same model version build one
+    # package and the others reuse it. packages are workspace assets, each workspace builds its own
+    name_locks = {}
+
+    def __init__(self, ml_client, history_file=DEFAULT_HISTORY_FILE):
+        self.ml_client = ml_client
+        self.history_file = history_file
+
+    def name_lock(self, environment_name):
+        with self.lock:
+            return self.name_locks.setdefault((id(self.ml_client), environment_name), threading.Lock())
+
+    # function to get a packaged environment by name, returns None if it was not built yet
+    def existing_environment(self, environment_name):
+        try:
+            return self.ml_client.environments.get(name=environment_name, label="latest")
+        except Exception:
+            return None
+
+    # function to get the package environment of a model, reusing the one of the model version if it exists
+    # package_config is a function that returns the ModelPackage for a target environment name
+    def package(self, model, package_config):
+        environment_name = package_name(model)
+        with self.name_lock(environment_name):
+            environment = self.existing_environment(environment_name)
+            if environment is not None:
+                print (f"Reusing package environment {environment.name} version {environment.version} for {model.name} version {model.version}")
+                self.record(model.name, "hit")
+                return environment
+            environment, seconds = self.build(model, package_config(environment_name))
+            self.record(model.name, "build", seconds)
+            return environment
+
+    def build(self, model, package_config):
+        start = time.time()
+        environment = self.ml_client.models.package(model.name, model.version, package_config)
+        seconds = time.time() - start
+        print (f"Built package environment {package_config.target_environment_name} for {model.name} in {seconds / 60:.1f} min")
+        self.save_build_time(seconds)
+        return environment, seconds
+
+    def record(self, model_name, outcome, seconds=0.0):
+        with self.lock:
+            key = {"hit": "hits", "build": "builds"}[outcome]
+            self.stats[key] = self.stats[key] + 1
+            self.stats["build_seconds"] = self.stats["build_seconds"] + seconds
+            self.stats["models"].append({"model": model_name, "outcome": outcome, "build_seconds": round(seconds, 1)})
+
+    def load_history(self):
+        if not self.history_file or not os.path.exists(self.history_file):
+            return []
+        try:
+            with open(self.history_file) as f:
+                return json.load(f)
+        except Exception as e:
+            print (f"::warning:: Could not read package environment history {self.history_file}: \n{e}")
+            return []
+
+    def save_build_time(self, seconds):
+        if not self.history_file:
+            return
+        with self.lock:
+            history = (self.load_history() + [round(seconds, 1)])[-HISTORY_SIZE:]
+            history_dir = os.path.dirname(self.history_file)
+            if history_dir and not os.path.exists(history_dir):
+                os.makedirs(history_dir)
+            # write to a temp file and rename so a concurrent reader never sees a half written file
+            tmp_file = f"{self.history_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(history, f)
+            os.replace(tmp_file, self.history_file)
+
+    # function to report the hit rate and the build minutes saved by the hits of this process
+    # a hit saves the average build time of the recent builds, so the estimate also works in a run without builds,
+    # without a history the builds of this process are used
+    # time_scale is the simulated seconds per real second of fake_ml_client.py, the minutes are reported in simulated time
+    def report(self, time_scale=1.0):
+        history = self.load_history()
+        if history:
+            average_build_seconds = sum(history) / len(history)
+        else:
+            average_build_seconds = self.stats["build_seconds"] / self.stats["builds"] if self.stats["builds"] else 0.0
+        packaged = self.stats["hits"] + self.stats["builds"]
+        report = {
+            "packaged": packaged,
+            "hits": self.stats["hits"],
+            "builds": self.stats["builds"],
+            "hit_rate": self.stats["hits"] / packaged if packaged else 0.0,
+            "build_minutes": self.stats["build_seconds"] / time_scale / 60,
+            "build_minutes_saved": self.stats["hits"] * average_build_seconds / time_scale / 60,
+            "models": self.stats["models"],
+        }
+        summary = ["Packaged|Reused|Built|Hit rate|Build minutes|Build minutes saved",
+                   "--------|------|-----|--------|-------------|-------------------",
+                   f"{packaged}|{report['hits']}|{report['builds']}|{report['hit_rate']:.0%}|{report['build_minutes']:.1f}|{report['build_minutes_saved']:.1f}"]
+        print ("\n".join(summary))
+        if os.environ.get("GITHUB_STEP_SUMMARY"):
+            with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fh:
+                print ("####Package environment reuse", file=fh)
+                print ("\n".join(summary), file=fh)
+        return report
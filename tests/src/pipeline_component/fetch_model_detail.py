@@ -1,6 +1,11 @@
+import os
+import sys
 from utils.logging import get_logger
 from fetch_task import HfTask
 import re
+# model_version_resolver.py is shared by the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from model_version_resolver import ModelVersionResolver
 
 logger = get_logger(__name__)
 
@@ -10,22 +15,9 @@ class ModelDetail:
 
     def get_latest_model_version(self, model_name):
         logger.info("In get_latest_model_version...")
-        version_list = list(self.workspace_ml_client.models.list(model_name))
-        if len(version_list) == 0:
-            logger.info("Model not found in registry")
-        else:
-            model_version = version_list[0].version
-            foundation_model = self.workspace_ml_client.models.get(
-                model_name, model_version)
-            logger.info(
-                "\n\nUsing model name: {0}, version: {1}, id: {2} for inferencing".format(
-                    foundation_model.name, foundation_model.version, foundation_model.id
-                )
-            )
-        logger.info(
-            f"Latest model {foundation_model.name} version {foundation_model.version} created at {foundation_model.creation_context.created_at}")
-        #print(f"Model Config : {latest_model.config}")
-        return foundation_model
+        # the model was just registered, so the versions are listed without the cache, see model_version_resolver.py in tests/src
+        resolver = ModelVersionResolver(self.workspace_ml_client, self.workspace_ml_client.workspace_name, cache=False)
+        return resolver.resolve(model_name)
         
     def get_model_detail(self, test_model_name):
         expression_to_ignore = ["/", "\\", "|", "@", "#", ".",
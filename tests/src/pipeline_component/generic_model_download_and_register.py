@@ -10,14 +10,16 @@ from mlflow.transformers import generate_signature_output
 from mlflow.tracking.client import MlflowClient
 from mlflow.store.artifact.models_artifact_repo import ModelsArtifactRepository
 from transformers import pipeline
-from huggingface_hub import HfApi
 from utils.logging import get_logger
 from huggingface_hub import login
-import pandas as pd
 import os
 import mlflow
 import re
 import json
+import sys
+# hf_task_index.py is shared by the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hf_task_index import get_task
 
 
 # import json
@@ -43,68 +45,15 @@ class Model:
         self.model_name = model_name
 
     def get_task(self) -> str:
-        """ This method will read the huggin face api url data in a dataframe. Then it will findout 
-        the model which is of transformer type . Then it will find that particular model and its task
+        """ This method will look up the task of the model in the local hugging face task index.
+        The index is refreshed incrementally, so this does not list all the models on the hub
 
         Returns:
-            str: task name
+            str: task name, empty if the model is not a transformers model with a supported task
         """
-        # response = urlopen(URL)
-        # # Load all the data with the help of json
-        # data_json = json.loads(response.read())
-        # # Convert it into dataframe and mention the specific column
-        # df = pd.DataFrame(data_json, columns=COLUMNS_TO_READ)
-        # # Find the data with the model which will be having trasnfomer tag
-        # df = df[df.tags.apply(lambda x: STRING_TO_CHECK in x)]
-        # # Find the data with that particular name
-        # required_data = df[df.modelId.apply(lambda x: x == self.model_name)]
-        # # Get the task
-        # required_data = required_data["pipeline_tag"].to_string()
-        # pattern = r'[0-9\s+]'
-        # final_data = re.sub(pattern, '', required_data)
-        # return final_data
-
-        hf_api = HfApi()
-        # Get all the1 models in the list
-        models = hf_api.list_models(
-            full=True, sort='lastModified', direction=-1)
-        # Unpack all values from the generator object
-        required_data = [i for i in models]
-
-        daata_dict = {}
-        # Loop through the list
-        for data in required_data:
-            # Loop through all the column present in the list
-            for key in data.__dict__.keys():
-                if key in LIST_OF_COLUMNS:
-                    # Check the dictionary already contains a value for that particular column
-                    if daata_dict.get(key) is None:
-                        # If the column and its value is not present then insert column and an empty list pair to the dictionary
-                        daata_dict[key] = []
-                    # Get the value for that particular column
-                    values = daata_dict.get(key)
-                    if key == 'tags':
-                        # If its tag column extract value if it is nonne then bydefault return a list with string Empty
-                        values.append(data.__dict__.get(key, ["Empty"]))
-                    else:
-                        values.append(data.__dict__.get(key, "Empty"))
-                    daata_dict[key] = values
-        # Convert dictionary to the dataframe
-        df = pd.DataFrame(daata_dict)
-        # Find the data with the model which will be having trasnfomer tag
-        df = df[df.tags.apply(lambda x: STRING_TO_CHECK in x)]
-        # Retrive the data whose task is in the list
-        df = df[df['pipeline_tag'].isin(TASK_NAME)]
-
-        # Find the data with that particular name
-        required_data = df[df.modelId.apply(lambda x: x == self.model_name)]
-        # Get the task
-        required_data = required_data["pipeline_tag"].to_string()
-        # Create pattern fiel number and space
-        pattern = r'[0-9\s+]'
-        # Replace number and space
-        final_data = re.sub(pattern, '', required_data)
-        return final_data
+        task = get_task(self.model_name)
+        logger.info(f"The specified task is this one : {task}")
+        return task
 
     def get_sample_input_data(self, task: str):
         """This method will load the sample input data based on the task name
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from hf_model_info import HfModelInfoClient
+
+# keeps the register scripts from uploading a model again when its hugging face revision did not change
+# every registered version is tagged with the commit sha and a content hash of the model files,
+# and before anything is downloaded they are compared with the tags of the latest registered version
+# the latest version is looked up through mlflow and cached in memory and on disk for ttl seconds
+COMMIT_SHA_TAG = "hf_commit_sha"
+CONTENT_HASH_TAG = "hf_content_hash"
+DEFAULT_TTL = int(os.environ.get("registered_revision_cache_ttl", 600))
+DEFAULT_CACHE_FILE = os.environ.get("registered_revision_cache_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "registered_revision_cache.json"))
+# outcome of the register step, written to the mlflow run and printed
+REGISTERED = "registered"
+SKIPPED_UNCHANGED = "skipped-unchanged"
+
+
+# function to hash the file list of a model without downloading it, from the sha256 of lfs files or the size of the others
+def content_hash(info):
+    siblings = sorted((sibling["rfilename"], sibling.get("sha256") or str(sibling.get("size"))) for sibling in info.get("siblings") or [])
+    return hashlib.sha256(json.dumps(siblings).encode("utf-8")).hexdigest()
+
+
+# function to get the revision of a model on the hub as the tags it is registered with, returns None if the hub cannot be reached
+# the info is always fetched from the hub, a cached sha would report a model changed within the cache ttl as unchanged.
+# the fresh info replaces the cached one, so that the snapshot is loaded at the same sha
+def hub_revision(model_id, info_client=None):
+    info_client = info_client or HfModelInfoClient()
+    try:
+        info = info_client.fetch(model_id)
+        info_client.write_cache(model_id, info)
+    except Exception as e:
+        print (f"::warning:: Could not get the revision of {model_id}, it will be registered again: \n{e}")
+        return None
+    if not info.get("sha"):
+        return None
+    return {COMMIT_SHA_TAG: info["sha"], CONTENT_HASH_TAG: content_hash(info)}
+
+
+class RegisteredRevisionCache:
+    # tags of the latest registered versions looked up in this process, keyed by model name
+    memory = {}
+    lock = threading.Lock()
+
+    # client is an mlflow MlflowClient of the workspace the models are registered in
+    def __init__(self, client, ttl=DEFAULT_TTL, cache_file=DEFAULT_CACHE_FILE):
+        self.client = client
+        self.ttl = ttl
+        self.cache_file = cache_file
+
+    def load_disk_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except Exception as e:
+            print (f"::warning:: Could not read registered revision cache {self.cache_file}: \n{e}")
+            return {}
+
+    def save_disk_cache(self, registered_model_name, entry):
+        if not self.cache_file:
+            return
+        with self.lock:
+            cache = self.load_disk_cache()
+            cache[registered_model_name] = entry
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=4, sort_keys=True)
+            os.replace(tmp_file, self.cache_file)
+
+    # function to get the version and tags of the latest registered version of a model, None if it was never registered
+    def latest(self, registered_model_name):
+        if registered_model_name in self.memory:
+            return self.memory[registered_model_name]
+        entry = self.load_disk_cache().get(registered_model_name)
+        if entry is None or time.time() - entry["checked_at"] > self.ttl:
+            try:
+                versions = self.client.get_latest_versions(name=registered_model_name, stages=["None"])
+            except Exception as e:
+                # the registered model does not exist yet
+                print (f"No registered version of {registered_model_name} found: {e}")
+                versions = []
+            entry = {"version": versions[0].version, "tags": dict(versions[0].tags or {}), "checked_at": time.time()} if versions else None
+            if entry is not None:
+                self.save_disk_cache(registered_model_name, entry)
+        self.memory[registered_model_name] = entry
+        return entry
+
+    # function to check if the latest registered version was registered from the same revision
+    def is_registered(self, registered_model_name, revision):
+        if revision is None:
+            return False
+        entry = self.latest(registered_model_name)
+        if entry is None:
+            return False
+        return all(entry["tags"].get(key) == value for key, value in revision.items())
+
+    # function to tag a newly registered version with the revision it was registered from
+    def record(self, registered_model_name, version, revision):
+        if revision is None:
+            return
+        for key, value in revision.items():
+            self.client.set_model_version_tag(name=registered_model_name, version=version, key=key, value=value)
+        entry = {"version": version, "tags": dict(revision), "checked_at": time.time()}
+        self.memory[registered_model_name] = entry
+        self.save_disk_cache(registered_model_name, entry)
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import http.client
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from hf_model_info import HfModelInfoClient, HF_ENDPOINT
+
+# downloader for the weight shards of large models, used by the register stage through snapshot_cache.py
+# reads the safetensors index of the model, downloads the shards concurrently with bounded parallelism
+# and keeps partial files as <shard>.part, so a retry or a rerun continues from the last byte with a range request
+# every shard is checked against the size and sha256 the hub reports for it before it is renamed into place
+INDEX_FILE = "model.safetensors.index.json"
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 2
+DEFAULT_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+
+
+class ShardDownloader:
+    def __init__(self, model_id, revision="main", max_workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, endpoint=None, info_client=None):
+        self.model_id = model_id
+        self.revision = revision
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.info_client = info_client or HfModelInfoClient()
+        # files are downloaded from the same hub as the model info
+        self.endpoint = endpoint or self.info_client.endpoint
+        self.token = self.info_client.token
+        self.lock = threading.Lock()
+        self.downloaded = 0
+
+    def file_url(self, file_name):
+        return f"{self.endpoint}/{self.model_id}/resolve/{urllib.parse.quote(self.revision)}/{urllib.parse.quote(file_name)}"
+
+    def open_url(self, file_name, start=0):
+        request = urllib.request.Request(self.file_url(file_name))
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        if start > 0:
+            request.add_header("Range", f"bytes={start}-")
+        return urllib.request.urlopen(request, timeout=DEFAULT_TIMEOUT)
+
+    # function to get the shard file names from the safetensors index, returns an empty list if the model has no index
+    def list_shards(self):
+        try:
+            with self.open_url(INDEX_FILE) as response:
+                index = json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return []
+            raise
+        return sorted(set(index["weight_map"].values()))
+
+    # function to get the expected size and sha256 of every file of the model, from the model info of the hub
+    def expected_files(self):
+        siblings = self.info_client.get(self.model_id).get("siblings") or []
+        return {sibling["rfilename"]: sibling for sibling in siblings}
+
+    # function to download one shard to output_dir, continuing from a partial file left by an earlier attempt
+    def download_shard(self, file_name, output_dir, expected):
+        target = os.path.join(output_dir, file_name)
+        part = f"{target}.part"
+        if os.path.exists(target):
+            print (f"{file_name} already downloaded")
+            return 0
+        target_dir = os.path.dirname(target)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir, exist_ok=True)
+        start_time = time.time()
+        received = 0
+        for attempt in range(self.retries + 1):
+            # a partial file can only be resumed if the size of the shard is known
+            start = os.path.getsize(part) if os.path.exists(part) and expected.get("size") is not None else 0
+            try:
+                if expected.get("size") is None or start < expected["size"]:
+                    with self.open_url(file_name, start) as response:
+                        # a server that ignores the range sends the whole file again, so start over
+                        mode = "ab" if start > 0 and response.status == 206 else "wb"
+                        with open(part, mode) as f:
+                            while True:
+                                chunk = response.read(CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                                received = received + len(chunk)
+                                with self.lock:
+                                    self.downloaded = self.downloaded + len(chunk)
+                self.verify(part, file_name, expected)
+                os.replace(part, target)
+                elapsed = time.time() - start_time
+                print (f"Downloaded {file_name}, {received / 1024 / 1024:.1f} MB in {elapsed:.1f}s")
+                return received
+            except ValueError as e:
+                # the content is wrong, not just incomplete, so the partial file cannot be resumed
+                print (f"::warning:: {e}, downloading {file_name} again")
+                os.remove(part)
+            except (OSError, http.client.HTTPException) as e:
+                print (f"::warning:: Download of {file_name} interrupted at {os.path.getsize(part) if os.path.exists(part) else 0} bytes, attempt {attempt + 1} of {self.retries + 1}: \n{e}")
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise Exception(f"Could not download {file_name} of {self.model_id} after {self.retries + 1} attempts")
+
+    # function to check the size and sha256 of a downloaded shard, raises ValueError if they do not match
+    def verify(self, path, file_name, expected):
+        size = os.path.getsize(path)
+        if expected.get("size") is not None and size != expected["size"]:
+            if size < expected["size"]:
+                raise OSError(f"{file_name} is incomplete, {size} of {expected['size']} bytes")
+            raise ValueError(f"{file_name} has {size} bytes, expected {expected['size']}")
+        if expected.get("sha256"):
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+            if sha256.hexdigest() != expected["sha256"]:
+                raise ValueError(f"{file_name} has sha256 {sha256.hexdigest()}, expected {expected['sha256']}")
+
+    # function to download all shards of the model to output_dir, returns the list of shard file names
+    # returns an empty list if the model has no safetensors index, those models are downloaded as usual
+    def download(self, output_dir):
+        shards = self.list_shards()
+        if not shards:
+            return []
+        expected = self.expected_files()
+        total = sum(expected.get(shard, {}).get("size") or 0 for shard in shards)
+        print (f"Downloading {len(shards)} shards of {self.model_id}, {total / 1024 / 1024:.1f} MB with {self.max_workers} workers")
+        start = time.time()
+        self.downloaded = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = [executor.submit(self.download_shard, shard, output_dir, expected.get(shard, {})) for shard in shards]
+            for future in futures:
+                future.result()
+        elapsed = time.time() - start
+        print (f"Downloaded {self.downloaded / 1024 / 1024:.1f} MB of {len(shards)} shards in {elapsed:.1f}s, {self.downloaded / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s")
+        return shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel, resumable download of the safetensors shards of a model")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--revision", type=str, default="main")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--max_workers", type=int, default=DEFAULT_WORKERS)
+    # endpoint of the hub, for example the local stand-in started by fake_hub_server.py
+    parser.add_argument("--endpoint", type=str, default=HF_ENDPOINT)
+    args = parser.parse_args()
+    info_client = None
+    if args.endpoint != HF_ENDPOINT:
+        # keep the model info of another endpoint out of the default cache
+        info_client = HfModelInfoClient(cache_dir=os.path.join(args.output_dir, ".hf_model_info"), endpoint=args.endpoint)
+    shards = ShardDownloader(args.model, args.revision, args.max_workers, endpoint=args.endpoint, info_client=info_client).download(args.output_dir)
+    if not shards:
+        print (f"::warning:: {args.model} has no {INDEX_FILE}, nothing to download")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import fcntl
+import fnmatch
+import shutil
+import threading
+from contextlib import contextmanager
+from huggingface_hub import snapshot_download
+from hf_model_info import HfModelInfoClient
+from shard_downloader import ShardDownloader, INDEX_FILE
+
+# cache of hugging face model snapshots shared by the register scripts, keyed by repo id and commit sha
+# a snapshot is downloaded once into <cache_dir>/<org>--<name>/<sha> and loaded from there by every later run
+# that can see the cache dir, so point hf_snapshot_cache_dir at a mounted or shared folder to reuse it across runs
+# snapshots are locked while they are downloaded or loaded, and the least recently used ones are evicted
+# when the cache grows over max_bytes. objects loaded from a snapshot are also kept for the life of the process
+# so that the register and signature steps use the same model and tokenizer instead of loading them again
+DEFAULT_CACHE_DIR = os.environ.get("hf_snapshot_cache_dir", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "hf_snapshots"))
+DEFAULT_MAX_BYTES = int(os.environ.get("hf_snapshot_cache_max_bytes", 100 * 1024 * 1024 * 1024))
+# written into every complete snapshot, its modified time is the last access time used for eviction
+META_FILE = ".snapshot.json"
+# weight formats a hub repo can ship side by side, from_pretrained loads only one of them
+# a snapshot has the config and tokenizer files and one weight format, safetensors if the repo has it, else pytorch .bin
+WEIGHT_PATTERNS = {"safetensors": ["*.safetensors"], "bin": ["*.bin"], "h5": ["*.h5"], "msgpack": ["*.msgpack"], "onnx": ["*.onnx", "*.onnx_data"]}
+PREFERRED_FORMATS = ["safetensors", "bin", "h5", "msgpack"]
+# exports for other runtimes, not read by from_pretrained
+EXPORT_PATTERNS = ["onnx/*", "openvino/*", "coreml/*", "*.tflite", "*.ot", "*.gguf"]
+
+
+# function to get the ignore patterns of the weight formats that are not loaded, given the files of a repo
+# returns None when the files are not known, so that nothing is left out
+def weight_ignore_patterns(siblings):
+    if not siblings:
+        return None
+    weight_format = next((name for name in PREFERRED_FORMATS if any(fnmatch.fnmatch(sibling, WEIGHT_PATTERNS[name][0]) for sibling in siblings)), None)
+    return [pattern for name, patterns in WEIGHT_PATTERNS.items() if name != weight_format for pattern in patterns] + EXPORT_PATTERNS
+
+
+class SnapshotCache:
+    # objects loaded by all caches in this process, keyed by loader and snapshot path
+    loaded = {}
+    lock = threading.Lock()
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, info_client=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.info_client = info_client or HfModelInfoClient()
+
+    def snapshot_dir(self, model_id, sha):
+        return os.path.join(self.cache_dir, model_id.replace("/", "--"), sha)
+
+    # function to hold a file lock next to a snapshot, exclusive to write or evict it and shared to read it
+    @contextmanager
+    def file_lock(self, path, exclusive=True, blocking=True):
+        lock_dir = os.path.dirname(path)
+        if not os.path.exists(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+        with open(f"{path}.lock", "w") as lock_file:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags = flags | fcntl.LOCK_NB
+            fcntl.flock(lock_file, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # function to get the commit sha of the revision of a model, returns None if the hub cannot be reached
+    def resolve_sha(self, model_id, revision=None):
+        if revision and len(revision) == 40:
+            return revision
+        try:
+            return self.info_client.get(model_id).get("sha")
+        except Exception as e:
+            print (f"::warning:: Could not resolve the commit of {model_id}, loading it without the snapshot cache: \n{e}")
+            return None
+
+    # function to get the local path of a snapshot, downloading it if it is not in the cache yet
+    # returns the model id itself if the commit cannot be resolved, so that from_pretrained falls back to the hub
+    def snapshot_path(self, model_id, revision=None):
+        sha = self.resolve_sha(model_id, revision)
+        if sha is None:
+            return model_id
+        path = self.snapshot_dir(model_id, sha)
+        meta_file = os.path.join(path, META_FILE)
+        if os.path.exists(meta_file):
+            print (f"Snapshot cache hit for {model_id} at {sha}")
+        else:
+            # only one writer downloads a snapshot, the others wait for the lock and find it complete
+            with self.file_lock(path):
+                if not os.path.exists(meta_file):
+                    start = time.time()
+                    # the temp dir is kept when a download fails, so the next attempt resumes the shards downloaded so far
+                    tmp_path = f"{path}.tmp"
+                    self.download(model_id, sha, tmp_path)
+                    size = sum(os.path.getsize(os.path.join(root, file_name)) for root, _, files in os.walk(tmp_path) for file_name in files)
+                    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                        json.dump({"model_id": model_id, "sha": sha, "size": size}, f)
+                    if os.path.exists(path):
+                        shutil.rmtree(path)
+                    os.replace(tmp_path, path)
+                    print (f"Downloaded {model_id} at {sha}, {size / 1024 / 1024:.0f} MB in {time.time() - start:.1f}s")
+            self.evict(keep=path)
+        os.utime(meta_file)
+        return path
+
+    # function to download the config, tokenizer and one weight format of a snapshot to path, sharded safetensors weights go through the parallel, resumable ShardDownloader
+    def download(self, model_id, sha, path):
+        siblings = [sibling["rfilename"] for sibling in self.info_client.get(model_id).get("siblings") or []]
+        if INDEX_FILE in siblings:
+            # the shards come from ShardDownloader, and the other weight formats, such as the .bin shards many
+            # sharded repos also ship, are not downloaded at all
+            snapshot_download(repo_id=model_id, revision=sha, local_dir=path, token=self.info_client.token, ignore_patterns=weight_ignore_patterns(siblings) + ["*.safetensors"])
+            ShardDownloader(model_id, sha, info_client=self.info_client).download(path)
+        else:
+            snapshot_download(repo_id=model_id, revision=sha, local_dir=path, token=self.info_client.token, ignore_patterns=weight_ignore_patterns(siblings))
+
+    # function to delete the least recently used snapshots until the cache fits in max_bytes
+    # snapshots that are being downloaded or loaded by another process are locked and skipped
+    def evict(self, keep=None):
+        with self.lock, self.file_lock(os.path.join(self.cache_dir, "evict")):
+            entries = []
+            for model_dir in os.listdir(self.cache_dir):
+                if not os.path.isdir(os.path.join(self.cache_dir, model_dir)):
+                    continue
+                for sha in os.listdir(os.path.join(self.cache_dir, model_dir)):
+                    meta_file = os.path.join(self.cache_dir, model_dir, sha, META_FILE)
+                    try:
+                        with open(meta_file) as f:
+                            size = json.load(f)["size"]
+                        entries.append((os.path.getmtime(meta_file), size, os.path.join(self.cache_dir, model_dir, sha)))
+                    except (OSError, ValueError, KeyError):
+                        continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    with self.file_lock(path, blocking=False):
+                        shutil.rmtree(path)
+                except (BlockingIOError, OSError):
+                    continue
+                print (f"Evicted snapshot {path}")
+                total = total - size
+
+    # function to load an object such as a model, tokenizer or config from the snapshot of a model
+    # loader is a class with from_pretrained, for example AutoTokenizer, and kwargs are passed to it
+    # an object that was loaded before in this process is returned again without loading it
+    def from_pretrained(self, loader, model_id, revision=None, **kwargs):
+        path = self.snapshot_path(model_id, revision)
+        key = (loader.__name__, path, json.dumps(kwargs, sort_keys=True, default=str))
+        with self.lock:
+            if key in self.loaded:
+                return self.loaded[key]
+        loaded = None
+        while loaded is None:
+            if path == model_id:
+                loaded = loader.from_pretrained(model_id, **kwargs)
+                break
+            # a shared lock keeps the snapshot from being evicted while it is read
+            with self.file_lock(path, exclusive=False):
+                if os.path.exists(os.path.join(path, META_FILE)):
+                    loaded = loader.from_pretrained(path, **kwargs)
+            if loaded is None:
+                # another process evicted the snapshot before it was locked, download it again
+                path = self.snapshot_path(model_id, revision)
+        with self.lock:
+            self.loaded[key] = loaded
+        return loaded
@@ -185,7 +185,8 @@ if __name__ == "__main__":
     latest_env = workspace_ml_client.environments.get(
         name=queue.environment, version=str(latest_version))
     logger.info(f"Latest Environment : {latest_env}")
-    command_job = run_azure_ml_job(code="./", command_to_run="python generic_model_download_and_register.py",
+    # upload tests/src so that the job can import the shared hf_task_index.py, and run from this folder as before
+    command_job = run_azure_ml_job(code="../", command_to_run="cd test_with_model_package && python generic_model_download_and_register.py",
                                    environment=latest_env, compute=queue.compute, environment_variables=environment_variables)
     create_and_get_job_studio_url(command_job, workspace_ml_client)
 
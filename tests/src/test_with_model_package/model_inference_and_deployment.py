@@ -18,6 +18,11 @@ import mlflow
 from box import ConfigBox
 import re
 import sys
+# model_version_resolver.py is shared by the test drivers in tests/src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from model_version_resolver import ModelVersionResolver
+from deployment_orchestrator import run_together
+from package_environment_cache import PackageEnvironmentCache
 
 logger = get_logger(__name__)
 
@@ -55,22 +60,9 @@ class ModelInferenceAndDeployemnt:
 
     def get_latest_model_version(self, workspace_ml_client, model_name):
         logger.info("In get_latest_model_version...")
-        version_list = list(workspace_ml_client.models.list(model_name))
-        if len(version_list) == 0:
-            logger.info("Model not found in registry")
-        else:
-            model_version = version_list[0].version
-            foundation_model = workspace_ml_client.models.get(
-                model_name, model_version)
-            logger.info(
-                "\n\nUsing model name: {0}, version: {1}, id: {2} for inferencing".format(
-                    foundation_model.name, foundation_model.version, foundation_model.id
-                )
-            )
-        logger.info(
-            f"Latest model {foundation_model.name} version {foundation_model.version} created at {foundation_model.creation_context.created_at}")
-        #print(f"Model Config : {latest_model.config}")
-        return foundation_model
+        # the model was just registered, so the versions are listed without the cache, see model_version_resolver.py in tests/src
+        resolver = ModelVersionResolver(workspace_ml_client, workspace_ml_client.workspace_name, cache=False)
+        return resolver.resolve(model_name)
 
     def cloud_inference(self, scoring_file, scoring_input, online_endpoint_name, deployment_name):
         try:
@@ -100,35 +92,37 @@ class ModelInferenceAndDeployemnt:
 
     def create_model_package(self, latest_model, endpoint):
         logger.info("In create_model_package...")
+        model_package = endpoint_result = None
         try:
             model_configuration = ModelConfiguration(mode="download")
             # latest_model_name = self.get_model_name(
             #     latest_model_name=latest_model.name)
             logger.info(f"Registered model name is this : {latest_model.name}")
-            package_name = f"package-v2-{latest_model.name}"
-            package_config = ModelPackage(
+            # the package environment is named after the model name and version,
+            # a model version that was packaged before, for example by an earlier run, reuses its environment
+            package_cache = PackageEnvironmentCache(self.workspace_ml_client)
+            package_config = lambda package_name: ModelPackage(
                 target_environment_name=package_name,
                 inferencing_server=AzureMLOnlineInferencingServer(),
                 model_configuration=model_configuration
             )
-            model_package = self.workspace_ml_client.models.package(
-                latest_model.name,
-                latest_model.version,
-                package_config
+            # the package and the endpoint do not depend on each other, so the endpoint is created while the package is built
+            model_package, endpoint_result = run_together(
+                lambda: package_cache.package(latest_model, package_config),
+                lambda: self.workspace_ml_client.begin_create_or_update(endpoint).result()
             )
+            package_cache.report()
+            if isinstance(model_package, Exception):
+                raise model_package
         except Exception as e:
             _, _, exc_tb = sys.exc_info()
             logger.error(f"::error:: Could not create Model package: \n")
             logger.error(f"The exception occured at this line no : {exc_tb.tb_lineno}" +
                          f" the exception is this one :{e}")
-        try:
-            self.workspace_ml_client.begin_create_or_update(endpoint).result()
-        except Exception as e:
-            _, _, exc_tb = sys.exc_info()
+        if isinstance(endpoint_result, Exception):
             logger.error(f"::error:: Could not create endpoint: \n")
-            logger.error(f"The exception occured at this line no : {exc_tb.tb_lineno}" +
-                         f" the exception is this one : {e}")
-            self.prase_logs(str(e))
+            logger.error(f" the exception is this one : {endpoint_result}")
+            self.prase_logs(str(endpoint_result))
             exit(1)
         return model_package
 
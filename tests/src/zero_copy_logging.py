@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+import uuid
+import errno
+import fcntl
+import base64
+import shutil
+import threading
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+
+# registers a transformers model with mlflow without serialising it again
+# mlflow.transformers.log_model saves the whole pipeline to a temp dir before uploading it, which rewrites every weight
+# this lays out the mlflow model directory with hardlinks (or reflinks across file systems) to the files of the cached
+# snapshot, writes only MLmodel and the environment files, and logs the directory to the mlflow run as it is
+# upload_dir and LocalArtifactStore model a block upload of the directory for benchmark_artifact_logging.py only,
+# the register driver logs the directory with mlflow.log_artifacts
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_UPLOAD_WORKERS = 8
+# weight formats by preference, as (file name prefix, extension, index file). the pytorch pipeline is loaded from the
+# first format the snapshot has, and only that format is linked, so the artifact has the size log_model would write
+WEIGHT_FORMATS = [("model", ".safetensors", "model.safetensors.index.json"), ("pytorch_model", ".bin", "pytorch_model.bin.index.json")]
+MODEL_FILES = ["config.json", "generation_config.json"]
+# files tokenizer.save_pretrained writes besides the vocab files of the tokenizer class, see tokenizer_files
+TOKENIZER_FILES = ["tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "added_tokens.json", "chat_template.jinja"]
+# ioctl to clone a file on file systems with copy on write, such as btrfs and xfs
+FICLONE = 0x40049409
+
+
+# function to link a file of the snapshot into the model directory, returns how the file was placed
+# hardlinks need the same file system, reflinks are tried next and a copy is the last resort
+def link_file(source, target, stats):
+    size = os.path.getsize(source)
+    try:
+        os.link(source, target)
+        stats["linked_bytes"] = stats["linked_bytes"] + size
+        return "linked"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        stats["reflinked_bytes"] = stats["reflinked_bytes"] + size
+        return "reflinked"
+    except OSError:
+        shutil.copyfile(source, target)
+        stats["copied_bytes"] = stats["copied_bytes"] + size
+        return "copied"
+
+
+def write_metadata(path, content, stats):
+    with open(path, "w") as f:
+        f.write(content)
+    stats["metadata_bytes"] = stats["metadata_bytes"] + os.path.getsize(path)
+
+
+# function to get the weight files of the format the pipeline was loaded from, with its index file
+def weight_files(file_names):
+    for prefix, extension, index_file in WEIGHT_FORMATS:
+        files = [file_name for file_name in file_names if file_name.startswith(prefix) and file_name.endswith(extension)]
+        if files:
+            return files + ([index_file] if index_file in file_names else [])
+    return []
+
+
+# function to get the files save_pretrained writes for the tokenizer of a loaded pipeline
+def tokenizer_files(model_pipeline):
+    return TOKENIZER_FILES + list(getattr(model_pipeline.tokenizer, "vocab_files_names", {}).values())
+
+
+# function to lay out an mlflow transformers model directory from a snapshot, without writing any weights
+# flavor has the class names of the loaded pipeline: instance_type (pipeline), pipeline_model_type (model) and tokenizer_type
+# the model gets the config and one weight format, the tokenizer the files in tokenizer_names, see tokenizer_files.
+# other files of the snapshot, such as other weight formats, README or LICENSE, are not part of the artifact
+# signature is ModelSignature.to_dict(), returns the counts of bytes linked, reflinked, copied and written
+def layout_model_dir(snapshot_path, output_dir, task, model_id, flavor, signature=None, requirements=None, tokenizer_names=None):
+    stats = {"linked_bytes": 0, "reflinked_bytes": 0, "copied_bytes": 0, "metadata_bytes": 0}
+    model_dir = os.path.join(output_dir, "model")
+    tokenizer_dir = os.path.join(output_dir, "components", "tokenizer")
+    os.makedirs(model_dir)
+    os.makedirs(tokenizer_dir)
+    file_names = sorted(file_name for file_name in os.listdir(snapshot_path) if os.path.isfile(os.path.join(snapshot_path, file_name)))
+    model_files = set(weight_files(file_names) + MODEL_FILES)
+    tokenizer_names = set(tokenizer_names or TOKENIZER_FILES)
+    for file_name in file_names:
+        source = os.path.join(snapshot_path, file_name)
+        if file_name in model_files:
+            link_file(source, os.path.join(model_dir, file_name), stats)
+        elif file_name in tokenizer_names:
+            link_file(source, os.path.join(tokenizer_dir, file_name), stats)
+    requirements = requirements or ["mlflow", "transformers", "torch"]
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
+    mlmodel = {
+        "artifact_path": os.path.basename(os.path.normpath(output_dir)),
+        "flavors": {
+            "python_function": {
+                "env": {"conda": "conda.yaml", "virtualenv": "python_env.yaml"},
+                "loader_module": "mlflow.transformers",
+                "python_version": python_version,
+            },
+            "transformers": dict({
+                "code": None,
+                "components": ["tokenizer"],
+                "framework": "pt",
+                "model_binary": "model",
+                "source_model_name": model_id,
+                "task": task,
+            }, **flavor),
+        },
+        "model_uuid": uuid.uuid4().hex,
+        "utc_time_created": time.strftime("%Y-%m-%d %H:%M:%S.000000", time.gmtime()),
+    }
+    if signature is not None:
+        mlmodel["signature"] = signature
+    write_metadata(os.path.join(output_dir, "MLmodel"), yaml.safe_dump(mlmodel, default_flow_style=False), stats)
+    write_metadata(os.path.join(output_dir, "requirements.txt"), "\n".join(requirements) + "\n", stats)
+    write_metadata(os.path.join(output_dir, "conda.yaml"), yaml.safe_dump({
+        "channels": ["conda-forge"],
+        "dependencies": [f"python={python_version}", "pip", {"pip": requirements}],
+        "name": "mlflow-env",
+    }, default_flow_style=False), stats)
+    write_metadata(os.path.join(output_dir, "python_env.yaml"), yaml.safe_dump({
+        "python": python_version,
+        "build_dependencies": ["pip"],
+        "dependencies": ["-r requirements.txt"],
+    }, default_flow_style=False), stats)
+    return stats
+
+
+# file system stand-in of an azure blob container, with the same stage_block and commit_block_list calls as BlobClient
+class LocalArtifactStore:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.bytes_written = 0
+
+    def uri(self, blob_name):
+        return "file://" + os.path.abspath(os.path.join(self.root, blob_name))
+
+    def block_file(self, blob_name, block_id):
+        return os.path.join(self.root, ".blocks", blob_name, block_id)
+
+    def stage_block(self, blob_name, block_id, data):
+        block_file = self.block_file(blob_name, block_id)
+        os.makedirs(os.path.dirname(block_file), exist_ok=True)
+        with open(block_file, "wb") as f:
+            f.write(data)
+        with self.lock:
+            self.bytes_written = self.bytes_written + len(data)
+
+    def commit_block_list(self, blob_name, block_ids):
+        target = os.path.join(self.root, blob_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            for block_id in block_ids:
+                with open(self.block_file(blob_name, block_id), "rb") as block:
+                    shutil.copyfileobj(block, f)
+        shutil.rmtree(os.path.join(self.root, ".blocks", blob_name))
+
+
+# function to upload a directory to an artifact store under artifact_path, in blocks of chunk_size with max_workers transfers
+# the blocks of all files share one pool, so a directory with one large file is uploaded as fast as one with many
+# returns the number of bytes uploaded and the elapsed seconds
+def upload_dir(local_dir, store, artifact_path, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=DEFAULT_UPLOAD_WORKERS):
+    start = time.time()
+    files = []
+    for root, _, file_names in os.walk(local_dir):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            files.append((path, f"{artifact_path}/{os.path.relpath(path, local_dir).replace(os.sep, '/')}", os.path.getsize(path)))
+
+    def stage(path, blob_name, offset, block_id):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            store.stage_block(blob_name, block_id, f.read(chunk_size))
+
+    uploaded = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        block_lists = []
+        futures = []
+        for path, blob_name, size in files:
+            # block ids of a blob must have the same length, see the azure blob docs
+            block_ids = [base64.b64encode(f"{i:08d}".encode("utf-8")).decode("utf-8") for i in range(max(1, -(-size // chunk_size)))]
+            block_lists.append((blob_name, block_ids))
+            for i, block_id in enumerate(block_ids):
+                futures.append(executor.submit(stage, path, blob_name, i * chunk_size, block_id))
+            uploaded = uploaded + size
+        for future in futures:
+            future.result()
+        for future in [executor.submit(store.commit_block_list, blob_name, block_ids) for blob_name, block_ids in block_lists]:
+            future.result()
+    elapsed = time.time() - start
+    print (f"Uploaded {len(files)} files, {uploaded / 1024 / 1024:.1f} MB in {elapsed:.1f}s, {uploaded / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s")
+    return uploaded, elapsed
+
+
+# function to log and register a model laid out by layout_model_dir
+# the directory is logged to the active mlflow run with log_artifacts, which uploads the linked files as they are
+# without serialising the model. without an active run one is started for it, and ended once the model is registered
+def log_model_dir(model_dir, artifact_path, registered_model_name):
+    import mlflow
+    started = mlflow.active_run() is None
+    run = mlflow.active_run() or mlflow.start_run()
+    try:
+        mlflow.log_artifacts(model_dir, artifact_path)
+        return mlflow.register_model(f"runs:/{run.info.run_id}/{artifact_path}", registered_model_name)
+    finally:
+        if started:
+            mlflow.end_run()
+
+
+# function to describe the classes of a loaded pipeline for the transformers flavor of MLmodel
+def pipeline_flavor(model_pipeline):
+    import transformers
+    return {
+        "instance_type": type(model_pipeline).__name__,
+        "pipeline_model_type": type(model_pipeline.model).__name__,
+        "tokenizer_type": type(model_pipeline.tokenizer).__name__,
+        "transformers_version": transformers.__version__,
+    }